@@ -0,0 +1,605 @@
+"""Check that levels can be beaten by searching over the player's moves
+
+    python analyze.py                          # every level file, 200 seeds
+    python analyze.py levels/level_04.json --seeds 1000 --path
+    python analyze.py --json report.json
+
+A level file gives a different variant for each game seed: the coins and
+random spikes change, the platforms do not. For each variant the analyzer
+searches the places the player can stand, and the points it drops back
+in from after getting hurt, for the quickest way to the end of the level.
+Places are connected by short moves (walk a few steps, jump left or right
+holding the direction for a while, ...) simulated with the real Player
+physics. Moves only depend on the platforms, so they are simulated once
+per level file and shared by all its variants, which only check where the
+moves touch spikes, coins and enemies.
+
+Falling into lava or touching a spike or an enemy costs a life but is not
+the end, so a variant counts as beatable if its end can be reached without
+losing every life. Patrollers and jumpers move with the level tick alone,
+so the analyzer knows where they are at every point of a route. Chasers
+are treated as patrolling, as they do until the player comes close, and
+the report warns about levels with chasers. The report gives, per
+variant, the lives lost at best, the quickest time to the end, and how
+many coins can be picked up; over all level files it also counts the
+seeds where the levels hold too few coins to win before the endless
+level. Standing positions are rounded to STAND_STEP pixels.
+
+Variants are checked in parallel on all cores.
+"""
+
+import argparse
+import array
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame  # noqa: E402
+
+import enemies  # noqa: E402
+import levelfile  # noqa: E402
+from main import (  # noqa: E402
+    COYOTE_TICKS,
+    LEVEL_FILES,
+    PLAYER_SPEED,
+    TIMESTEP,
+    Level,
+    Player,
+)
+
+# Longest move simulated, in ticks
+MAX_TICKS = 150
+
+# Ticks a jump or fall holds its direction; None holds it until landing
+AIR_HOLDS = (10, 20, None)
+
+# Pixels standing places and drop-in points are rounded to
+STAND_STEP = 2 * PLAYER_SPEED
+DROP_STEP = 4 * PLAYER_SPEED
+
+# Screen x of the player's right edge the camera keeps it left of, and the
+# spawn point of the first level and of the others (see Simulation)
+SCROLL_RIGHT = 500
+FIRST_SPAWN_X = 240
+SPAWN_X = 120
+
+# Lives a game starts with; the first level costs one straight away, as
+# the player spawns touching the lava
+LIVES = Player().life
+
+# Coins needed to win
+WIN_SCORE = 6
+
+Move = collections.namedtuple("Move", ["jump", "direction", "hold"])
+Move.__doc__ = "Press jump or not, then hold a direction (-1, 0, 1) for hold ticks"
+
+# Moves from standing on a platform: a step to the next standing place,
+# walking off the edge, and jumps; and from falling in from the top
+STAND_MOVES = (
+    [Move(False, d, STAND_STEP // PLAYER_SPEED) for d in (-1, 1)]
+    + [Move(False, d, None) for d in (-1, 1)]
+    + [Move(True, 0, 0)]
+    + [Move(True, d, hold) for d in (-1, 1) for hold in AIR_HOLDS]
+)
+DROP_MOVES = [Move(False, 0, 0)] + [
+    Move(False, d, hold) for d in (-1, 1) for hold in AIR_HOLDS
+]
+
+Edge = collections.namedtuple(
+    "Edge", ["move", "target", "ticks", "lives", "points", "bounds"]
+)
+Edge.__doc__ = """Result of a move
+
+target is a place (platform slot, x), with a slot of None for dropping in
+from the top after getting hurt, or EXIT. points holds the player's x and
+y after each tick, bounds the area they cover.
+"""
+
+EXIT = "exit"
+
+Result = collections.namedtuple(
+    "Result",
+    [
+        "path",
+        "seed",
+        "beatable",
+        "lives",
+        "ticks",
+        "coins",
+        "reachable_coins",
+        "route",
+    ],
+)
+Result.__doc__ = """Analysis of one level variant
+
+lives is the fewest lives lost on the way to the end and ticks the
+quickest time to it (with up to all but one life lost), both None when
+the end cannot be reached. route lists the moves of the quickest way as
+(place, move) pairs.
+"""
+
+
+def exit_x(level_limit):
+    """Player x past which a player running right finishes the level
+
+    Simulation.step() ends a level once the player's screen x minus the
+    camera offset is below level_limit; running right, the camera keeps
+    the player's right edge at SCROLL_RIGHT.
+    """
+    return 2 * (SCROLL_RIGHT - Player().rect.width) - level_limit
+
+
+def snap(x, step):
+    """Round an x position to a multiple of step"""
+    return round(x / step) * step
+
+
+class LevelGraph:
+    """Moves between places in a level layout, simulated as needed"""
+
+    def __init__(self, path):
+        """Initialize graph for a level file's platforms"""
+        self.path = path
+        data = levelfile.load(path)
+        self.player = Player()
+        self.level = Level(self.player)
+        self.player.level = self.level
+        for width, height, x, y in levelfile.rows(data.platforms, 4):
+            self.level.platform_list.add(x, y, width, height)
+        self.exit_x = exit_x(data.level_limit)
+        # Nothing is gained left of every platform and the spawn points, and
+        # the world goes on forever that way
+        lefts = list(data.platforms[2::4]) + [SPAWN_X]
+        self.left_x = min(lefts) - 4 * DROP_STEP
+
+        # Place -> list of Edges
+        self.edges = {}
+
+    def __getstate__(self):
+        """Pickle only the moves; the level is rebuilt from the file"""
+        return self.path, self.edges
+
+    def __setstate__(self, state):
+        path, edges = state
+        self.__init__(path)
+        self.edges = edges
+
+    def moves(self, place):
+        """Edges out of a place, simulating them the first time"""
+        edges = self.edges.get(place)
+        if edges is None:
+            moves = DROP_MOVES if place[0] is None else STAND_MOVES
+            edges = [self.simulate(place, move) for move in moves]
+            self.edges[place] = edges
+        return edges
+
+    def explore(self):
+        """Simulate the moves from every place the player can get to
+
+        Afterwards moves() never simulates, and the graph can be handed to
+        other processes whole.
+        """
+        platforms = self.level.platform_list
+        width = self.player.rect.width
+        pending = set()
+        for slot in platforms.live_slots():
+            left = platforms.left[slot] - width + 1
+            right = platforms.left[slot] + platforms.width[slot] - 1
+            for x in range(left, right + 1):
+                pending.add((slot, min(max(snap(x, STAND_STEP), left), right)))
+        first = snap(self.left_x, DROP_STEP) + DROP_STEP
+        for x in range(first, self.exit_x + DROP_STEP, DROP_STEP):
+            pending.add((None, x))
+
+        pending = sorted(pending, key=repr)
+        seen = set(pending)
+        while pending:
+            for edge in self.moves(pending.pop()):
+                target = edge.target
+                if target is not None and target != EXIT and target not in seen:
+                    seen.add(target)
+                    pending.append(target)
+        return self
+
+    def simulate(self, place, move):
+        """Play a move from a place and see where it ends"""
+        player = self.player
+        platforms = self.level.platform_list
+        slot, x = place
+
+        player.rect.x = x
+        player.change_x = 0
+        player.change_y = 0
+        player.jump_buffer = 0
+        if slot is None:
+            player.rect.y = 0
+            player.air_ticks = COYOTE_TICKS + 1
+        else:
+            player.rect.bottom = platforms.top[slot]
+            player.air_ticks = 0
+        player.life = LIVES
+        player.events.clear()
+        if move.jump:
+            player.jump()
+
+        points = array.array("i")
+        target = None
+        lives = 0
+        airborne = False
+        for tick in range(MAX_TICKS):
+            if move.hold is None or tick < move.hold:
+                if move.direction < 0:
+                    player.go_left()
+                elif move.direction > 0:
+                    player.go_right()
+                else:
+                    player.stop()
+            else:
+                player.stop()
+            player.update()
+
+            if player.life < LIVES:
+                # Fell in the lava and drops back in from the top
+                target = (None, snap(player.rect.x, DROP_STEP))
+                lives = 1
+                break
+            points.append(player.rect.x)
+            points.append(player.rect.y)
+            if player.rect.x > self.exit_x:
+                target = EXIT
+                break
+
+            if player.air_ticks:
+                airborne = True
+            elif airborne or (move.hold is not None and tick >= move.hold - 1):
+                target = self.landing()
+                break
+
+        ticks = len(points) // 2 + lives
+        if target is None or target == place or not points:
+            return Edge(move, None, ticks, lives, points, None)
+        if target != EXIT and target[1] < self.left_x:
+            return Edge(move, None, ticks, lives, points, None)
+
+        xs = points[::2]
+        ys = points[1::2]
+        size = player.rect.size
+        bounds = pygame.Rect(min(xs), min(ys), 0, 0)
+        bounds.width = max(xs) - bounds.x + size[0]
+        bounds.height = max(ys) - bounds.y + size[1]
+        return Edge(move, target, ticks, lives, points, bounds)
+
+    def landing(self):
+        """Place of the player standing where it is now"""
+        rect = self.player.rect
+        slots = self.level.platform_list.collide_slots(rect.move(0, 1))
+        if not slots:
+            # On the ground, which is lava, so this never happens in play
+            return None
+        slot = slots[0]
+        platforms = self.level.platform_list
+        left = platforms.left[slot] - rect.width + 1
+        right = platforms.left[slot] + platforms.width[slot] - 1
+        return (slot, min(max(snap(rect.x, STAND_STEP), left), right))
+
+
+def enemy_rect(enemy, tick):
+    """Where an enemy that starts the level at rest is at a level tick
+
+    Chasers are placed as if they never saw the player.
+    """
+    enemy.offset = enemy.phase = enemy.tick = 0
+    enemy.update(tick)
+    return enemy.rect
+
+
+def follow(edge, spikes, coins, size, hazards=(), start=0):
+    """Where an edge really ends given a variant's spikes, coins and enemies
+
+    hazards are the enemies whose territory the edge passes through, and
+    start the level tick the edge starts at. Each spike or enemy touched
+    costs a life, as in Level.update(). Returns (target, ticks, lives,
+    indexes of coins picked up).
+    """
+    if (
+        not hazards
+        and edge.bounds.collidelist(spikes) < 0
+        and edge.bounds.collidelist(coins) < 0
+    ):
+        return edge.target, edge.ticks, edge.lives, ()
+
+    rect = pygame.Rect((0, 0), size)
+    taken = []
+    points = edge.points
+    for i in range(0, len(points), 2):
+        rect.x = points[i]
+        rect.y = points[i + 1]
+        for index in rect.collidelistall(coins):
+            if index not in taken:
+                taken.append(index)
+        # Point i // 2 is where the player is after the edge's tick i // 2 + 1
+        tick = start + i // 2 + 1
+        hits = len(rect.collidelistall(spikes)) + sum(
+            rect.colliderect(enemy_rect(enemy, tick)) for enemy in hazards
+        )
+        if hits:
+            # Hurt, and drop back in from the top
+            return (None, snap(rect.x, DROP_STEP)), i // 2 + 1, hits, taken
+    return edge.target, edge.ticks, edge.lives, taken
+
+
+def search(graph, start, spent, spikes, coins, enemy_list=(), clock=0):
+    """Quickest ways through a variant for each number of lives lost
+
+    clock is the level tick at the start. Enemies make moves depend on
+    when they are made, and a place is still only searched from the
+    earliest time it is reached with some number of lives lost, so routes
+    that wait for an enemy to pass can be missed, but every route found
+    is safe. Returns ({lives lost: (ticks, route)} for reaching the end,
+    set of coin indexes that can be picked up).
+    """
+    size = graph.player.rect.size
+    budget = LIVES - 1
+    best = {(start, spent): 0}
+    parents = {}
+    # Entries are (ticks, lives lost, insertion count, place)
+    counter = itertools.count(1)
+    heap = [(0, spent, 0, start)]
+    finishes = {}
+    reachable = set()
+    # Place -> fewest lives lost of the labels taken off the heap there;
+    # any later label there took as long or longer, so it only matters
+    # if it lost fewer lives
+    settled = {}
+    # id of an Edge -> follow() result, as edges are taken with different
+    # numbers of lives lost, for edges that pass no enemies
+    followed = {}
+    # id of an Edge -> enemies whose territory it passes through
+    nearby = {}
+
+    while heap:
+        ticks, lives, _, place = heapq.heappop(heap)
+        if settled.get(place, budget + 1) <= lives:
+            continue
+        settled[place] = lives
+        if place == EXIT:
+            if lives not in finishes:
+                finishes[lives] = ticks
+            continue
+
+        for edge in graph.moves(place):
+            if edge.target is None:
+                continue
+            hazards = nearby.get(id(edge))
+            if hazards is None:
+                hazards = nearby[id(edge)] = [
+                    enemy
+                    for enemy in enemy_list
+                    if edge.bounds.colliderect(enemy.territory)
+                ]
+            if hazards:
+                # Where the enemies are depends on when the edge is taken
+                result = follow(edge, spikes, coins, size, hazards, clock + ticks)
+            else:
+                result = followed.get(id(edge))
+                if result is None:
+                    result = followed[id(edge)] = follow(edge, spikes, coins, size)
+            target, cost, lost, taken = result
+            total = lives + lost
+            if total > budget:
+                continue
+            reachable.update(taken)
+            key = (target, total)
+            arrival = ticks + cost
+            if arrival < best.get(key, arrival + 1):
+                best[key] = arrival
+                parents[key] = ((place, lives), edge.move)
+                heapq.heappush(heap, (arrival, total, next(counter), target))
+
+    routes = {}
+    for lives, ticks in finishes.items():
+        route = []
+        key = (EXIT, lives)
+        while key in parents:
+            key, move = parents[key]
+            route.append((key[0], move))
+        routes[lives] = (ticks, route[::-1])
+    return routes, reachable
+
+
+# Graphs built by or handed to this process, by level file
+_graphs = {}
+
+
+def _build(path):
+    """Explore a level file's graph, in a worker process"""
+    return LevelGraph(path).explore()
+
+
+def _share(graphs):
+    """Use graphs built elsewhere, in a worker process"""
+    _graphs.update(graphs)
+
+
+def analyze(path, level_no, seeds):
+    """Analyze a level file's variants for some seeds"""
+    graph = _graphs.get(path)
+    if graph is None:
+        graph = _graphs[path] = LevelGraph(path)
+
+    results = []
+    for seed in seeds:
+        # Built the same way as LevelLoader.build() builds it in a game
+        variant = Level.from_file(
+            path, graph.player, random.Random(f"{seed}:{level_no}")
+        )
+        spikes = [spike.rect for spike in variant.spike_list]
+        coins = [coin.rect for coin in variant.coin_list]
+        enemy_list = list(variant.enemy_list)
+
+        if level_no == 0:
+            # Hurt by the lava on the first tick
+            start, spent, clock = (None, FIRST_SPAWN_X), 1, 1
+        else:
+            # The player comes in where it left the last level; assume it
+            # falls in from the top
+            start, spent, clock = (None, SPAWN_X), 0, 0
+
+        routes, reachable = search(
+            graph, start, spent, spikes, coins, enemy_list, clock
+        )
+        if routes:
+            fewest = min(routes)
+            ticks, route = min(routes.values(), key=lambda found: found[0])
+            results.append(
+                Result(
+                    path, seed, True, fewest, ticks, len(coins), len(reachable), route
+                )
+            )
+        else:
+            results.append(
+                Result(path, seed, False, None, None, len(coins), len(reachable), [])
+            )
+    return results
+
+
+def describe(place, move):
+    """One line of a route"""
+    slot, x = place
+    where = f"from top at x={x}" if slot is None else f"platform {slot} x={x}"
+    if move.direction == 0:
+        action = "jump" if move.jump else "drop"
+    else:
+        side = "right" if move.direction > 0 else "left"
+        held = "until landing" if move.hold is None else f"{move.hold} ticks"
+        action = f"{'jump' if move.jump else 'move'} {side}, held {held}"
+    return f"{where:>26}: {action}"
+
+
+def report(results, files, show_path):
+    """Print a summary per level file and over the seeds"""
+    unbeatable = 0
+    for path in files:
+        rows = [result for result in results if result.path == path]
+        beaten = [result for result in rows if result.beatable]
+        unbeatable += len(rows) - len(beaten)
+
+        print(f"{os.path.basename(path)}: {len(beaten)}/{len(rows)} variants beatable")
+        kinds = levelfile.load(path).enemies[1::2]
+        if enemies.KIND_NAMES.index(enemies.Chaser.kind) in kinds:
+            print(
+                "  warning: chasers are treated as patrolling, results are optimistic"
+            )
+        if beaten:
+            ticks = [result.ticks for result in beaten]
+            lives = [result.lives for result in beaten]
+            print(
+                f"  quickest {min(ticks) * TIMESTEP:.2f}s, median "
+                f"{statistics.median(ticks) * TIMESTEP:.2f}s, "
+                f"slowest {max(ticks) * TIMESTEP:.2f}s"
+            )
+            print(f"  lives lost at best: {min(lives)} to {max(lives)}")
+        print(
+            f"  coins: {min(result.coins for result in rows)} to "
+            f"{max(result.coins for result in rows)} placed, at least "
+            f"{min(result.reachable_coins for result in rows)} reachable"
+        )
+        for result in rows:
+            if not result.beatable:
+                print(f"  UNBEATABLE: seed {result.seed}")
+
+        if show_path and beaten:
+            quickest = min(beaten, key=lambda result: result.ticks)
+            print(f"  quickest route (seed {quickest.seed}, {quickest.ticks} ticks):")
+            for place, move in quickest.route:
+                print("    " + describe(place, move))
+
+    # Coins from every level file under the same game seed
+    if len(files) == len(LEVEL_FILES):
+        totals = collections.Counter()
+        for result in results:
+            totals[result.seed] += result.reachable_coins
+        short = sorted(seed for seed, total in totals.items() if total < WIN_SCORE)
+        print(
+            f"{len(short)}/{len(totals)} seeds have fewer than {WIN_SCORE} "
+            "reachable coins before the endless level"
+        )
+    return unbeatable
+
+
+def run_analyzer(argv=None):
+    """Analyze level files from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "files", nargs="*", help="level files (default: all of them in play order)"
+    )
+    parser.add_argument(
+        "--seeds", type=int, default=200, help="variants per level (%(default)s)"
+    )
+    parser.add_argument("--first-seed", type=int, default=0, help="first game seed")
+    parser.add_argument("--workers", type=int, help="processes (default: all cores)")
+    parser.add_argument("--path", action="store_true", help="print quickest routes")
+    parser.add_argument("--json", metavar="FILE", help="also write results to FILE")
+    args = parser.parse_args(argv)
+
+    files = [os.path.abspath(path) for path in args.files] or LEVEL_FILES
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+
+    # Split each file's seeds into batches so all cores stay busy, with
+    # enough seeds per batch to reuse the moves each process simulates
+    workers = args.workers or os.cpu_count() or 1
+    per_batch = max(1, min(50, len(files) * len(seeds) // (workers * 4) or 1))
+    # Simulate each layout's moves once, then share them with every worker
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        graphs = dict(zip(files, executor.map(_build, files)))
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_share, initargs=(graphs,)
+    ) as executor:
+        futures = []
+        for path in files:
+            level_no = LEVEL_FILES.index(path) if path in LEVEL_FILES else 0
+            for first in range(0, len(seeds), per_batch):
+                batch = list(seeds[first : first + per_batch])
+                futures.append(executor.submit(analyze, path, level_no, batch))
+        for future in futures:
+            results.extend(future.result())
+
+    unbeatable = report(results, files, args.path)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                [
+                    {
+                        "file": os.path.basename(result.path),
+                        "seed": result.seed,
+                        "beatable": result.beatable,
+                        "lives_lost": result.lives,
+                        "ticks": result.ticks,
+                        "coins": result.coins,
+                        "reachable_coins": result.reachable_coins,
+                        "route": [
+                            {"from": list(place), **move._asdict()}
+                            for place, move in result.route
+                        ],
+                    }
+                    for result in results
+                ],
+                f,
+                indent=2,
+            )
+    return 1 if unbeatable else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_analyzer())
@@ -0,0 +1,188 @@
+"""Asset loading on a worker thread with a shared cache
+
+Paths are resolved relative to the assets directory next to this file,
+not the current directory. Loads run on a background thread and return
+futures, so the main loop can keep drawing (e.g. a loading screen) while
+files are decoded.
+
+Loaded assets are cached and shared. Each acquire() holds a reference;
+assets nobody holds are kept for reuse until more than `capacity` of them
+pile up, then the least recently used ones are dropped.
+
+A process forked from one that has loaded anything (e.g. the workers of
+env.ParallelEnvs) inherits the cache but not the loading thread, so the
+shared ASSETS starts a new thread in the child and forgets loads that
+were still running.
+"""
+
+import collections
+import concurrent.futures
+import io
+import os
+import threading
+
+import pygame
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+
+# Unreferenced assets kept around for reuse
+CAPACITY = 16
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
+MUSIC_EXTENSIONS = {".mp3", ".ogg", ".mod", ".xm"}
+
+
+def asset_path(name):
+    """Absolute path of a file in the assets directory"""
+    return os.path.join(ASSET_DIR, name)
+
+
+def _load_image(path):
+    """Decode an image, converted to the display format if there is one"""
+    image = pygame.image.load(path)
+    if pygame.display.get_surface() is not None:
+        if image.get_alpha() is None and not image.get_colorkey():
+            image = image.convert()
+        else:
+            image = image.convert_alpha()
+    return image
+
+
+def _load_sound(path):
+    """Decode a short sound effect into memory"""
+    return pygame.mixer.Sound(path)
+
+
+def _load_music(path):
+    """Read a music file into memory
+
+    Music is streamed by the mixer as it plays, so only the file read is
+    done up front.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
+LOADERS = {"image": _load_image, "sound": _load_sound, "music": _load_music}
+
+
+def kind_of(name):
+    """Guess how to load an asset from its file extension"""
+    extension = os.path.splitext(name)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return "image"
+    if extension in MUSIC_EXTENSIONS:
+        return "music"
+    return "sound"
+
+
+class AssetManager:
+    """Loads assets in the background and shares them between users"""
+
+    def __init__(self, capacity=CAPACITY):
+        """Initialize asset manager"""
+        self.capacity = capacity
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="assets"
+        )
+        self.lock = threading.Lock()
+
+        # (kind, name) -> Future of the loaded asset
+        self.futures = {}
+        # (kind, name) -> number of holders
+        self.references = collections.Counter()
+        # Loaded assets nobody holds, least recently used first
+        self.unused = collections.OrderedDict()
+
+    def load(self, name, kind=None, callback=None):
+        """Start loading an asset if needed and return its future
+
+        The asset is not referenced by this; use acquire() to hold it.
+        callback, if given, is called with the future once it is done.
+        """
+        key = (kind or kind_of(name), name)
+        with self.lock:
+            future = self.futures.get(key)
+            if future is None:
+                future = self.executor.submit(LOADERS[key[0]], asset_path(name))
+                self.futures[key] = future
+                self.unused[key] = None
+                self._evict()
+            elif key in self.unused:
+                self.unused.move_to_end(key)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def preload(self, names, progress=None):
+        """Start loading several assets, returning their futures
+
+        progress, if given, is called with (loaded, total) each time one of
+        them finishes, from the loading thread.
+        """
+        total = len(names)
+        loaded = [0]
+        lock = threading.Lock()
+
+        def done(future):
+            with lock:
+                loaded[0] += 1
+                count = loaded[0]
+            progress(count, total)
+
+        return [self.load(name, callback=done if progress else None) for name in names]
+
+    def acquire(self, name, kind=None):
+        """Get an asset, waiting for it to load, and hold a reference to it"""
+        key = (kind or kind_of(name), name)
+        future = self.load(name, kind)
+        with self.lock:
+            self.references[key] += 1
+            self.unused.pop(key, None)
+        return future.result()
+
+    def release(self, name, kind=None):
+        """Drop a reference taken with acquire()"""
+        key = (kind or kind_of(name), name)
+        with self.lock:
+            self.references[key] -= 1
+            if self.references[key] <= 0:
+                del self.references[key]
+                self.unused[key] = None
+                self._evict()
+
+    def image(self, name):
+        """Acquire an image; the surface is shared and must not be drawn on"""
+        return self.acquire(name, "image")
+
+    def sound(self, name):
+        """Acquire a sound effect"""
+        return self.acquire(name, "sound")
+
+    def music(self, name):
+        """Acquire a music file as a file object for pygame.mixer.music.load()"""
+        return io.BytesIO(self.acquire(name, "music"))
+
+    def _after_fork(self):
+        """Start over with a new loading thread in a forked child process"""
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="assets"
+        )
+        # The parent's lock may have been held by its loading thread
+        self.lock = threading.Lock()
+        for key, future in list(self.futures.items()):
+            if not future.done():
+                del self.futures[key]
+                self.unused.pop(key, None)
+
+    def _evict(self):
+        """Drop unreferenced assets beyond capacity; lock must be held"""
+        while len(self.unused) > self.capacity:
+            key, _ = self.unused.popitem(last=False)
+            self.futures.pop(key, None)
+
+
+# Shared by the whole game
+ASSETS = AssetManager()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=ASSETS._after_fork)
@@ -0,0 +1,228 @@
+"""Sound effects from a fixed channel pool, and music with fades
+
+Effects are synthesized into pygame.mixer.Sound buffers once when the
+AudioEngine is created, and each plays on one of a fixed set of reserved
+channels. Playing an effect only looks up its buffer and picks a channel;
+when every channel is busy, the oldest sound of the same or lower
+priority is cut off to make room ("voice stealing").
+
+Music is streamed by pygame.mixer.music from files read into memory
+when the engine is created. Changing tracks fades the old one out and
+the new one in.
+"""
+
+import array
+import io
+import math
+import os
+import random
+
+import pygame
+
+from assets import ASSETS
+
+# Channels reserved for effects
+CHANNELS = 8
+
+EFFECT_VOLUME = 0.5
+MUSIC_VOLUME = 0.1
+
+# Default track, and tracks for particular levels
+MUSIC = "bg-music.mp3"
+LEVEL_MUSIC = {}
+
+# Milliseconds to fade music out and in
+FADE_MS = 800
+
+# name -> (priority, synthesizer); higher priorities can cut off lower ones
+EFFECTS = {}
+
+# Format codes of array.array for the mixer's sample sizes
+SAMPLE_TYPES = {8: "B", -8: "b", 16: "H", -16: "h", 32: "f"}
+
+
+def _effect(name, priority):
+    """Register a function returning an effect's samples as floats"""
+
+    def register(synthesize):
+        EFFECTS[name] = (priority, synthesize)
+        return synthesize
+
+    return register
+
+
+def _tone(start, end, seconds, rate, shape=math.sin):
+    """Samples of a tone sliding from start to end Hz and fading out"""
+    count = int(seconds * rate)
+    phase = 0.0
+    samples = []
+    for i in range(count):
+        t = i / count
+        phase += 2 * math.pi * (start + (end - start) * t) / rate
+        samples.append(shape(phase) * (1 - t))
+    return samples
+
+
+def _square(phase):
+    """Square wave, for a retro sound"""
+    return 0.6 if math.sin(phase) >= 0 else -0.6
+
+
+@_effect("jump", priority=0)
+def _jump(rate):
+    return _tone(300, 620, 0.12, rate, _square)
+
+
+@_effect("coin", priority=1)
+def _coin(rate):
+    return _tone(988, 988, 0.07, rate, _square) + _tone(1319, 1319, 0.2, rate, _square)
+
+
+@_effect("spike", priority=2)
+def _spike(rate):
+    # Noise over a low thud, always the same noise
+    rng = random.Random(0)
+    thud = _tone(160, 60, 0.25, rate)
+    return [
+        0.6 * sample + 0.4 * rng.uniform(-1, 1) * (1 - i / len(thud))
+        for i, sample in enumerate(thud)
+    ]
+
+
+@_effect("lava", priority=2)
+def _lava(rate):
+    return _tone(420, 70, 0.5, rate, _square)
+
+
+@_effect("enemy", priority=2)
+def _enemy(rate):
+    return _tone(220, 110, 0.2, rate, _square)
+
+
+def make_sound(samples):
+    """Sound buffer in the mixer's format from samples between -1 and 1"""
+    rate, size, channels = pygame.mixer.get_init()
+    if size == 32:
+        values = samples
+    else:
+        bits = abs(size)
+        scale = 2 ** (bits - 1) - 1
+        offset = 0 if size < 0 else 2 ** (bits - 1)
+        values = [int(sample * scale + offset) for sample in samples]
+
+    # The same value on every channel of a frame
+    data = array.array(SAMPLE_TYPES[size])
+    for value in values:
+        data.extend([value] * channels)
+    return pygame.mixer.Sound(buffer=data)
+
+
+class AudioEngine:
+    """Plays the effects and music for a running simulation
+
+    Call update() after each simulation tick; it plays the sounds for the
+    player's events of that tick and keeps the music matching the level.
+    """
+
+    def __init__(self, channels=CHANNELS, tracks=LEVEL_MUSIC, music=MUSIC):
+        """Initialize audio, synthesizing every effect; needs pygame.mixer"""
+        rate = pygame.mixer.get_init()[0]
+        self.sounds = {}
+        self.priorities = {}
+        for name, (priority, synthesize) in EFFECTS.items():
+            sound = make_sound(synthesize(rate))
+            sound.set_volume(EFFECT_VOLUME)
+            self.sounds[name] = sound
+            self.priorities[name] = priority
+
+        # Keep the effect channels for ourselves
+        if pygame.mixer.get_num_channels() < channels:
+            pygame.mixer.set_num_channels(channels)
+        pygame.mixer.set_reserved(channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(channels)]
+        # Priority and start count of the sound last played on each channel
+        self.playing = [0] * channels
+        self.started = [0] * channels
+        self.count = 0
+
+        self.tracks = tracks
+        self.default_track = music
+        # Track playing or fading in, and one waiting for a fade out to end
+        self.track = None
+        self.next_track = None
+        # Every track's file, read into memory up front and held
+        self.music = {
+            name: ASSETS.acquire(name, "music")
+            for name in sorted({music, *tracks.values()})
+        }
+
+    def play(self, name):
+        """Play an effect, cutting off an older one if all channels are busy
+
+        Returns False if every channel is playing something more important.
+        """
+        sound = self.sounds[name]
+        priority = self.priorities[name]
+        channels = self.channels
+        playing = self.playing
+        started = self.started
+
+        chosen = -1
+        for i in range(len(channels)):
+            if not channels[i].get_busy():
+                chosen = i
+                break
+            # Steal the oldest sound not more important than this one
+            if playing[i] <= priority and (chosen < 0 or started[i] < started[chosen]):
+                chosen = i
+        if chosen < 0:
+            return False
+
+        self.count += 1
+        playing[chosen] = priority
+        started[chosen] = self.count
+        channels[chosen].play(sound)
+        return True
+
+    def play_music(self, name):
+        """Switch to a music track, fading the current one out first"""
+        if name == (self.next_track or self.track):
+            return
+        if pygame.mixer.music.get_busy():
+            # Starting a track while another fades out would wait for the
+            # fade, so start it from update() once the fade is over
+            self.next_track = name
+            pygame.mixer.music.fadeout(FADE_MS)
+        else:
+            self._start(name)
+
+    def stop_music(self):
+        """Fade the music out"""
+        pygame.mixer.music.fadeout(FADE_MS)
+        self.track = self.next_track = None
+
+    def _start(self, name):
+        """Start a track fading in"""
+        extension = os.path.splitext(name)[1][1:]
+        pygame.mixer.music.load(io.BytesIO(self.music[name]), extension)
+        pygame.mixer.music.set_volume(MUSIC_VOLUME)
+        pygame.mixer.music.play(-1, fade_ms=FADE_MS)
+        self.track = name
+        self.next_track = None
+
+    def update(self, simulation):
+        """Play what happened in the simulation's last tick"""
+        for event in simulation.player.events:
+            self.play(event)
+
+        if simulation.finished:
+            if self.track is not None:
+                self.stop_music()
+        else:
+            self.play_music(
+                self.tracks.get(simulation.current_level_no, self.default_track)
+            )
+
+        # Start the next track once the old one has faded out
+        if self.next_track is not None and not pygame.mixer.music.get_busy():
+            self._start(self.next_track)
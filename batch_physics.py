@@ -0,0 +1,213 @@
+"""Vectorized physics for many players in one level
+
+BodyBatch keeps the position, velocity, life and score of N player-sized
+bodies in NumPy arrays and advances all of them at once with the same
+rules as Player.update() and Level.update(): gravity, ground clamping,
+swept platform collisions per axis, lava, spikes and coins. Each body
+collects coins independently, as if it had its own copy of the level.
+
+Bodies live in the level's world coordinates and never scroll to another
+level. Enemies are left out, so where a Player would be hurt by an enemy
+a body is not, and bodies only match Player in levels without enemies.
+This is meant for bots and ghost players in bulk, for AI training and
+load testing.
+"""
+
+import numpy as np
+
+from main import (
+    COYOTE_TICKS,
+    GRAVITY,
+    JUMP_BUFFER_TICKS,
+    JUMP_SPEED,
+    PLAYER_SPEED,
+    SCREEN_HEIGHT,
+)
+
+
+def _rects(group):
+    """Left, top, right and bottom of a group's entities as int arrays
+
+    Copied straight out of the EntityGroup's arrays, in the order the
+    entities were added.
+    """
+    slots = np.array(group.live_slots(), dtype=np.int64)
+    left = np.frombuffer(group.left, dtype=np.int32)[slots].astype(np.int64)
+    top = np.frombuffer(group.top, dtype=np.int32)[slots].astype(np.int64)
+    right = left + np.frombuffer(group.width, dtype=np.int32)[slots]
+    bottom = top + np.frombuffer(group.height, dtype=np.int32)[slots]
+    return left, top, right, bottom
+
+
+def _round(values):
+    """spatial.rect_round() for a whole array"""
+    return (np.sign(values) * np.floor(np.abs(values) + 0.5)).astype(np.int64)
+
+
+class BodyBatch:
+    """Positions and velocities of many bodies advanced together"""
+
+    def __init__(self, level, count, x=240, width=40, height=40, life=6):
+        """Initialize batch, with every body at the spawn point"""
+        self.count = count
+        self.width = width
+        self.height = height
+
+        self.x = np.full(count, x, dtype=np.int64)
+        self.y = np.full(count, SCREEN_HEIGHT - height, dtype=np.int64)
+        self.change_x = np.zeros(count, dtype=np.int64)
+        self.change_y = np.zeros(count, dtype=np.float64)
+        self.life = np.full(count, life, dtype=np.int64)
+        self.score = np.zeros(count, dtype=np.int64)
+        self.jump_buffer = np.zeros(count, dtype=np.int64)
+        self.air_ticks = np.zeros(count, dtype=np.int64)
+
+        # Level geometry, in the order the level's groups iterate
+        self.platforms = _rects(level.platform_list)
+        self.spikes = _rects(level.spike_list)
+        self.coins = _rects(level.coin_list)
+        self.lava_top = level.lava.rect.top
+
+        # Which coins each body has picked up
+        self.collected = np.zeros((count, len(self.coins[0])), dtype=bool)
+
+    @property
+    def done(self):
+        """Bodies that have lost or won, which no longer move"""
+        return (self.life <= 0) | (self.score >= 6)
+
+    def _overlaps(self, rects, x, y):
+        """(bodies, rects) matrix of which body overlaps which rect"""
+        left, top, right, bottom = rects
+        return (
+            (x[:, None] < right)
+            & (x[:, None] + self.width > left)
+            & (y[:, None] < bottom)
+            & (y[:, None] + self.height > top)
+        )
+
+    @staticmethod
+    def _sweep(distance, start, end, low, high, cross):
+        """Distance each body can move along one axis before a platform
+
+        start and end are the bodies' edges on that axis (e.g. left and
+        right), low and high the platforms' edges, and cross a (bodies,
+        platforms) mask of overlap on the other axis. Mirrors
+        Player.sweep_x() and Player.sweep_y().
+        """
+        if len(low) == 0:
+            return distance
+        d = distance[:, None]
+        forward = low[None, :] - end[:, None]
+        backward = start[:, None] - high[None, :]
+        ahead = cross & (d > 0) & (forward >= 0) & (forward < d)
+        behind = cross & (d < 0) & (backward >= 0) & (backward < -d)
+        nearest_ahead = np.where(ahead, forward, d).min(axis=1)
+        nearest_behind = np.where(behind, -backward, d).max(axis=1)
+        return np.where(distance > 0, nearest_ahead, nearest_behind)
+
+    @staticmethod
+    def _last_hit(hits):
+        """Index of the last rect each body overlaps, and whether it hit any"""
+        any_hit = hits.any(axis=1)
+        last = hits.shape[1] - 1 - np.argmax(hits[:, ::-1], axis=1)
+        return last, any_hit
+
+    def step(self, move, jump):
+        """Advance every body one tick
+
+        move is an array of -1, 0 or 1 per body and jump a bool array of
+        jump presses, like the fields of main.Inputs.
+        """
+        active = ~self.done
+        move = np.asarray(move)
+        jump = np.asarray(jump, dtype=bool) & active
+
+        self.change_x = np.where(active, move * PLAYER_SPEED, self.change_x)
+
+        x = self.x
+        y = self.y
+        change_y = self.change_y
+        air_ticks = self.air_ticks
+
+        # Jump when standing on a platform or the ground, or just after
+        # leaving one, if jump was pressed in the last few ticks
+        jump_buffer = np.where(jump, JUMP_BUFFER_TICKS, self.jump_buffer)
+        trying = (jump_buffer > 0) & active
+        if trying.any():
+            jump_buffer = np.where(trying, jump_buffer - 1, jump_buffer)
+            on_platform = self._overlaps(self.platforms, x, y + 2).any(1)
+            on_ground = y + self.height >= SCREEN_HEIGHT
+            jumping = trying & ((air_ticks <= COYOTE_TICKS) | on_platform | on_ground)
+            change_y = np.where(jumping, JUMP_SPEED, change_y)
+            jump_buffer = np.where(jumping, 0, jump_buffer)
+            air_ticks = np.where(jumping, COYOTE_TICKS + 1, air_ticks)
+
+        # Gravity
+        change_y = np.where(change_y == 0, 1.0, change_y + GRAVITY)
+        ground = SCREEN_HEIGHT - self.height
+        grounded = (y >= ground) & (change_y >= 0)
+        change_y = np.where(grounded, 0.0, change_y)
+        y = np.where(grounded, ground, y)
+
+        # Move left/right, stopping at the first platform in the way
+        left, top, right, bottom = self.platforms
+        beside = (y[:, None] < bottom) & (y[:, None] + self.height > top)
+        x = x + self._sweep(self.change_x, x, x + self.width, left, right, beside)
+
+        # Push out of platforms that were already overlapping
+        if len(left):
+            last, hit = self._last_hit(self._overlaps(self.platforms, x, y))
+            x = np.where(hit & (self.change_x > 0), left[last] - self.width, x)
+            x = np.where(hit & (self.change_x < 0), right[last], x)
+
+        # Move up/down, stopping at the first platform in the way
+        distance = _round(y + change_y) - y
+        above = (x[:, None] < right) & (x[:, None] + self.width > left)
+        allowed = self._sweep(distance, y, y + self.height, top, bottom, above)
+        y = y + allowed
+        standing = (y + self.height >= SCREEN_HEIGHT) | (
+            (allowed != distance) & (distance > 0)
+        )
+        change_y = np.where(allowed != distance, 0.0, change_y)
+
+        # Push out of platforms that were already overlapping
+        if len(left):
+            last, hit = self._last_hit(self._overlaps(self.platforms, x, y))
+            standing |= hit & (change_y > 0)
+            y = np.where(hit & (change_y > 0), top[last] - self.height, y)
+            y = np.where(hit & (change_y < 0), bottom[last], y)
+            change_y = np.where(hit, 0.0, change_y)
+
+        air_ticks = np.where(standing, 0, air_ticks + 1)
+        life = self.life
+
+        # Lava
+        burnt = y + self.height > self.lava_top
+        life = life - burnt
+        y = np.where(burnt, 0, y)
+        air_ticks = np.where(burnt, COYOTE_TICKS + 1, air_ticks)
+
+        # Coins not yet collected by each body
+        if len(self.coins[0]):
+            taken = self._overlaps(self.coins, x, y) & ~self.collected
+            taken &= active[:, None]
+            self.collected |= taken
+            self.score = self.score + taken.sum(axis=1)
+
+        # Spikes, one life each
+        if len(self.spikes[0]):
+            spiked = self._overlaps(self.spikes, x, y).sum(axis=1)
+            life = life - spiked
+            y = np.where(spiked > 0, 0, y)
+            air_ticks = np.where(spiked > 0, COYOTE_TICKS + 1, air_ticks)
+
+        life = np.maximum(life, 0)
+
+        # Bodies that are done stay where they are
+        self.x = np.where(active, x, self.x)
+        self.y = np.where(active, y, self.y)
+        self.change_y = np.where(active, change_y, self.change_y)
+        self.life = np.where(active, life, self.life)
+        self.jump_buffer = np.where(active, jump_buffer, self.jump_buffer)
+        self.air_ticks = np.where(active, air_ticks, self.air_ticks)
@@ -0,0 +1,249 @@
+"""Throughput benchmarks for simulation, collision, drawing, particles and loading
+
+Runs headless with SDL's dummy video and audio drivers:
+
+    python benchmarks/bench.py               # run and compare to baseline
+    python benchmarks/bench.py --save        # run and store a new baseline
+
+Results are rates (higher is better). Any benchmark slower than the
+baseline by more than the tolerance is reported and the script exits with
+status 1. Without a baseline nothing can be compared, and the script
+exits with status 2 unless it is saving one.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pygame  # noqa: E402
+
+import levelfile  # noqa: E402
+import main  # noqa: E402
+import particles  # noqa: E402
+from spatial import EntityGroup  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Allowed slowdown against the baseline before a benchmark counts as failed
+TOLERANCE = 0.25
+
+# Entity counts for the collision benchmark
+COLLISION_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def measure(run, min_time=0.3, repeat=3):
+    """Best rate of run() in operations per second
+
+    run(n) must perform n operations. n grows until one round takes at
+    least min_time, then the best of repeat rounds is kept.
+    """
+    n = 1
+    while True:
+        start = time.perf_counter()
+        run(n)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        n *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed * 1.2))
+
+    best = n / elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        run(n)
+        best = max(best, n / (time.perf_counter() - start))
+    return best
+
+
+def scripted_inputs(count, seed=0):
+    """Reproducible inputs that mostly run right and jump now and then"""
+    rng = random.Random(seed)
+    return [
+        main.Inputs(rng.choice([-1, 0, 1, 1, 1]), rng.random() < 0.05, True)
+        for _ in range(count)
+    ]
+
+
+def bench_simulation():
+    """Simulation ticks per second"""
+    inputs = scripted_inputs(4096)
+
+    def run(n):
+        simulation = main.Simulation(seed=1, prefetch=False)
+        for i in range(n):
+            simulation.step(inputs[i % len(inputs)])
+
+    return {"simulation_ticks_per_s": measure(run)}
+
+
+def bench_collision():
+    """Spatial queries per second as a level grows"""
+    results = {}
+    for size in COLLISION_SIZES:
+        rng = random.Random(size)
+        # Keep density constant: about one platform per 300 pixels
+        width = size * 300
+        group = EntityGroup(main.Platform)
+        for _ in range(size):
+            group.add(rng.randrange(width), rng.randrange(main.SCREEN_HEIGHT), 210, 30)
+
+        probes = []
+        for _ in range(1024):
+            probe = pygame.sprite.Sprite()
+            probe.rect = pygame.Rect(
+                rng.randrange(width), rng.randrange(main.SCREEN_HEIGHT), 40, 40
+            )
+            probes.append(probe)
+
+        def run(n):
+            for i in range(n):
+                group.spritecollide(probes[i % len(probes)])
+
+        results[f"collision_queries_per_s_{size}"] = measure(run)
+    return results
+
+
+def bench_drawing():
+    """Frames drawn per second offscreen, full and dirty-rect"""
+    screen = pygame.display.set_mode((main.SCREEN_WIDTH, main.SCREEN_HEIGHT))
+    font = pygame.font.Font(None, 36)
+    inputs = scripted_inputs(4096, seed=1)
+    results = {}
+
+    for name, dirty_rects in (("full", False), ("dirty", True)):
+        simulation = main.Simulation(seed=1, prefetch=False)
+        renderer = main.Renderer(screen, font, dirty_rects)
+
+        def run(n):
+            for i in range(n):
+                simulation.step(inputs[i % len(inputs)])
+                renderer.draw(simulation)
+
+        results[f"draw_frames_per_s_{name}"] = measure(run)
+    return results
+
+
+def bench_particles():
+    """Frames of a full particle pool moved and drawn per second"""
+    surface = pygame.Surface((main.SCREEN_WIDTH, main.SCREEN_HEIGHT))
+    system = particles.ParticleSystem(seed=1)
+    burst = particles.BURSTS["lava"]
+    size = surface.get_size()
+
+    def run(n):
+        for i in range(n):
+            # Keep the pool full
+            if i % 10 == 0:
+                for _ in range(system.capacity // burst.count):
+                    system.emit(main.SCREEN_WIDTH // 2, main.SCREEN_HEIGHT // 2, burst)
+            system.step()
+            system.project(0, size)
+            system.draw(surface)
+
+    return {"particle_frames_per_s": measure(run)}
+
+
+def bench_loading():
+    """Levels built per second, from the compiled cache and from JSON"""
+    files = main.LEVEL_FILES
+    player = main.Player()
+
+    def cached(n):
+        for i in range(n):
+            main.Level.from_file(files[i % len(files)], player, random.Random(i))
+
+    def parsed(n):
+        for i in range(n):
+            levelfile.parse(files[i % len(files)])
+
+    # Make sure the caches exist
+    cached(len(files))
+    return {
+        "level_builds_per_s": measure(cached),
+        "level_parses_per_s": measure(parsed),
+    }
+
+
+BENCHMARKS = [
+    bench_simulation,
+    bench_collision,
+    bench_drawing,
+    bench_particles,
+    bench_loading,
+]
+
+
+def compare(results, baseline, tolerance):
+    """Names of benchmarks slower than the baseline beyond tolerance"""
+    regressions = []
+    for name, rate in results.items():
+        expected = baseline.get(name)
+        if expected and rate < expected * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def run_benchmarks(argv=None):
+    """Run the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", action="store_true", help="store as baseline")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file")
+    parser.add_argument("--output", help="also write results to this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help="allowed slowdown as a fraction (default %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    pygame.init()
+    results = {}
+    for bench in BENCHMARKS:
+        results.update(bench())
+    pygame.quit()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    for name, rate in results.items():
+        line = f"{name:40} {rate:14.1f}/s"
+        if baseline.get(name):
+            line += f"  ({rate / baseline[name] - 1:+.1%} vs baseline)"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"No baseline at {args.baseline}, nothing compared; save one with --save")
+        return 2
+    for name in results:
+        if not baseline.get(name):
+            print(f"NOT COMPARED: {name} is not in the baseline")
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name in regressions:
+        print(f"REGRESSION: {name} is more than {args.tolerance:.0%} slower")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_benchmarks())
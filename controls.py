@@ -0,0 +1,209 @@
+"""Input devices mapped to game actions and queued for simulation ticks
+
+Keyboard keys, joystick buttons and sticks, and scripted sources all turn
+into the same small set of actions. Presses and releases are timestamped
+when they arrive and wait in a queue; each simulation tick takes the ones
+that happened up to its own point in time. A press therefore lands on the
+tick it belongs to however many ticks run per rendered frame, and is
+never lost between frames.
+
+The time from a press arriving to the tick that uses it is recorded, so
+input latency can be measured with latency().
+"""
+
+import collections
+import time
+
+import pygame
+
+from profiler import percentiles
+
+# Actions
+LEFT = "left"
+RIGHT = "right"
+JUMP = "jump"
+RESTART = "restart"
+QUIT = "quit"
+PROFILER = "profiler"
+
+# Actions the simulation consumes; the rest are returned straight away by
+# InputQueue.handle() for the main loop to act on
+TICK_ACTIONS = {LEFT, RIGHT, JUMP, RESTART}
+
+KEY_BINDINGS = {
+    pygame.K_LEFT: LEFT,
+    pygame.K_RIGHT: RIGHT,
+    pygame.K_UP: JUMP,
+    pygame.K_c: RESTART,
+    pygame.K_q: QUIT,
+    pygame.K_F3: PROFILER,
+}
+
+# Face button and start on common gamepads
+BUTTON_BINDINGS = {0: JUMP, 7: RESTART}
+
+# How far a stick must be pushed to count as a direction
+AXIS_DEADZONE = 0.5
+
+# Press latencies kept for latency()
+LATENCY_WINDOW = 600
+
+ActionEvent = collections.namedtuple("ActionEvent", ["time", "action", "pressed"])
+ActionEvent.__doc__ = "An action pressed or released at a perf_counter() time"
+
+
+class InputQueue:
+    """Maps device events to actions and hands them out per tick"""
+
+    def __init__(self, key_bindings=KEY_BINDINGS, button_bindings=BUTTON_BINDINGS):
+        """Initialize queue"""
+        self.key_bindings = key_bindings
+        self.button_bindings = button_bindings
+
+        # ActionEvents not yet taken by a tick, oldest first
+        self.events = collections.deque()
+        # Movement actions held down, most recently pressed last; an action
+        # held on two devices is listed twice
+        self.held = []
+
+        # Open joysticks by instance id, and the direction each stick holds
+        self.joysticks = {}
+        self.stick_actions = {}
+
+        # Seconds from recent presses arriving to being used by a tick
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def push(self, action, pressed, timestamp=None):
+        """Queue an action for the simulation
+
+        Returns the action if it is pressed and not one the simulation
+        consumes, so the caller can handle it right away.
+        """
+        if action not in TICK_ACTIONS:
+            return action if pressed else None
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self.events.append(ActionEvent(timestamp, action, pressed))
+        return None
+
+    def handle(self, event, timestamp=None):
+        """Translate a pygame event into actions
+
+        Returns a pressed action the simulation does not consume (see
+        push()), or None.
+        """
+        if event.type in (pygame.KEYDOWN, pygame.KEYUP):
+            action = self.key_bindings.get(event.key)
+            if action is not None:
+                return self.push(action, event.type == pygame.KEYDOWN, timestamp)
+
+        elif event.type in (pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP):
+            action = self.button_bindings.get(event.button)
+            if action is not None:
+                pressed = event.type == pygame.JOYBUTTONDOWN
+                return self.push(action, pressed, timestamp)
+
+        elif event.type == pygame.JOYAXISMOTION and event.axis == 0:
+            action = None
+            if event.value <= -AXIS_DEADZONE:
+                action = LEFT
+            elif event.value >= AXIS_DEADZONE:
+                action = RIGHT
+            self._stick(event.instance_id, action, timestamp)
+
+        elif event.type == pygame.JOYHATMOTION and event.hat == 0:
+            x = event.value[0]
+            action = LEFT if x < 0 else RIGHT if x > 0 else None
+            self._stick(("hat", event.instance_id), action, timestamp)
+
+        elif event.type == pygame.JOYDEVICEADDED:
+            joystick = pygame.joystick.Joystick(event.device_index)
+            self.joysticks[joystick.get_instance_id()] = joystick
+
+        elif event.type == pygame.JOYDEVICEREMOVED:
+            self.joysticks.pop(event.instance_id, None)
+            self._stick(event.instance_id, None, timestamp)
+            self._stick(("hat", event.instance_id), None, timestamp)
+
+        return None
+
+    def _stick(self, stick, action, timestamp):
+        """Turn a stick or hat direction into press and release events"""
+        previous = self.stick_actions.get(stick)
+        if action == previous:
+            return
+        if previous is not None:
+            self.push(previous, False, timestamp)
+        if action is not None:
+            self.push(action, True, timestamp)
+        self.stick_actions[stick] = action
+
+    def next_inputs(self, until):
+        """Take the events up to time until and return (move, jump, restart)
+
+        move follows the direction held at the end, the most recently
+        pressed one winning; jump and restart are set if pressed at any
+        point, even if already released again.
+        """
+        now = time.perf_counter()
+        jump = restart = False
+        while self.events and self.events[0].time <= until:
+            timestamp, action, pressed = self.events.popleft()
+            if pressed:
+                self.latencies.append(now - timestamp)
+
+            if action in (LEFT, RIGHT):
+                if pressed:
+                    self.held.append(action)
+                elif action in self.held:
+                    # Remove the most recent press of it
+                    del self.held[len(self.held) - 1 - self.held[::-1].index(action)]
+            elif pressed and action == JUMP:
+                jump = True
+            elif pressed and action == RESTART:
+                restart = True
+
+        move = 0
+        if self.held:
+            move = -1 if self.held[-1] == LEFT else 1
+        return move, jump, restart
+
+    def latency(self, points=(50, 95, 99)):
+        """Percentiles of recent press latencies in milliseconds"""
+        return {
+            point: value * 1000
+            for point, value in percentiles(self.latencies, points).items()
+        }
+
+
+class ScriptedSource:
+    """Feeds a fixed script of actions into an InputQueue
+
+    Steps are (seconds, action, pressed) with seconds counted from start(),
+    e.g. for demos or automated play through the same path as real input.
+    """
+
+    def __init__(self, queue, steps):
+        """Initialize source"""
+        self.queue = queue
+        self.steps = collections.deque(sorted(steps, key=lambda step: step[0]))
+        self.start_time = None
+
+    def start(self, now=None):
+        """Start the script's clock"""
+        self.start_time = time.perf_counter() if now is None else now
+
+    def poll(self, now=None):
+        """Queue the steps that are due"""
+        if self.start_time is None:
+            self.start()
+        if now is None:
+            now = time.perf_counter()
+        while self.steps and self.start_time + self.steps[0][0] <= now:
+            offset, action, pressed = self.steps.popleft()
+            self.queue.push(action, pressed, self.start_time + offset)
+
+    @property
+    def finished(self):
+        """True once every step has been queued"""
+        return not self.steps
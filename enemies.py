@@ -0,0 +1,265 @@
+"""Enemies, and a scheduler that spends AI time on the ones near the player
+
+Every enemy stays on its home platform: patrollers walk back and forth,
+jumpers hop in place and chasers run at the player when it comes close.
+Movement is worked out from the number of ticks since an enemy's last
+update rather than one tick at a time, so an enemy updated every fourth
+tick, or woken after sleeping for a minute, ends up exactly where it
+would be had it been updated every tick.
+
+EnemyGroup relies on that to update enemies on and just around the
+screen every tick, those further out every few ticks, and not to touch
+the rest at all until the screen comes near them.
+"""
+
+import collections
+
+import pygame
+
+from spatial import SpatialGroup, rect_round
+
+SIZE = 30
+
+# Pixels per tick
+PATROL_SPEED = 2
+CHASE_SPEED = 3
+
+# How close the player must be for a chaser to go after it
+CHASE_RANGE = 250
+CHASE_HEIGHT = 150
+
+# A jumper's hop, and the ticks it waits between hops
+HOP_SPEED = -7
+HOP_GRAVITY = 0.35
+HOP_REST = 40
+
+# Pixels beyond each side of the screen within which enemies are updated
+# every tick, and every SLICE ticks; enemies further away sleep
+ACTIVE_MARGIN = 200
+NEAR_MARGIN = 800
+SLICE = 4
+
+EnemyState = collections.namedtuple(
+    "EnemyState",
+    ["kind", "chunk", "left", "top", "right", "offset", "phase", "tick"],
+)
+EnemyState.__doc__ = """Saved state of an enemy (see Enemy.state())
+
+chunk is the endless level chunk the enemy belongs to, or None.
+"""
+
+
+def _hop():
+    """Height of a jumper's feet each tick of a hop, then resting"""
+    heights = []
+    change_y = HOP_SPEED
+    height = 0
+    while True:
+        change_y += HOP_GRAVITY
+        height -= rect_round(change_y)
+        if height <= 0:
+            break
+        heights.append(height)
+    return [0] + heights + [0] * HOP_REST
+
+
+HOP = _hop()
+
+_images = {}
+
+
+def _image(color):
+    """Shared image of an enemy, one per color"""
+    image = _images.get(color)
+    if image is None:
+        image = pygame.Surface([SIZE, SIZE])
+        image.fill(color)
+        pygame.draw.rect(image, (0, 0, 0), image.get_rect(), 3)
+        _images[color] = image
+    return image
+
+
+class Enemy(pygame.sprite.Sprite):
+    """Walks back and forth along its home platform
+
+    offset is the position in the back-and-forth cycle: it counts up
+    from 0 to the platform's free width walking right and on up to twice
+    that walking back left.
+    """
+
+    kind = "patroller"
+    color = (128, 0, 128)
+
+    def __init__(self, left, top, right, offset=0, phase=0, tick=0, chunk=None):
+        """Initialize enemy on the platform spanning left to right at top"""
+        super().__init__()
+        self.left = left
+        self.top = top
+        self.right = right
+        # Room to move, and the area the enemy can ever be in
+        self.span = max(0, right - left - SIZE)
+        self.territory = pygame.Rect(
+            left, top - SIZE - max(HOP), right - left, SIZE + max(HOP)
+        )
+
+        # Which of EnemyGroup's SLICE ticks the enemy is updated on when
+        # near the screen; fixed by where it lives, so an enemy rebuilt from
+        # its state is updated on the same ticks
+        self.slice = hash((left, top, right)) % SLICE
+
+        self.offset = offset
+        self.phase = phase
+        # Tick the enemy was last updated to
+        self.tick = tick
+        self.chunk = chunk
+
+        self.image = _image(self.color)
+        self.rect = self.image.get_rect()
+        self.place()
+
+    @property
+    def position(self):
+        """Distance from the left end of the platform"""
+        if self.offset <= self.span:
+            return self.offset
+        return 2 * self.span - self.offset
+
+    def place(self):
+        """Move the rect to where the state says the enemy is"""
+        self.rect.x = self.left + self.position
+        self.rect.bottom = self.top
+
+    def update(self, tick, target=None):
+        """Catch up to tick; target is the player's rect"""
+        if tick > self.tick:
+            self.advance(tick - self.tick, target)
+            self.tick = tick
+            self.place()
+
+    def advance(self, ticks, target):
+        """Move on by a number of ticks"""
+        self.patrol(ticks)
+
+    def patrol(self, ticks):
+        """Walk back and forth for a number of ticks"""
+        if self.span:
+            self.offset = (self.offset + PATROL_SPEED * ticks) % (2 * self.span)
+
+    def state(self):
+        """Everything needed to recreate the enemy"""
+        return EnemyState(
+            self.kind,
+            self.chunk,
+            self.left,
+            self.top,
+            self.right,
+            self.offset,
+            self.phase,
+            self.tick,
+        )
+
+
+class Jumper(Enemy):
+    """Hops up and down in the middle of its platform"""
+
+    kind = "jumper"
+    color = (255, 140, 0)
+
+    def place(self):
+        """Move the rect to where the state says the enemy is"""
+        self.rect.x = self.left + self.span // 2
+        self.rect.bottom = self.top - HOP[self.phase]
+
+    def advance(self, ticks, target):
+        """Move on by a number of ticks"""
+        self.phase = (self.phase + ticks) % len(HOP)
+
+
+class Chaser(Enemy):
+    """Patrols, but runs at the player when it comes close
+
+    Chasing depends on where the player is each tick. Chasers only chase
+    within CHASE_RANGE of the player, well inside the area EnemyGroup
+    updates every tick, so they never chase in bigger steps.
+    """
+
+    kind = "chaser"
+    color = (139, 0, 0)
+
+    def advance(self, ticks, target):
+        """Move on by a number of ticks"""
+        if target is None or not self.sees(target):
+            self.patrol(ticks)
+            return
+
+        position = self.position
+        goal = min(max(target.centerx - SIZE // 2 - self.left, 0), self.span)
+        if goal > position:
+            position = min(goal, position + CHASE_SPEED * ticks)
+            self.offset = position
+        elif goal < position:
+            position = max(goal, position - CHASE_SPEED * ticks)
+            # The walking-left half of the cycle
+            self.offset = (2 * self.span - position) % (2 * self.span)
+
+    def sees(self, target):
+        """Whether the player is close enough to chase"""
+        return (
+            abs(target.centerx - self.rect.centerx) <= CHASE_RANGE
+            and self.top - CHASE_HEIGHT < target.bottom <= self.top
+        )
+
+
+KINDS = {cls.kind: cls for cls in (Enemy, Jumper, Chaser)}
+
+# Kind names in a fixed order; level caches and snapshots store the index
+# into this, so only ever add to the end
+KIND_NAMES = tuple(KINDS)
+
+
+def from_state(state):
+    """Recreate an enemy from Enemy.state()"""
+    return KINDS[state.kind](
+        state.left,
+        state.top,
+        state.right,
+        state.offset,
+        state.phase,
+        state.tick,
+        state.chunk,
+    )
+
+
+class EnemyGroup(SpatialGroup):
+    """Enemies indexed by where they can go, updated by distance from view
+
+    Each enemy is indexed by its territory, which never moves, so the
+    index stays valid however the enemies move. update() only visits the
+    enemies near the screen:
+
+    - on screen or within ACTIVE_MARGIN of it: every tick
+    - within NEAR_MARGIN: every SLICE ticks, each on the tick of its own
+      slice so the work is spread out
+    - further away: not at all until the screen comes closer
+    """
+
+    def bounds(self, sprite):
+        """Index enemies by their territory"""
+        return sprite.territory
+
+    def update(self, tick, viewport, target=None):
+        """Bring the enemies near the viewport up to tick"""
+        active = viewport.inflate(2 * ACTIVE_MARGIN, 0)
+        near = viewport.inflate(2 * NEAR_MARGIN, 0)
+        for enemy in self.query(near):
+            if enemy.territory.colliderect(active) or (tick + enemy.slice) % SLICE == 0:
+                enemy.update(tick, target)
+
+    def spritecollide(self, sprite, dokill=False):
+        """Same as pygame.sprite.spritecollide against this group"""
+        rect = sprite.rect
+        hits = [enemy for enemy in self.query(rect) if rect.colliderect(enemy.rect)]
+        if dokill:
+            for hit in hits:
+                hit.kill()
+        return hits
@@ -0,0 +1,278 @@
+"""Reinforcement learning environments around the headless Simulation
+
+PlatformerEnv has the usual reset()/step() interface and needs no
+window, mixer or clock. ParallelEnvs runs many of them in worker processes
+that write observations, rewards and done flags straight into shared
+memory, so stepping a batch costs one small message per worker.
+
+    envs = ParallelEnvs(64)
+    observations = envs.reset()
+    while training:
+        observations, rewards, dones = envs.step(policy(observations))
+    envs.close()
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from main import SCREEN_HEIGHT, SCREEN_WIDTH, Inputs, Simulation
+
+# Actions are (move, jump) pairs
+ACTIONS = [(move, jump) for jump in (False, True) for move in (-1, 0, 1)]
+
+# Nearest platforms, coins and spikes included in an observation
+NEAR_PLATFORMS = 5
+NEAR_COINS = 3
+NEAR_SPIKES = 3
+
+# Player x, y, change_x, change_y, life, score, level, then dx and dy of
+# nearby things and the width of nearby platforms
+OBSERVATION_SIZE = 7 + NEAR_PLATFORMS * 3 + NEAR_COINS * 2 + NEAR_SPIKES * 2
+
+# Reward for each coin, life lost, level finished, pixel of progress, and
+# for winning and losing
+COIN_REWARD = 1.0
+LIFE_REWARD = -1.0
+LEVEL_REWARD = 5.0
+PROGRESS_REWARD = 0.01
+WIN_REWARD = 10.0
+LOSE_REWARD = -10.0
+
+# Ticks before an episode is cut short, one minute of play
+MAX_STEPS = 3600
+
+
+class PlatformerEnv:
+    """Single game as a reinforcement learning environment"""
+
+    action_count = len(ACTIONS)
+    observation_size = OBSERVATION_SIZE
+
+    def __init__(self, max_steps=MAX_STEPS):
+        """Initialize environment"""
+        self.max_steps = max_steps
+        self.simulation = None
+        self.steps = 0
+
+    def reset(self, seed=None, out=None):
+        """Start a new episode and return its first observation"""
+        self.simulation = Simulation(seed, prefetch=False)
+        self.steps = 0
+        self.best_x = self.simulation.player.rect.x
+        return self.observation(out)
+
+    def step(self, action, out=None):
+        """Play one tick, returning (observation, reward, done, info)"""
+        simulation = self.simulation
+        player = simulation.player
+        score = player.score
+        life = player.life
+        level_no = simulation.current_level_no
+
+        move, jump = ACTIONS[action]
+        simulation.step(Inputs(move, jump))
+        self.steps += 1
+
+        # Player may have been replaced by a restart
+        player = simulation.player
+        reward = (player.score - score) * COIN_REWARD
+        reward += (life - player.life) * LIFE_REWARD
+        if simulation.current_level_no != level_no:
+            reward += LEVEL_REWARD
+            self.best_x = player.rect.x
+        elif player.rect.x > self.best_x:
+            reward += (player.rect.x - self.best_x) * PROGRESS_REWARD
+            self.best_x = player.rect.x
+
+        if simulation.game_won:
+            reward += WIN_REWARD
+        elif simulation.game_over:
+            reward += LOSE_REWARD
+
+        done = simulation.finished or self.steps >= self.max_steps
+        info = {
+            "score": player.score,
+            "life": player.life,
+            "level": simulation.current_level_no,
+            "won": simulation.game_won,
+        }
+        return self.observation(out), reward, done, info
+
+    def observation(self, out=None):
+        """Current state as a float32 vector, written into out if given"""
+        if out is None:
+            out = np.zeros(OBSERVATION_SIZE, dtype=np.float32)
+        else:
+            out[:] = 0
+
+        simulation = self.simulation
+        player = simulation.player
+        level = simulation.current_level
+        rect = player.rect
+
+        out[0] = (rect.x - level.camera.x) / SCREEN_WIDTH
+        out[1] = rect.y / SCREEN_HEIGHT
+        out[2] = player.change_x
+        out[3] = player.change_y
+        out[4] = player.life
+        out[5] = player.score
+        out[6] = simulation.current_level_no
+
+        # Look around one screen in each direction
+        area = rect.inflate(SCREEN_WIDTH * 2, SCREEN_HEIGHT * 2)
+        index = 7
+        for group, count, with_width in (
+            (level.platform_list, NEAR_PLATFORMS, True),
+            (level.coin_list, NEAR_COINS, False),
+            (level.spike_list, NEAR_SPIKES, False),
+        ):
+            nearby = group.query(area)
+            nearby.sort(key=lambda sprite: abs(sprite.rect.centerx - rect.centerx))
+            for sprite in nearby[:count]:
+                out[index] = (sprite.rect.x - rect.x) / SCREEN_WIDTH
+                out[index + 1] = (sprite.rect.y - rect.y) / SCREEN_HEIGHT
+                if with_width:
+                    out[index + 2] = sprite.rect.width / SCREEN_WIDTH
+                index += 3 if with_width else 2
+            index += (count - min(count, len(nearby))) * (3 if with_width else 2)
+        return out
+
+
+def _worker(connection, memory_name, env_count, first, last, max_steps):
+    """Run environments first to last, driven by commands from connection"""
+    memory = shared_memory.SharedMemory(name=memory_name)
+    observations, rewards, dones, actions = _views(memory, env_count)
+    envs = [PlatformerEnv(max_steps) for _ in range(first, last)]
+
+    try:
+        while True:
+            command, argument = connection.recv()
+            if command == "reset":
+                for i, env in enumerate(envs, first):
+                    seed = None if argument is None else argument + i
+                    env.reset(seed, observations[i])
+            elif command == "step":
+                for i, env in enumerate(envs, first):
+                    _, reward, done, _ = env.step(actions[i], observations[i])
+                    rewards[i] = reward
+                    dones[i] = done
+                    if done:
+                        env.reset(out=observations[i])
+            elif command == "close":
+                break
+            connection.send(None)
+    finally:
+        del observations, rewards, dones, actions
+        memory.close()
+
+
+def _views(memory, env_count):
+    """Arrays for observations, rewards, dones and actions in shared memory"""
+    # Widest types first so every array is aligned
+    sizes = [
+        env_count * 8,
+        env_count * OBSERVATION_SIZE * 4,
+        env_count * 4,
+        env_count,
+    ]
+    offsets = np.cumsum([0] + sizes)
+    buffer = memory.buf
+    actions = np.ndarray((env_count,), np.int64, buffer, offsets[0])
+    observations = np.ndarray(
+        (env_count, OBSERVATION_SIZE), np.float32, buffer, offsets[1]
+    )
+    rewards = np.ndarray((env_count,), np.float32, buffer, offsets[2])
+    dones = np.ndarray((env_count,), np.bool_, buffer, offsets[3])
+    return observations, rewards, dones, actions
+
+
+def _memory_size(env_count):
+    """Bytes of shared memory needed for env_count environments"""
+    return env_count * (OBSERVATION_SIZE * 4 + 4 + 1 + 8)
+
+
+class ParallelEnvs:
+    """Many environments stepped together across worker processes
+
+    Environments that finish are reset automatically; the observation
+    returned for them is the first one of the new episode.
+    """
+
+    def __init__(self, env_count, workers=None, max_steps=MAX_STEPS, context=None):
+        """Start the worker processes"""
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, env_count))
+        self.env_count = env_count
+
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=_memory_size(env_count)
+        )
+        (
+            self.observations,
+            self.rewards,
+            self.dones,
+            self.actions,
+        ) = _views(self.memory, env_count)
+
+        context = multiprocessing.get_context(context)
+        self.connections = []
+        self.processes = []
+        bounds = np.linspace(0, env_count, workers + 1).astype(int)
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_worker,
+                args=(child, self.memory.name, env_count, first, last, max_steps),
+                daemon=True,
+            )
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def _send(self, command, argument=None):
+        """Send a command to every worker and wait until all are done"""
+        for connection in self.connections:
+            connection.send((command, argument))
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self, seed=None):
+        """Reset every environment, returning the observations
+
+        Environment i is seeded with seed + i when a seed is given.
+        """
+        self._send("reset", seed)
+        return self.observations
+
+    def step(self, actions):
+        """Step every environment, returning (observations, rewards, dones)
+
+        The returned arrays live in shared memory and are overwritten by
+        the next call; copy them to keep them.
+        """
+        self.actions[:] = actions
+        self._send("step")
+        return self.observations, self.rewards, self.dones
+
+    def close(self):
+        """Stop the workers and free the shared memory"""
+        for connection in self.connections:
+            try:
+                connection.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join()
+        del self.observations, self.rewards, self.dones, self.actions
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,187 @@
+"""Level file loading with a compiled binary cache
+
+Levels are described in JSON files:
+
+    {
+        "level_limit": -2000,
+        "platforms": [[width, height, x, y], ...],
+        "coins": {"min": 1, "max": 4},
+        "spikes": [{"platform": 3, "x": 50}, ...],
+        "random_spikes": false,
+        "enemies": [{"platform": 2, "kind": "patroller"}, ...]
+    }
+
+Enemy kinds are listed in enemies.KIND_NAMES.
+
+The first load of a file compiles it into a packed array of ints under
+__cache__/ next to it. Later loads memory-map that file instead of parsing
+the JSON again, as long as the source has not changed.
+"""
+
+import array
+import collections
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+from enemies import KIND_NAMES
+
+# Magic, source mtime and size, level limit, coin min/max, random spikes,
+# platform count, spike count, enemy count
+HEADER = struct.Struct("=4sqqiiiiIII")
+MAGIC = b"LVL2"
+
+CACHE_DIR = "__cache__"
+
+LevelData = collections.namedtuple(
+    "LevelData",
+    [
+        "level_limit",
+        "platforms",
+        "coin_range",
+        "spikes",
+        "random_spikes",
+        "enemies",
+    ],
+)
+LevelData.__doc__ = """Contents of a level file
+
+platforms is a flat sequence of ints, four per platform (width, height,
+x, y); spikes is a flat sequence of two per spike (platform index, x
+offset on that platform); enemies is a flat sequence of two per enemy
+(platform index, index in enemies.KIND_NAMES).
+"""
+
+
+def rows(values, width):
+    """Split a flat int sequence into tuples of width items"""
+    for i in range(0, len(values), width):
+        yield tuple(values[i : i + width])
+
+
+def cache_path(path):
+    """Path of the compiled cache for a level file"""
+    directory, name = os.path.split(path)
+    base = os.path.splitext(name)[0]
+    return os.path.join(directory, CACHE_DIR, base + ".bin")
+
+
+def parse(path):
+    """Read a level from its JSON source"""
+    with open(path) as f:
+        data = json.load(f)
+
+    platforms = array.array("i")
+    for platform in data["platforms"]:
+        platforms.extend(platform)
+
+    spikes = array.array("i")
+    for spike in data.get("spikes", []):
+        spikes.extend([spike["platform"], spike["x"]])
+
+    enemies = array.array("i")
+    for enemy in data.get("enemies", []):
+        kind = enemy.get("kind", KIND_NAMES[0])
+        if kind not in KIND_NAMES:
+            raise ValueError(f"{path}: unknown enemy kind {kind!r}")
+        enemies.extend([enemy["platform"], KIND_NAMES.index(kind)])
+
+    coins = data.get("coins", {})
+    return LevelData(
+        level_limit=data["level_limit"],
+        platforms=platforms,
+        coin_range=(coins.get("min", 0), coins.get("max", 0)),
+        spikes=spikes,
+        random_spikes=data.get("random_spikes", False),
+        enemies=enemies,
+    )
+
+
+def compile_level(level, stat, cache):
+    """Write the binary cache for a parsed level"""
+    header = HEADER.pack(
+        MAGIC,
+        stat.st_mtime_ns,
+        stat.st_size,
+        level.level_limit,
+        level.coin_range[0],
+        level.coin_range[1],
+        int(level.random_spikes),
+        len(level.platforms) // 4,
+        len(level.spikes) // 2,
+        len(level.enemies) // 2,
+    )
+    directory = os.path.dirname(cache)
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file of our own first, so readers never see half
+    # a cache even when several processes or threads compile it at once
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=directory, prefix=os.path.basename(cache), suffix=".tmp", delete=False
+    ) as f:
+        try:
+            f.write(header)
+            level.platforms.tofile(f)
+            level.spikes.tofile(f)
+            level.enemies.tofile(f)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, cache)
+
+
+def read_cache(cache, stat):
+    """Map a compiled level, or return None if it is missing or stale"""
+    try:
+        with open(cache, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(mapped) < HEADER.size or (len(mapped) - HEADER.size) % 4:
+        return None
+    (
+        magic,
+        mtime_ns,
+        size,
+        level_limit,
+        coin_min,
+        coin_max,
+        random_spikes,
+        platform_count,
+        spike_count,
+        enemy_count,
+    ) = HEADER.unpack_from(mapped)
+    if magic != MAGIC or mtime_ns != stat.st_mtime_ns or size != stat.st_size:
+        return None
+
+    values = memoryview(mapped)[HEADER.size :].cast("i")
+    spikes_end = platform_count * 4 + spike_count * 2
+    if len(values) != spikes_end + enemy_count * 2:
+        return None
+    return LevelData(
+        level_limit=level_limit,
+        platforms=values[: platform_count * 4],
+        coin_range=(coin_min, coin_max),
+        spikes=values[platform_count * 4 : spikes_end],
+        random_spikes=bool(random_spikes),
+        enemies=values[spikes_end:],
+    )
+
+
+def load(path):
+    """Load a level file, using and refreshing its compiled cache"""
+    stat = os.stat(path)
+    cache = cache_path(path)
+
+    level = read_cache(cache, stat)
+    if level is None:
+        level = parse(path)
+        try:
+            compile_level(level, stat, cache)
+        except OSError:
+            # A read-only install still works, just without the cache
+            pass
+    return level
@@ -1,5 +1,30 @@
+import argparse
+import collections
+import concurrent.futures
+import glob
+import os
+
 import pygame
 import random
+import time
+import weakref
+
+import enemies
+import levelfile
+from assets import ASSETS
+from audio import AudioEngine
+from controls import PROFILER, QUIT, InputQueue
+import procgen
+import replay
+import snapshot
+from profiler import NULL_PROFILER, FrameProfiler
+from spatial import Entity, EntityGroup
+
+try:
+    from particles import ParticleSystem
+except ImportError:
+    # Particles need NumPy; without it the game runs with no effects
+    ParticleSystem = None
 
 # Global constants
 
@@ -16,6 +41,81 @@ ORANGE = (255, 165, 0)
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 
+# Background image of every level
+BACKGROUND = "green_forest.png"
+
+# Player physics, in pixels and pixels per tick
+PLAYER_SPEED = 6
+JUMP_SPEED = -10
+GRAVITY = 0.35
+
+# A jump pressed up to this many ticks before landing still happens, and
+# the player can still jump this many ticks after walking off a platform
+JUMP_BUFFER_TICKS = 6
+COYOTE_TICKS = 6
+
+# Things a tick can report in Player.events, named after their sounds
+EVENT_JUMP = "jump"
+EVENT_COIN = "coin"
+EVENT_SPIKE = "spike"
+EVENT_LAVA = "lava"
+EVENT_ENEMY = "enemy"
+
+# Length of one physics tick in seconds
+TIMESTEP = 1 / 60
+
+# Longest frame the main loop will catch up on, to avoid a spiral of death
+MAX_FRAME_TIME = 0.25
+
+# Input for a single tick: move is -1, 0 or 1, jump and restart are presses
+Inputs = collections.namedtuple(
+    "Inputs", ["move", "jump", "restart"], defaults=[0, False, False]
+)
+NO_INPUT = Inputs()
+
+# Sprite images shared by every instance: (kind, size, color) -> Surface
+_surface_cache = {}
+
+
+def _build_surface(kind, size, color):
+    """Draw a new sprite image"""
+    width, height = size
+    if kind == "rect":
+        surface = pygame.Surface([width, height])
+        surface.fill(color)
+    elif kind == "circle":
+        surface = pygame.Surface([width, height], pygame.SRCALPHA)
+        radius = width // 2
+        pygame.draw.circle(surface, color, (radius, radius), radius)
+    elif kind == "spike":
+        surface = pygame.Surface([width, height], pygame.SRCALPHA)
+        pygame.draw.polygon(
+            surface, color, [(width // 2, 0), (0, height), (width, height)]
+        )
+    else:
+        raise ValueError(f"Unknown surface kind: {kind}")
+
+    # Match the display format when there is one, for faster blits
+    if pygame.display.get_surface() is not None:
+        if kind == "rect":
+            surface = surface.convert()
+        else:
+            surface = surface.convert_alpha()
+    return surface
+
+
+def cached_surface(kind, size, color):
+    """Get the shared image for a sprite, drawing it on first use
+
+    Returned surfaces are shared between sprites and must not be drawn on.
+    """
+    key = (kind, tuple(size), color)
+    surface = _surface_cache.get(key)
+    if surface is None:
+        surface = _build_surface(kind, size, color)
+        _surface_cache[key] = surface
+    return surface
+
 
 class Player(pygame.sprite.Sprite):
     """Player controlled sprite"""
@@ -26,8 +126,7 @@ class Player(pygame.sprite.Sprite):
 
         # Create a circular player image
         radius = 20
-        self.image = pygame.Surface([radius * 2, radius * 2], pygame.SRCALPHA)
-        pygame.draw.circle(self.image, BLUE, (radius, radius), radius)
+        self.image = cached_surface("circle", [radius * 2, radius * 2], BLUE)
 
         # Set a reference to the image rect
         self.rect = self.image.get_rect()
@@ -45,112 +144,180 @@ class Player(pygame.sprite.Sprite):
         # Player life
         self.life = 5 + 1
 
+        # Ticks a jump press is still waiting to happen, and ticks since
+        # the player last stood on something
+        self.jump_buffer = 0
+        self.air_ticks = 0
+
+        # Events of the current tick, for sounds and effects
+        self.events = []
+
     def update(self):
         """Update player position"""
+        # Jump if jump was pressed recently and the player can
+        if self.jump_buffer > 0:
+            self.jump_buffer -= 1
+            if self.can_jump():
+                self.change_y = JUMP_SPEED
+                self.jump_buffer = 0
+                self.events.append(EVENT_JUMP)
+                # No second jump from coyote time
+                self.air_ticks = COYOTE_TICKS + 1
+
         self.calc_grav()
 
-        # Move left/right
-        self.rect.x += self.change_x
+        # Move left/right, stopping at the first platform in the way
+        self.rect.x += self.sweep_x(self.change_x)
 
-        # Check for horizontal collisions
-        block_hit_list = pygame.sprite.spritecollide(
-            self, self.level.platform_list, False
-        )
-        for block in block_hit_list:
+        # Push out of any platform that was already overlapping
+        for left, top, right, bottom in self.level.platform_list.boxes(self.rect):
             if self.change_x > 0:
-                self.rect.right = block.rect.left
+                self.rect.right = left
             elif self.change_x < 0:
-                self.rect.left = block.rect.right
-
-        # Move up/down
-        self.rect.y += self.change_y
+                self.rect.left = right
+
+        # Move up/down, stopping at the first platform in the way
+        moved = self.rect.copy()
+        moved.y += self.change_y
+        distance = moved.y - self.rect.y
+        allowed = self.sweep_y(distance)
+        self.rect.y += allowed
+        standing = self.rect.bottom >= SCREEN_HEIGHT
+        if allowed != distance:
+            # Landed on or bumped into a platform
+            self.change_y = 0
+            standing = standing or distance > 0
 
-        # Check for vertical collisions
-        block_hit_list = pygame.sprite.spritecollide(
-            self, self.level.platform_list, False
-        )
-        for block in block_hit_list:
+        # Push out of any platform that was already overlapping
+        for left, top, right, bottom in self.level.platform_list.boxes(self.rect):
             if self.change_y > 0:
-                self.rect.bottom = block.rect.top
+                self.rect.bottom = top
+                standing = True
             elif self.change_y < 0:
-                self.rect.top = block.rect.bottom
+                self.rect.top = bottom
 
             # Stop vertical movement
             self.change_y = 0
 
-        # Check if player touches lava
-        if pygame.sprite.collide_rect(self, self.level.lava):
-            self.life -= 1
-            self.rect.y = 0  # Reset player position
-            if self.life <= 0:
-                self.life = 0
-                # Game over logic can be added here
+        self.air_ticks = 0 if standing else self.air_ticks + 1
+
+        # Check if player touches lava, which spans the whole view
+        if self.rect.bottom > self.level.lava.rect.top:
+            self.hurt(EVENT_LAVA)
+
+    def sweep_x(self, distance):
+        """How far the player can move horizontally before hitting a platform
+
+        Checks everything the player would pass through, so no speed can
+        carry it through a platform.
+        """
+        rect = self.rect
+        if distance == 0:
+            return 0
+        path = rect.union(rect.move(distance, 0))
+        for left, top, right, bottom in self.level.platform_list.boxes(path):
+            if top >= rect.bottom or bottom <= rect.top:
+                continue
+            if distance > 0 and 0 <= left - rect.right < distance:
+                distance = left - rect.right
+            elif distance < 0 and 0 <= rect.left - right < -distance:
+                distance = right - rect.left
+        return distance
+
+    def sweep_y(self, distance):
+        """How far the player can move vertically before hitting a platform"""
+        rect = self.rect
+        if distance == 0:
+            return 0
+        path = rect.union(rect.move(0, distance))
+        for left, top, right, bottom in self.level.platform_list.boxes(path):
+            if left >= rect.right or right <= rect.left:
+                continue
+            if distance > 0 and 0 <= top - rect.bottom < distance:
+                distance = top - rect.bottom
+            elif distance < 0 and 0 <= rect.top - bottom < -distance:
+                distance = bottom - rect.top
+        return distance
 
     def calc_grav(self):
         """Calculate gravity effect"""
         if self.change_y == 0:
             self.change_y = 1
         else:
-            self.change_y += 0.35
+            self.change_y += GRAVITY
 
         # Check if on the ground
         if self.rect.y >= SCREEN_HEIGHT - self.rect.height and self.change_y >= 0:
             self.change_y = 0
             self.rect.y = SCREEN_HEIGHT - self.rect.height
 
-    def jump(self):
-        """Make the player jump"""
+    def can_jump(self):
+        """Whether the player is on a platform or the ground, or just left one"""
+        if self.air_ticks <= COYOTE_TICKS:
+            return True
+
         self.rect.y += 2
-        platform_hit_list = pygame.sprite.spritecollide(
-            self, self.level.platform_list, False
-        )
+        platform_hit_list = self.level.platform_list.collide_slots(self.rect)
         self.rect.y -= 2
 
         # Check if the player is on a platform or the ground
-        if len(platform_hit_list) > 0 or self.rect.bottom >= SCREEN_HEIGHT:
-            self.change_y = -10
+        return len(platform_hit_list) > 0 or self.rect.bottom >= SCREEN_HEIGHT
+
+    def jump(self):
+        """Make the player jump on the next update, or as soon as it can"""
+        self.jump_buffer = JUMP_BUFFER_TICKS
+
+    def hurt(self, event):
+        """Lose a life to what event names and drop back in"""
+        self.life -= 1
+        self.events.append(event)
+        self.drop_in()
+        if self.life <= 0:
+            self.life = 0
+            # Game over logic can be added here
+
+    def drop_in(self):
+        """Move the player back to the top of the screen after getting hurt"""
+        self.rect.y = 0  # Reset player position
+        # Falling back in is not walking off a platform
+        self.air_ticks = COYOTE_TICKS + 1
 
     def go_left(self):
         """Move player left"""
-        self.change_x = -6
+        self.change_x = -PLAYER_SPEED
 
     def go_right(self):
         """Move player right"""
-        self.change_x = 6
+        self.change_x = PLAYER_SPEED
 
     def stop(self):
         """Stop player movement"""
         self.change_x = 0
 
 
-class Platform(pygame.sprite.Sprite):
-    """Platform the player can jump on"""
-
-    def __init__(self, width, height):
-        """Initialize platform"""
-        # super() means allow you to refer to the parent class
-        super().__init__()
+class Platform(Entity):
+    """Platform the player can jump on, stored in an EntityGroup"""
 
-        self.image = pygame.Surface([width, height])
-        self.image.fill(ORANGE)
+    __slots__ = ()
 
-        self.rect = self.image.get_rect()
+    @staticmethod
+    def surface(width, height):
+        """Image for a platform of this size"""
+        return cached_surface("rect", [width, height], ORANGE)
 
 
-class Coin(pygame.sprite.Sprite):
-    """Coin that the player can collect"""
+class Coin(Entity):
+    """Coin that the player can collect, stored in an EntityGroup"""
 
-    def __init__(self):
-        """Initialize coin"""
-        super().__init__()
+    __slots__ = ()
 
-        # Create a circular coin image
-        radius = 10
-        self.image = pygame.Surface([radius * 2, radius * 2], pygame.SRCALPHA)
-        pygame.draw.circle(self.image, YELLOW, (radius, radius), radius)
+    # Circular coin with a radius of 10
+    size = (20, 20)
 
-        # Set a reference to the image rect
-        self.rect = self.image.get_rect()
+    @staticmethod
+    def surface(width, height):
+        """Image for a coin"""
+        return cached_surface("circle", [width, height], YELLOW)
 
 
 class Lava(pygame.sprite.Sprite):
@@ -160,26 +327,46 @@ class Lava(pygame.sprite.Sprite):
         """Initialize lava"""
         super().__init__()  # allow you to refer to the parent class
 
-        self.image = pygame.Surface([SCREEN_WIDTH, 20])
-        self.image.fill(RED)
+        self.image = cached_surface("rect", [SCREEN_WIDTH, 20], RED)
 
         self.rect = self.image.get_rect()
         self.rect.y = SCREEN_HEIGHT - 20
 
 
-class Spike(pygame.sprite.Sprite):
-    """Spike that hurts the player"""
+class Spike(Entity):
+    """Spike that hurts the player, stored in an EntityGroup"""
+
+    __slots__ = ()
+
+    # Triangular spike
+    size = (20, 20)
+
+    @staticmethod
+    def surface(width, height):
+        """Image for a spike"""
+        return cached_surface("spike", [width, height], RED)
+
+
+class Camera:
+    """Horizontal scroll position of the view into a level
+
+    Everything in a level lives in fixed world coordinates; the camera
+    offset is only applied when drawing, so scrolling costs the same no
+    matter how many sprites the level has.
+    """
 
     def __init__(self):
-        """Initialize spike"""
-        super().__init__()  # allow you to refer to the parent class
+        """Initialize camera"""
+        self.x = 0
 
-        # Create a triangular spike image
-        self.image = pygame.Surface([20, 20], pygame.SRCALPHA)
-        pygame.draw.polygon(self.image, RED, [(10, 0), (0, 20), (20, 20)])
+    @property
+    def viewport(self):
+        """Area of the world currently on screen"""
+        return pygame.Rect(self.x, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
 
-        # Set a reference to the image rect
-        self.rect = self.image.get_rect()
+    def apply(self, rect):
+        """Convert a world rect to screen coordinates"""
+        return rect.move(-self.x, 0)
 
 
 class Level:
@@ -187,304 +374,207 @@ class Level:
 
     def __init__(self, player):
         """Initialize level"""
-        self.platform_list = pygame.sprite.Group()
-        self.enemy_list = pygame.sprite.Group()
-        self.coin_list = pygame.sprite.Group()
+        self.platform_list = EntityGroup(Platform)
+        self.enemy_list = enemies.EnemyGroup()
+        self.coin_list = EntityGroup(Coin)
         self.player = player
-        self.spike_list = pygame.sprite.Group()
+        self.spike_list = EntityGroup(Spike)
 
         # Lava
         self.lava = Lava()
 
-        # World shift
-        self.world_shift = 0
+        # Scroll position
+        self.camera = Camera()
 
-        # Load background image
-        self.background = pygame.image.load("assets/green_forest.png").convert()
+        # Ticks this level has been played for, the enemies' clock
+        self.tick = 0
+
+        # Load background image, held until the level is garbage collected
+        self.background = ASSETS.image(BACKGROUND)
+        weakref.finalize(self, ASSETS.release, BACKGROUND, "image")
 
     def update(self):
         """Update level"""
-        self.platform_list.update()
-        self.enemy_list.update()
-        self.coin_list.update()
-        self.spike_list.update()
+        # Platforms, coins and spikes are static data with nothing to update
+        self.tick += 1
+        self.enemy_list.update(self.tick, self.camera.viewport, self.player.rect)
 
         # Check for coin collection
-        coin_hit_list = pygame.sprite.spritecollide(self.player, self.coin_list, True)
+        coin_hit_list = self.coin_list.spritecollide(self.player, True)
         for coin in coin_hit_list:
             self.player.score += 1
+            self.player.events.append(EVENT_COIN)
 
         # Check for spike collision
-        spike_hit_list = pygame.sprite.spritecollide(
-            self.player, self.spike_list, False
-        )
+        spike_hit_list = self.spike_list.spritecollide(self.player)
         for spike in spike_hit_list:
-            self.player.life -= 1
-            self.player.rect.y = 0  # Reset player position
-            if self.player.life <= 0:
-                self.player.life = 0
-                # Game over logic can be added here
-
-    def draw(self, screen):
-        """Draw level"""
-        screen.blit(self.background, (0, 0))
-        self.platform_list.draw(screen)
-        self.enemy_list.draw(screen)
-        self.coin_list.draw(screen)
-        # Draw lava
-        screen.blit(self.lava.image, self.lava.rect)
-        # Draw spikes
-        self.spike_list.draw(screen)
-
-    def shift_world(self, shift_x):
-        """Shift the world"""
-        self.world_shift += shift_x
+            self.player.hurt(EVENT_SPIKE)
 
-        for platform in self.platform_list:
-            platform.rect.x += shift_x
+        # Check for enemy collision
+        enemy_hit_list = self.enemy_list.spritecollide(self.player)
+        for enemy in enemy_hit_list:
+            self.player.hurt(EVENT_ENEMY)
 
-        for enemy in self.enemy_list:
-            enemy.rect.x += shift_x
+    @classmethod
+    def from_file(cls, path, player, rng=random):
+        """Create a level from a level file (see levelfile.py)
 
-        for coin in self.coin_list:
-            coin.rect.x += shift_x
-
-        for spike in self.spike_list:
-            spike.rect.x += shift_x
-
-
-class Level_01(Level):
-    """Level 1"""
-
-    def __init__(self, player):
-        """Create Level 1"""
-        Level.__init__(self, player)
-
-        self.level_limit = -2000
-
-        # Platform Layout
-        level = [
-            [210, 30, 220, 520],
-            [210, 30, 500, 450],
-            [210, 30, 800, 400],
-            [210, 30, 1100, 500],
-            [210, 30, 1390, 380],
-            [210, 30, 1700, 280],
-            [210, 30, 2000, 500],
-            [210, 30, 2300, 440],
-            [210, 30, 2600, 360],
-        ]
-
-        for platform in level:
-            block = Platform(platform[0], platform[1])
-            block.rect.x = platform[2]
-            block.rect.y = platform[3]
-            block.player = self.player
-            self.platform_list.add(block)
-
-        # Add Coins (Randomly choose 1 to 4 platforms for coins)
-        num_coins = random.randint(1, min(4, len(level)))
-        selected_platforms = random.sample(level, num_coins)
-
-        for platform in selected_platforms:
-            coin = Coin()
-            coin.rect.x = platform[2] + random.randint(0, platform[0] - 20)
-            coin.rect.y = platform[3] - 40
-            self.coin_list.add(coin)
-
-
-class Level_02(Level):
-    """Level 2"""
-
-    def __init__(self, player):
-        """Create Level 2"""
-        Level.__init__(self, player)
-
-        self.level_limit = -2000
-
-        # Platform Layout
-        level = [
-            [210, 30, 330, 470],
-            [210, 30, 620, 380],
-            [210, 30, 900, 420],
-            [210, 30, 1100, 290],
-            [210, 30, 1400, 180],
-            [210, 30, 1700, 380],
-            [210, 30, 2100, 430],
-            [210, 30, 2400, 330],
-        ]
-
-        for platform in level:
-            block = Platform(platform[0], platform[1])
-            block.rect.x = platform[2]
-            block.rect.y = platform[3]
-            block.player = self.player
-            self.platform_list.add(block)
-
-        # Add Coins (Randomly choose 1 to 4 platforms for coins)
-        num_coins = random.randint(1, min(4, len(level)))
-        selected_platforms = random.sample(level, num_coins)
-
-        for platform in selected_platforms:
-            coin = Coin()
-            coin.rect.x = platform[2] + random.randint(0, platform[0] - 20)
-            coin.rect.y = platform[3] - 40
-            self.coin_list.add(coin)
-
-
-class Level_03(Level):
-    """Level 3"""
-
-    def __init__(self, player):
-        """Create level 3"""
-        Level.__init__(self, player)
-
-        self.level_limit = -2000
+        Coins and random spikes are placed using rng, so a seeded
+        random.Random always produces the same level.
+        """
+        data = levelfile.load(path)
+        level = cls(player)
+        level.level_limit = data.level_limit
 
         # Platform layout
-        level = [
-            [210, 30, 150, 550],  # 0
-            [210, 30, 500, 500],  # 1
-            [210, 30, 800, 400],  # 2
-            [210, 30, 1100, 300],  # 3
-            [210, 30, 1360, 380],  # 4
-            [210, 30, 1600, 250],
-            [210, 30, 1900, 350],
-            [210, 30, 2200, 300],
-            [210, 30, 2550, 270],
-        ]
-
-        for platform in level:
-            block = Platform(platform[0], platform[1])
-            block.rect.x = platform[2]
-            block.rect.y = platform[3]
-            block.player = self.player
-            self.platform_list.add(block)
-
-        # Add Coins (Randomly choose 1 to 4 platforms for coins)
-        num_coins = random.randint(1, min(4, len(level)))
-        selected_platforms = random.sample(level, num_coins)
-
-        for platform in selected_platforms:
-            coin = Coin()
-            coin.rect.x = platform[2] + random.randint(0, platform[0] - 20)
-            coin.rect.y = platform[3] - 40
-            self.coin_list.add(coin)
-
-        # Add spikes
-        # for platform in level:
-        #     if random.choice([True, False]):  # Randomly place spikes
-        #         spike = Spike()
-        #         spike.rect.x = platform[2] + random.randint(0, platform[0] - 20)
-        #         spike.rect.y = platform[3] - 20
-        #         self.spike_list.add(spike)
-
-        # Add spike above the fourth platform
-        fourth_platform = level[3]
-        spike = Spike()
-        spike.rect.x = fourth_platform[2] + 50
-        spike.rect.y = fourth_platform[3] - 20  # Adjust the y-coordinate as needed
-        self.spike_list.add(spike)
-
-        # Add spike above the fifth platform
-        fifth_platform = level[4]
-        spike = Spike()
-        spike.rect.x = fifth_platform[2] + 80
-        spike.rect.y = fifth_platform[3] - 20  # Adjust the y-coordinate as needed
-        self.spike_list.add(spike)
-
-
-class Level_04(Level):
-    """Level 4"""
+        layout = list(levelfile.rows(data.platforms, 4))
+        for width, height, x, y in layout:
+            level.platform_list.add(x, y, width, height)
+
+        # Add coins on randomly chosen platforms
+        coin_min, coin_max = data.coin_range
+        if layout and coin_max > 0:
+            num_coins = rng.randint(coin_min, min(coin_max, len(layout)))
+            for width, height, x, y in rng.sample(layout, num_coins):
+                level.coin_list.add(x + rng.randint(0, width - 20), y - 40)
+
+        # Add spikes at fixed spots on platforms
+        for platform_no, offset in levelfile.rows(data.spikes, 2):
+            width, height, x, y = layout[platform_no]
+            level.spike_list.add(x + offset, y - 20)
+
+        # Randomly place spikes
+        if data.random_spikes:
+            for width, height, x, y in layout:
+                if rng.choice([True, False]):
+                    level.spike_list.add(x + rng.randint(0, width - 20), y - 20)
+
+        # Enemies on their home platforms
+        for platform_no, kind in levelfile.rows(data.enemies, 2):
+            width, height, x, y = layout[platform_no]
+            enemy_class = enemies.KINDS[enemies.KIND_NAMES[kind]]
+            level.enemy_list.add(enemy_class(x, y, x + width))
+
+        return level
+
+    @property
+    def world_shift(self):
+        """How far the world has been scrolled, negative when moving right"""
+        return -self.camera.x
+
+    def visible_sprites(self, static=True):
+        """On-screen sprites and their screen rects, in drawing order
+
+        With static off, platforms are left out for a StaticLayer to draw.
+        """
+        camera = self.camera
+        viewport = camera.viewport
+
+        visible = []
+        if static:
+            for platform in self.platform_list.query(viewport):
+                visible.append((platform, camera.apply(platform.rect)))
+        for enemy in self.enemy_list.query(viewport):
+            if viewport.colliderect(enemy.rect):
+                visible.append((enemy, camera.apply(enemy.rect)))
+        for coin in self.coin_list.query(viewport):
+            visible.append((coin, camera.apply(coin.rect)))
+        # Lava is fixed to the bottom of the screen
+        visible.append((self.lava, self.lava.rect))
+        for spike in self.spike_list.query(viewport):
+            visible.append((spike, camera.apply(spike.rect)))
+        return visible
 
-    def __init__(self, player):
-        """Create level 4"""
-        Level.__init__(self, player)
+    def draw(self, screen):
+        """Draw level"""
+        screen.blit(self.background, (0, 0))
+        for sprite, rect in self.visible_sprites():
+            screen.blit(sprite.image, rect)
 
-        self.level_limit = -2000
 
-        # Platform layout
-        level = [
-            [210, 30, 190, 500],
-            [210, 30, 400, 410],
-            [210, 30, 700, 340],
-            [210, 30, 950, 250],
-            [210, 30, 1300, 180],
-            [210, 30, 1900, 220],
-            [210, 30, 2200, 175],
-            [210, 30, 2600, 210],
-            [210, 30, 3000, 250],
-        ]
-
-        for platform in level:
-            block = Platform(platform[0], platform[1])
-            block.rect.x = platform[2]
-            block.rect.y = platform[3]
-            block.player = self.player
-            self.platform_list.add(block)
-
-        # Add Coins (Randomly choose 1 to 4 platforms for coins)
-        num_coins = random.randint(1, min(4, len(level)))
-        selected_platforms = random.sample(level, num_coins)
-
-        for platform in selected_platforms:
-            coin = Coin()
-            coin.rect.x = platform[2] + random.randint(0, platform[0] - 20)
-            coin.rect.y = platform[3] - 40
-            self.coin_list.add(coin)
-
-        # Add spikes
-        for platform in level:
-            if random.choice([True, False]):  # Randomly place spikes
-                spike = Spike()
-                spike.rect.x = platform[2] + random.randint(0, platform[0] - 20)
-                spike.rect.y = platform[3] - 20
-                self.spike_list.add(spike)
-
-
-class Level_05(Level):
-    """Level 5"""
+class InfiniteLevel(Level):
+    """Endless level generated in chunks as the camera moves
 
-    def __init__(self, player):
-        """Create level 5"""
-        Level.__init__(self, player)
+    Only the chunks around the camera exist at any time; chunks that fall
+    behind are dropped and built again from the seed if the player comes
+    back, so memory use stays the same however far the player runs.
+    """
 
-        self.level_limit = -2000
+    # Chunks kept on each side of the ones on screen
+    CHUNKS_BEHIND = 1
+    CHUNKS_AHEAD = 2
 
-        # Platform layout
-        level = [
-            [210, 30, 500, 500],
-            [210, 30, 800, 400],
-            [210, 30, 1100, 300],
-            [210, 30, 1360, 380],
-            [210, 30, 1600, 250],
-            [210, 30, 1900, 350],
-        ]
-
-        for platform in level:
-            block = Platform(platform[0], platform[1])
-            block.rect.x = platform[2]
-            block.rect.y = platform[3]
-            block.player = self.player
-            self.platform_list.add(block)
-
-        # Add Coins (Randomly choose 1 to 4 platforms for coins)
-        num_coins = random.randint(1, min(4, len(level)))
-        selected_platforms = random.sample(level, num_coins)
-
-        for platform in selected_platforms:
-            coin = Coin()
-            coin.rect.x = platform[2] + random.randint(0, platform[0] - 20)
-            coin.rect.y = platform[3] - 40
-            self.coin_list.add(coin)
-
-        # Add spikes
-        for platform in level:
-            if random.choice([True, False]):  # Randomly place spikes
-                spike = Spike()
-                spike.rect.x = platform[2] + random.randint(0, platform[0] - 20)
-                spike.rect.y = platform[3] - 20
-                self.spike_list.add(spike)
+    def __init__(self, player, seed):
+        """Initialize level"""
+        super().__init__(player)
+        self.level_limit = float("-inf")
+        self.generator = procgen.ChunkGenerator(seed, JUMP_SPEED, GRAVITY, PLAYER_SPEED)
+
+        # Chunk index -> (platforms and spikes, {coin number: coin}) in it
+        self.chunks = {}
+        # Chunk index -> enemies in it
+        self.chunk_enemies = {}
+        # (chunk index, coin number) of coins already picked up
+        self.collected = set()
+
+        self.stream()
+
+    def stream(self):
+        """Build chunks coming into range and drop those out of range"""
+        first = self.camera.x // procgen.CHUNK_WIDTH - self.CHUNKS_BEHIND
+        last = (self.camera.x + SCREEN_WIDTH) // procgen.CHUNK_WIDTH
+        last += self.CHUNKS_AHEAD
+        for index in [index for index in self.chunks if not first <= index <= last]:
+            self.evict(index)
+        for index in range(first, last + 1):
+            if index not in self.chunks:
+                self.load(index)
+
+    def load(self, index):
+        """Add a chunk's sprites to the level"""
+        chunk = self.generator.chunk(index)
+        sprites = []
+
+        for width, height, x, y in chunk.platforms:
+            sprites.append(self.platform_list.add(x, y, width, height))
+
+        coins = {}
+        for number, (x, y) in enumerate(chunk.coins):
+            if (index, number) not in self.collected:
+                coins[number] = self.coin_list.add(x, y)
+
+        for x, y in chunk.spikes:
+            sprites.append(self.spike_list.add(x, y))
+
+        # Enemies start out as if they had been there all along
+        chunk_enemies = []
+        for platform_no, kind in chunk.enemies:
+            width, height, x, y = chunk.platforms[platform_no]
+            enemy = enemies.KINDS[kind](x, y, x + width, chunk=index)
+            enemy.update(self.tick)
+            self.enemy_list.add(enemy)
+            chunk_enemies.append(enemy)
+
+        self.chunks[index] = (sprites, coins)
+        self.chunk_enemies[index] = chunk_enemies
+
+    def evict(self, index):
+        """Remove a chunk's sprites, remembering which coins were taken"""
+        sprites, coins = self.chunks.pop(index)
+        for number, coin in coins.items():
+            if coin.alive():
+                coin.kill()
+            else:
+                self.collected.add((index, number))
+        for sprite in sprites:
+            sprite.kill()
+        for enemy in self.chunk_enemies.pop(index):
+            enemy.kill()
+
+    def update(self):
+        """Update level"""
+        self.stream()
+        super().update()
 
 
 def display_game_over(screen, font):
@@ -500,7 +590,6 @@ def display_game_over(screen, font):
         retry_text,
         (SCREEN_WIDTH // 2 - retry_text.get_width() // 2, SCREEN_HEIGHT // 2 + 10),
     )
-    pygame.display.flip()
 
 
 def display_win_screen(screen, font):
@@ -523,18 +612,541 @@ def display_win_screen(screen, font):
         retry_text,
         (SCREEN_WIDTH // 2 - retry_text.get_width() // 2, SCREEN_HEIGHT // 2 + 50),
     )
-    pygame.display.flip()
 
 
-def main():
+def display_loading(screen, futures):
+    """Show a progress bar until futures are done
+
+    Returns False if the window was closed while loading.
+    """
+    font = pygame.font.Font(None, 36)
+    text = font.render("Loading...", True, WHITE)
+    clock = pygame.time.Clock()
+    bar = pygame.Rect(0, 0, SCREEN_WIDTH // 2, 20)
+    bar.center = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 30)
+
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return False
+
+        loaded = sum(future.done() for future in futures)
+
+        screen.fill(BLACK)
+        screen.blit(
+            text,
+            (SCREEN_WIDTH // 2 - text.get_width() // 2, SCREEN_HEIGHT // 2 - 20),
+        )
+        pygame.draw.rect(screen, WHITE, bar, 2)
+        filled = bar.inflate(-4, -4)
+        filled.width = filled.width * loaded // max(1, len(futures))
+        pygame.draw.rect(screen, ORANGE, filled)
+        pygame.display.flip()
+
+        if loaded == len(futures):
+            # Surface any loading errors here rather than mid-game
+            for future in futures:
+                future.result()
+            return True
+        clock.tick(30)
+
+
+# Level files, played in name order
+LEVEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "levels")
+LEVEL_FILES = sorted(glob.glob(os.path.join(LEVEL_DIR, "*.json")))
+
+
+class LevelLoader:
+    """Sequence of levels that are only built when first needed
+
+    prefetch() starts building a level on a worker thread so it is usually
+    ready by the time the player reaches it.
+    """
+
+    def __init__(self, level_files, player, seed, prefetch=True):
+        """Initialize loader
+
+        With prefetch off, levels are only built on the calling thread.
+        """
+        self.level_files = level_files
+        self.player = player
+        self.seed = seed
+        self.prefetch_enabled = prefetch
+
+        # Level number -> Future of the built level
+        self.levels = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self):
+        # The endless level follows the last level file
+        return len(self.level_files) + 1
+
+    def __getitem__(self, level_no):
+        """Get a level, building it now if it was not prefetched"""
+        future = self.levels.get(level_no)
+        if future is None:
+            future = concurrent.futures.Future()
+            future.set_result(self.build(level_no))
+            self.levels[level_no] = future
+        return future.result()
+
+    def build(self, level_no):
+        """Create a level with its own generator derived from the seed
+
+        Seeding each level separately keeps levels the same whatever order
+        they happen to be built in.
+        """
+        if level_no == len(self.level_files):
+            return InfiniteLevel(self.player, f"{self.seed}:{level_no}")
+        rng = random.Random(f"{self.seed}:{level_no}")
+        return Level.from_file(self.level_files[level_no], self.player, rng)
+
+    def prefetch(self, level_no):
+        """Start building a level in the background"""
+        if not self.prefetch_enabled:
+            return
+        if level_no < len(self) and level_no not in self.levels:
+            self.levels[level_no] = self.executor.submit(self.build, level_no)
+
+
+class Simulation:
+    """Headless game logic advanced in fixed timesteps
+
+    The simulation owns the player, the levels and the win/lose state but
+    never touches the display, so it can be stepped as fast as the CPU
+    allows for tests and replays. Rendering is done by an optional observer
+    (see Renderer) that only reads this state.
+    """
+
+    def __init__(self, seed=None, prefetch=True):
+        """Initialize simulation
+
+        Two simulations with the same seed given the same inputs play out
+        exactly the same. Turn prefetch off to keep level building on the
+        calling thread, e.g. when running many simulations at once.
+        """
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+
+        # Create player
+        self.player = Player()
+
+        # Levels are built as the player reaches them
+        self.level_list = LevelLoader(LEVEL_FILES, self.player, seed, prefetch)
+
+        # Number of ticks simulated so far
+        self.tick = 0
+
+        # Times the phases of each tick when set to a FrameProfiler
+        self.profiler = NULL_PROFILER
+
+        # Set current level
+        self.current_level_no = 0
+        self.current_level = self.level_list[self.current_level_no]
+        self.player.level = self.current_level
+        self.level_list.prefetch(self.current_level_no + 1)
+
+        # X-coordinate of the spawn point
+        self.player.rect.x = self.current_level.camera.x + 240
+        # Y-coordinate of the spawn point
+        self.player.rect.y = SCREEN_HEIGHT - self.player.rect.height
+
+        self.active_sprite_list = pygame.sprite.Group()
+        self.active_sprite_list.add(self.player)
+
+        self.game_over = False
+        self.game_won = False
+
+        # Restarting goes back to this point instead of rebuilding levels
+        self.start_snapshot = snapshot.capture(self)
+
+    def restart(self):
+        """Start over from the first level, with every level as it was"""
+        tick = self.tick
+        snapshot.restore(self, self.start_snapshot)
+        self.tick = tick
+
+    @property
+    def finished(self):
+        """True once the game has been lost or won"""
+        return self.game_over or self.game_won
+
+    def step(self, inputs=NO_INPUT):
+        """Advance the game by one fixed timestep"""
+        self.tick += 1
+        self.player.events.clear()
+
+        if self.finished:
+            if inputs.restart:
+                self.restart()
+            return
+
+        player = self.player
+
+        if inputs.move < 0:
+            player.go_left()
+        elif inputs.move > 0:
+            player.go_right()
+        else:
+            player.stop()
+
+        if inputs.jump:
+            player.jump()
+
+        # Update player
+        with self.profiler.phase("player"):
+            self.active_sprite_list.update()
+
+        # Update level
+        with self.profiler.phase("level"):
+            self.current_level.update()
+
+        with self.profiler.phase("scroll"):
+            camera = self.current_level.camera
+
+            # Scroll right if player is near the right side
+            screen_rect = camera.apply(player.rect)
+            if screen_rect.right >= 500:
+                camera.x += screen_rect.right - 500
+
+            # Scroll left if player is near the left side
+            screen_rect = camera.apply(player.rect)
+            if screen_rect.left <= 120:
+                camera.x -= 120 - screen_rect.left
+
+        # Go to next level if player reaches the end
+        screen_rect = camera.apply(player.rect)
+        current_position = screen_rect.x + self.current_level.world_shift
+        if current_position < self.current_level.level_limit:
+            if self.current_level_no < len(self.level_list) - 1:
+                self.current_level_no += 1
+                self.current_level = self.level_list[self.current_level_no]
+                player.level = self.current_level
+                self.level_list.prefetch(self.current_level_no + 1)
+            player.rect.x = self.current_level.camera.x + 120
+
+        # Check for game over
+        if player.life <= 0:
+            self.game_over = True
+
+        # Check for win condition
+        if player.score >= 6:
+            self.game_won = True
+
+
+class Hud:
+    """Text for the score, life and level display
+
+    Text is only rendered when a value changes. Labels and each character
+    of a value are rasterized once and pasted together, so new values never
+    go through the font renderer either.
+    """
+
+    # Most values remembered per label before the cache is cleared
+    MAX_VALUES = 64
+
+    def __init__(self, font, color=BLACK):
+        """Initialize HUD"""
+        self.font = font
+        self.color = color
+
+        # Rendered characters and labels: string -> Surface
+        self.glyphs = {}
+        # label -> {value: Surface}
+        self.texts = {}
+
+    def glyph(self, text):
+        """Rendered image of a label or single character"""
+        image = self.glyphs.get(text)
+        if image is None:
+            image = self.font.render(text, True, self.color)
+            self.glyphs[text] = image
+        return image
+
+    def text(self, label, value):
+        """Image of a label followed by a value"""
+        cache = self.texts.setdefault(label, {})
+        image = cache.get(value)
+        if image is None:
+            parts = [self.glyph(label)] + [self.glyph(char) for char in str(value)]
+            width = sum(part.get_width() for part in parts)
+            height = max(part.get_height() for part in parts)
+
+            image = pygame.Surface([width, height], pygame.SRCALPHA)
+            x = 0
+            for part in parts:
+                # Parts do not overlap, so this just copies their pixels
+                image.blit(part, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+                x += part.get_width()
+
+            if len(cache) >= self.MAX_VALUES:
+                cache.clear()
+            cache[value] = image
+        return image
+
+
+class StaticLayer:
+    """A level's platforms pre-drawn onto screen-wide chunk surfaces
+
+    Platforms never move, so instead of blitting each one every frame they
+    are drawn once onto a transparent surface per screen-wide strip of the
+    world, built the first time the strip comes into view. Drawing the
+    static world is then one or two blits. Only the most recently used
+    chunks are kept, and all are dropped when the level's platforms change.
+    """
+
+    # Chunks kept, enough for a few screens either way
+    CAPACITY = 6
+
+    # Marks the transparent parts of a chunk
+    COLORKEY = (255, 0, 255)
+
+    def __init__(self, level):
+        """Initialize layer"""
+        self.level = level
+        self.version = level.platform_list.version
+        # Chunk index -> surface, least recently used first
+        self.chunks = collections.OrderedDict()
+
+    def chunk(self, index):
+        """Surface for one chunk, drawing it if needed"""
+        platforms = self.level.platform_list
+        if platforms.version != self.version:
+            self.chunks.clear()
+            self.version = platforms.version
+
+        surface = self.chunks.get(index)
+        if surface is not None:
+            self.chunks.move_to_end(index)
+            return surface
+
+        area = pygame.Rect(index * SCREEN_WIDTH, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+        surface = pygame.Surface(area.size)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        surface.fill(self.COLORKEY)
+        surface.set_colorkey(self.COLORKEY, pygame.RLEACCEL)
+        for platform in platforms.query(area):
+            surface.blit(platform.image, platform.rect.move(-area.x, 0))
+
+        self.chunks[index] = surface
+        while len(self.chunks) > self.CAPACITY:
+            self.chunks.popitem(last=False)
+        return surface
+
+    def draw(self, screen, area=None):
+        """Draw the platforms in view, or only those within a screen area"""
+        camera = self.level.camera
+        if area is None:
+            area = screen.get_rect()
+        left = camera.x + area.left
+        first = left // SCREEN_WIDTH
+        last = (left + area.width - 1) // SCREEN_WIDTH
+        for index in range(first, last + 1):
+            x = index * SCREEN_WIDTH - camera.x
+            source = area.move(-x, 0).clip(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+            screen.blit(self.chunk(index), source.move(x, 0), source)
+
+
+class Renderer:
+    """Draws a simulation to the screen without changing it
+
+    With dirty_rects enabled, frames where the camera did not move only
+    redraw the areas around sprites that moved, appeared or disappeared,
+    and draw() returns just those areas for pygame.display.update().
+
+    Particles are drawn over everything else; feed them with
+    particles.update() after each simulation tick. particles is None when
+    NumPy is not installed.
+    """
+
+    def __init__(self, screen, font, dirty_rects=False):
+        """Initialize renderer"""
+        self.screen = screen
+        self.font = font
+        self.dirty_rects = dirty_rects
+
+        # Times drawing and HUD text when set to a FrameProfiler
+        self.profiler = NULL_PROFILER
+
+        self.hud = Hud(font)
+
+        # Game over and win screens, rendered on first use
+        self.screens = {}
+
+        # What the last frame drew: sprite or HUD slot -> (image, screen rect)
+        self.drawn = {}
+        # Level and camera position of the last frame, or the full screen
+        # message shown
+        self.drawn_view = None
+
+        # Pre-drawn platforms of the current level
+        self.static_layer = None
+
+        # Bursts for coins and hurts, and the screen area they covered in
+        # the last frame
+        self.particles = ParticleSystem() if ParticleSystem is not None else None
+        self.particle_area = None
+
+    def draw_screen(self, display):
+        """Draw a full screen message, returning the areas that changed"""
+        screen = self.screen
+        if self.dirty_rects and self.drawn_view == display:
+            return []
+
+        image = self.screens.get(display)
+        if image is None:
+            image = pygame.Surface(screen.get_size(), 0, screen)
+            display(image, self.font)
+            self.screens[display] = image
+        screen.blit(image, (0, 0))
+
+        self.drawn_view = display
+        return [screen.get_rect()]
+
+    def draw(self, simulation):
+        """Draw the current state of the simulation
+
+        Returns the list of screen areas that changed.
+        """
+        screen = self.screen
+        player = simulation.player
+
+        if simulation.game_over:
+            return self.draw_screen(display_game_over)
+
+        if simulation.game_won:
+            return self.draw_screen(display_win_screen)
+
+        level = simulation.current_level
+        if self.static_layer is None or self.static_layer.level is not level:
+            self.static_layer = StaticLayer(level)
+
+        with self.profiler.phase("draw"):
+            # Everything to draw over the platforms this frame, in order
+            drawn = {}
+            for sprite, rect in level.visible_sprites(static=False):
+                drawn[sprite] = (sprite.image, rect)
+            for sprite in simulation.active_sprite_list:
+                drawn[sprite] = (sprite.image, level.camera.apply(sprite.rect))
+
+        # Display score, life, and level
+        with self.profiler.phase("hud"):
+            score_text = self.hud.text("Coins: ", player.score)
+            life_text = self.hud.text("Life: ", player.life)
+            level_text = self.hud.text("Level: ", simulation.current_level_no + 1)
+        drawn["score"] = (score_text, score_text.get_rect(topleft=(10, 10)))
+        drawn["life"] = (life_text, life_text.get_rect(topleft=(10, 50)))
+        drawn["level"] = (
+            level_text,
+            level_text.get_rect(topleft=(SCREEN_WIDTH // 2 - 50, 10)),
+        )
+
+        particle_area = None
+        if self.particles is not None:
+            with self.profiler.phase("particles"):
+                particle_area = self.particles.project(
+                    level.camera.x, screen.get_size()
+                )
+
+        with self.profiler.phase("draw"):
+            view = (level, level.camera.x, level.platform_list.version)
+            if not self.dirty_rects or view != self.drawn_view:
+                # Draw everything
+                screen.blit(level.background, (0, 0))
+                self.static_layer.draw(screen)
+                for image, rect in drawn.values():
+                    screen.blit(image, rect)
+                dirty = [screen.get_rect()]
+            else:
+                # Only repaint where something changed since the last frame
+                dirty = []
+                for key in self.drawn.keys() | drawn.keys():
+                    old = self.drawn.get(key)
+                    new = drawn.get(key)
+                    if old != new:
+                        dirty.extend(entry[1] for entry in (old, new) if entry)
+                # Particles move every frame
+                for area in (self.particle_area, particle_area):
+                    if area is not None:
+                        dirty.append(area)
+
+                # Clip to each area so translucent edges are not drawn twice
+                for area in dirty:
+                    screen.set_clip(area)
+                    screen.blit(level.background, area, area)
+                    self.static_layer.draw(screen, area)
+                    for image, rect in drawn.values():
+                        if rect.colliderect(area):
+                            screen.blit(image, rect)
+                screen.set_clip(None)
+
+        # Every particle lies inside an area just repainted
+        if self.particles is not None:
+            with self.profiler.phase("particles"):
+                self.particles.draw(screen)
+
+        self.drawn = drawn
+        self.drawn_view = view
+        self.particle_area = particle_area
+        return dirty
+
+
+def run_replay(path):
+    """Re-simulate a recorded session as fast as possible, without a display"""
+    seed, recorded = replay.load(path)
+    simulation = Simulation(seed)
+
+    start = time.perf_counter()
+    for move, jump, restart in recorded:
+        simulation.step(Inputs(move, jump, restart))
+    elapsed = time.perf_counter() - start
+
+    player = simulation.player
+    print(f"Replayed {simulation.tick} ticks in {elapsed:.3f}s", end="")
+    if elapsed > 0:
+        print(f" ({simulation.tick / elapsed:.0f} ticks/s)", end="")
+    print()
+    print(
+        f"Seed: {seed}  Level: {simulation.current_level_no + 1}  "
+        f"Coins: {player.score}  Life: {player.life}  "
+        f"Game over: {simulation.game_over}  Won: {simulation.game_won}"
+    )
+    return simulation
+
+
+def main(argv=None):
     """Main program"""
-    pygame.init()
+    parser = argparse.ArgumentParser(description="Side-scrolling Platformer")
+    parser.add_argument(
+        "--dirty-rects",
+        action="store_true",
+        help="only repaint changed screen areas, for slow displays",
+    )
+    parser.add_argument("--seed", type=int, help="seed for coin and spike placement")
+    parser.add_argument("--record", metavar="FILE", help="record inputs to FILE")
+    parser.add_argument(
+        "--replay", metavar="FILE", help="re-simulate a recording without a display"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="save per-frame timings to FILE on exit (.csv, otherwise JSON)",
+    )
+    parser.add_argument(
+        "--connect",
+        metavar="HOST:PORT",
+        help="play on a server started with net.py",
+    )
+    args = parser.parse_args(argv)
 
-    # Initialize mixer and load background music
+    if args.replay:
+        run_replay(args.replay)
+        return
+
+    pygame.init()
     pygame.mixer.init()
-    pygame.mixer.music.load("assets/bg-music.mp3")  # ensure the file path is correct
-    pygame.mixer.music.set_volume(0.1)  # set volume to 10%
-    pygame.mixer.music.play(-1)  # play music in an infinite loop
 
     # Set screen size
     size = [SCREEN_WIDTH, SCREEN_HEIGHT]
@@ -542,138 +1154,123 @@ def main():
 
     pygame.display.set_caption("Side-scrolling Platformer")
 
-    # Create player
-    player = Player()
+    # Load assets in the background while showing progress
+    loading = ASSETS.preload([BACKGROUND, "bg-music.mp3"])
+    if not display_loading(screen, loading):
+        pygame.quit()
+        return
+
+    # Sound effects and music
+    audio = AudioEngine()
 
-    # Create levels
-    level_list = []
-    level_list.append(Level_01(player))
-    level_list.append(Level_02(player))
-    level_list.append(Level_03(player))
-    level_list.append(Level_04(player))
-    level_list.append(Level_05(player))
+    client = None
+    if args.connect:
+        # net imports this module, so only load it when needed
+        import net
 
-    # Set current level
-    current_level_no = 0
-    current_level = level_list[current_level_no]
+        host, _, port = args.connect.rpartition(":")
+        client = net.Client((host or "127.0.0.1", int(port)))
+        simulation = client.simulation
+    else:
+        simulation = Simulation(args.seed)
 
-    active_sprite_list = pygame.sprite.Group()
-    player.level = current_level
+    recorder = None
+    if args.record:
+        recorder = replay.Recorder(simulation.seed)
 
-    # X-coordinate of the spawn point
-    player.rect.x = 240
-    # Y-coordinate of the spawn point
-    player.rect.y = SCREEN_HEIGHT - player.rect.height
-    active_sprite_list.add(player)
+    # Font for displaying score, life, and level
+    font = pygame.font.Font(None, 36)
+    renderer = Renderer(screen, font, args.dirty_rects)
+
+    # Frame timing, shown with F3
+    profiler = FrameProfiler(keep_history=bool(args.profile))
+    simulation.profiler = profiler
+    renderer.profiler = profiler
+    profiler_font = pygame.font.Font(None, 20)
 
     done = False
     clock = pygame.time.Clock()
 
-    # Font for displaying score, life, and level
-    font = pygame.font.Font(None, 36)
+    # Keyboard and joystick input, queued for the simulation ticks
+    controls = InputQueue()
 
-    game_over = False
-    game_won = False
+    # Time not yet consumed by simulation ticks
+    accumulator = 0.0
 
     # Main game loop
     while not done:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                done = True
-
-            if game_over or game_won:
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_c:
-                        # Restart the game
-                        player = Player()
-                        player.life = 5 + 1
-                        player.score = 0
-                        current_level_no = 0
-                        current_level = level_list[current_level_no]
-                        player.level = current_level
-                        player.rect.x = 240
-                        player.rect.y = SCREEN_HEIGHT - player.rect.height
-                        game_over = False
-                        game_won = False
-                        pygame.mixer.music.play(-1)  # Restart music
-                    elif event.key == pygame.K_q:
-                        done = True
-            else:
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT:
-                        player.go_left()
-                    if event.key == pygame.K_RIGHT:
-                        player.go_right()
-                    if event.key == pygame.K_UP:
-                        player.jump()
-
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_LEFT and player.change_x < 0:
-                        player.stop()
-                    if event.key == pygame.K_RIGHT and player.change_x > 0:
-                        player.stop()
-
-        if not game_over and not game_won:
-            # Update player
-            active_sprite_list.update()
-
-            # Update level
-            current_level.update()
-
-            # Shift world if player is near the right side
-            if player.rect.right >= 500:
-                diff = player.rect.right - 500
-                player.rect.right = 500
-                current_level.shift_world(-diff)
-
-            # Shift world if player is near the left side
-            if player.rect.left <= 120:
-                diff = 120 - player.rect.left
-                player.rect.left = 120
-                current_level.shift_world(diff)
-
-            # Go to next level if player reaches the end
-            current_position = player.rect.x + current_level.world_shift
-            if current_position < current_level.level_limit:
-                player.rect.x = 120
-                if current_level_no < len(level_list) - 1:
-                    current_level_no += 1
-                    current_level = level_list[current_level_no]
-                    player.level = current_level
-
-            # Draw everything
-            current_level.draw(screen)
-            active_sprite_list.draw(screen)
-
-            # Display score, life, and level
-            score_text = font.render(f"Coins: {player.score}", True, BLACK)
-            life_text = font.render(f"Life: {player.life}", True, BLACK)
-            level_text = font.render(f"Level: {current_level_no + 1}", True, BLACK)
-            screen.blit(score_text, (10, 10))
-            screen.blit(life_text, (10, 50))
-            screen.blit(level_text, (SCREEN_WIDTH // 2 - 50, 10))
-
-            # Check for game over
-            if player.life <= 0:
-                game_over = True
-                pygame.mixer.music.stop()  # Stop music
-
-            # Check for win condition
-            if player.score >= 6:
-                game_won = True
-                pygame.mixer.music.stop()  # Stop music
-
-        if game_over:
-            display_game_over(screen, font)
-
-        if game_won:
-            display_win_screen(screen, font)
+        profiler.start_frame()
+
+        with profiler.phase("events"):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    done = True
+
+                action = controls.handle(event)
+                if action == PROFILER:
+                    profiler.visible = not profiler.visible
+                    # Repaint whatever the overlay covered
+                    renderer.drawn_view = None
+                elif action == QUIT and simulation.finished:
+                    done = True
 
         # Limit to 60 frames per second
-        clock.tick(60)
+        with profiler.phase("wait"):
+            elapsed = clock.tick(60)
+        accumulator += elapsed / 1000
+        accumulator = min(accumulator, MAX_FRAME_TIME)
+
+        # The ticks run now cover the time up to now; each takes the input
+        # that arrived before its own end
+        tick_time = time.perf_counter() - accumulator
+
+        try:
+            # Run as many fixed physics ticks as the elapsed time calls for
+            while accumulator >= TIMESTEP:
+                tick_time += TIMESTEP
+                inputs = Inputs(*controls.next_inputs(tick_time))
+
+                if client is not None:
+                    client.step(inputs)
+                else:
+                    simulation.step(inputs)
+                if recorder is not None:
+                    recorder.record(inputs)
+                accumulator -= TIMESTEP
+
+                # Sounds for the tick, and music that follows the level
+                audio.update(simulation)
+                if renderer.particles is not None:
+                    renderer.particles.update(simulation)
+
+            if client is not None:
+                client.receive()
+        except ConnectionError as error:
+            # The server has gone away, so the session is over
+            print(f"Disconnected: {error}")
+            break
+
+        dirty = renderer.draw(simulation)
+
+        if profiler.visible:
+            with profiler.phase("profiler"):
+                dirty.append(profiler.draw(screen, profiler_font))
 
         # Update screen
-        pygame.display.flip()
+        with profiler.phase("flip"):
+            if args.dirty_rects:
+                pygame.display.update(dirty)
+            else:
+                pygame.display.flip()
+
+        profiler.end_frame()
+
+    if client is not None:
+        client.close()
+    if recorder is not None:
+        recorder.save(args.record)
+    if args.profile:
+        profiler.export(args.profile)
 
     pygame.quit()
 
@@ -0,0 +1,587 @@
+"""Network play against an authoritative server over UDP
+
+The server runs one Simulation per connected client and is the authority
+on its state. Clients send their per-tick inputs; the server applies them
+in order and sends back snapshots of the resulting state at a fixed rate.
+Snapshots are bit-packed and delta-compressed against the last snapshot
+the client acknowledged, so an idle player costs a few bytes per snapshot.
+
+Clients predict their own game by running the same Simulation locally
+with the session's seed and the same inputs. When a snapshot disagrees
+with what was predicted for that input, the client takes the server's
+state and re-simulates the inputs the server has not seen yet.
+
+Only the player, the progress through the levels, the camera and the
+level tick are reconciled this way. Level contents are not: which coins
+are left and where the enemies are stay as the client predicted them. A
+misprediction there, say a coin the server's player just missed, leaves
+the client's level different from the server's for the rest of the
+level, though score and life always follow the server.
+
+    python net.py --port 5555            # run a server
+    python main.py --connect localhost:5555
+"""
+
+import argparse
+import collections
+import select
+import socket
+import struct
+import time
+
+import replay
+from main import TIMESTEP, Inputs, Simulation
+
+DEFAULT_PORT = 5555
+
+# Snapshots are sent every this many server ticks (20 per second)
+SNAPSHOT_INTERVAL = 3
+
+# Inputs each session may consume per server tick, so a client that sends
+# a burst of inputs catches up without taking over the server
+MAX_CATCHUP = 4
+
+# Sent snapshots and predicted states kept for deltas and reconciliation
+HISTORY = 64
+
+# Seconds without a packet before a session is dropped
+TIMEOUT = 5.0
+
+# Sessions a server runs at once; hellos from further clients are refused
+MAX_SESSIONS = 32
+
+MAX_PACKET = 1200
+
+# Packet types, the first byte of every packet
+HELLO = 1
+WELCOME = 2
+INPUT = 3
+SNAPSHOT = 4
+BYE = 5
+FULL = 6
+
+# Packet headers after the type byte
+WELCOME_HEADER = struct.Struct("<q")
+INPUT_HEADER = struct.Struct("<IIH")
+SNAPSHOT_HEADER = struct.Struct("<III")
+
+# Inputs that fit in one input packet, at four bits each. Every packet
+# repeats all the inputs the server has not confirmed, oldest first, up to
+# this many; the server ignores inputs further ahead than that.
+MAX_INPUTS = (MAX_PACKET - 1 - INPUT_HEADER.size) * 2
+
+State = collections.namedtuple(
+    "State",
+    [
+        "level",
+        "x",
+        "y",
+        "change_x",
+        "change_y",
+        "jump_buffer",
+        "air_ticks",
+        "camera_x",
+        "level_tick",
+        "score",
+        "life",
+        "game_over",
+        "game_won",
+    ],
+)
+State.__doc__ = """What a snapshot holds about one game
+
+Level contents (coins, enemies) are not included; see the module docstring.
+"""
+
+# How each State field is packed
+FIELD_KINDS = (
+    "int",
+    "int",
+    "int",
+    "int",
+    "float",
+    "int",
+    "int",
+    "int",
+    "int",
+    "int",
+    "int",
+    "bool",
+    "bool",
+)
+
+# Baseline for snapshots sent without one
+EMPTY_STATE = State(0, 0, 0, 0, 0.0, 0, 0, 0, 0, 0, 0, False, False)
+
+# Bits used for the length of a packed integer
+LENGTH_BITS = 6
+
+FLOAT = struct.Struct("<d")
+
+
+class BitWriter:
+    """Packs values into a byte string bit by bit"""
+
+    def __init__(self):
+        """Initialize writer"""
+        self.value = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        """Append an unsigned value using the given number of bits"""
+        self.value |= value << self.bits
+        self.bits += bits
+
+    def write_int(self, value):
+        """Append a signed integer, small magnitudes taking fewer bits"""
+        # Zigzag: 0, -1, 1, -2, ... become 0, 1, 2, 3, ...
+        value = value * 2 if value >= 0 else -value * 2 - 1
+        length = value.bit_length()
+        self.write(length, LENGTH_BITS)
+        self.write(value, length)
+
+    def to_bytes(self):
+        """The packed bits, padded to whole bytes"""
+        return self.value.to_bytes((self.bits + 7) // 8, "little")
+
+
+class BitReader:
+    """Reads values written by BitWriter"""
+
+    def __init__(self, data):
+        """Initialize reader"""
+        self.value = int.from_bytes(data, "little")
+        self.bits = len(data) * 8
+        self.position = 0
+
+    def read(self, bits):
+        """Read an unsigned value of the given number of bits"""
+        if self.position + bits > self.bits:
+            raise ValueError("Packet is truncated")
+        value = (self.value >> self.position) & ((1 << bits) - 1)
+        self.position += bits
+        return value
+
+    def read_int(self):
+        """Read a signed integer written with write_int()"""
+        value = self.read(self.read(LENGTH_BITS))
+        return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def game_state(simulation):
+    """The State of a simulation"""
+    player = simulation.player
+    return State(
+        simulation.current_level_no,
+        player.rect.x,
+        player.rect.y,
+        player.change_x,
+        player.change_y,
+        player.jump_buffer,
+        player.air_ticks,
+        simulation.current_level.camera.x,
+        simulation.current_level.tick,
+        player.score,
+        player.life,
+        simulation.game_over,
+        simulation.game_won,
+    )
+
+
+def apply_state(simulation, state):
+    """Overwrite a simulation's player and progress with a State
+
+    Coins and enemies are left as they are: they are not in a State, so
+    a client never corrects mispredicted coin pickups or enemy moves.
+    """
+    if state.level != simulation.current_level_no:
+        simulation.current_level_no = state.level
+        simulation.current_level = simulation.level_list[state.level]
+        simulation.player.level = simulation.current_level
+        simulation.level_list.prefetch(state.level + 1)
+
+    player = simulation.player
+    player.rect.x = state.x
+    player.rect.y = state.y
+    player.change_x = state.change_x
+    player.change_y = state.change_y
+    player.jump_buffer = state.jump_buffer
+    player.air_ticks = state.air_ticks
+    simulation.current_level.camera.x = state.camera_x
+    simulation.current_level.tick = state.level_tick
+    player.score = state.score
+    player.life = state.life
+    simulation.game_over = state.game_over
+    simulation.game_won = state.game_won
+
+
+def encode_snapshot(tick, ack, state, baseline_tick=0, baseline=EMPTY_STATE):
+    """Pack a snapshot as the changes from a baseline state
+
+    ack is the last input the state includes. A baseline_tick of 0 means
+    no baseline, and every field is sent relative to EMPTY_STATE.
+    """
+    writer = BitWriter()
+    for kind, value, base in zip(FIELD_KINDS, state, baseline):
+        if value == base:
+            writer.write(0, 1)
+            continue
+        writer.write(1, 1)
+        if kind == "int":
+            writer.write_int(value - base)
+        elif kind == "float":
+            writer.write(int.from_bytes(FLOAT.pack(value), "little"), 64)
+        else:
+            writer.write(int(value), 1)
+    header = SNAPSHOT_HEADER.pack(tick, ack, baseline_tick)
+    return bytes([SNAPSHOT]) + header + writer.to_bytes()
+
+
+def decode_snapshot(data, baselines):
+    """Unpack a snapshot, returning (tick, ack, state)
+
+    baselines maps snapshot ticks to states already received. Raises
+    KeyError if the snapshot's baseline is not among them.
+    """
+    tick, ack, baseline_tick = SNAPSHOT_HEADER.unpack_from(data, 1)
+    baseline = baselines[baseline_tick] if baseline_tick else EMPTY_STATE
+    reader = BitReader(data[1 + SNAPSHOT_HEADER.size :])
+
+    values = []
+    for kind, base in zip(FIELD_KINDS, baseline):
+        if not reader.read(1):
+            values.append(base)
+        elif kind == "int":
+            values.append(base + reader.read_int())
+        elif kind == "float":
+            values.append(FLOAT.unpack(reader.read(64).to_bytes(8, "little"))[0])
+        else:
+            values.append(bool(reader.read(1)))
+    return tick, ack, State(*values)
+
+
+def encode_inputs(ack, first, inputs):
+    """Pack a run of inputs starting at sequence number first
+
+    ack is the last snapshot tick received. Each input takes four bits.
+    """
+    writer = BitWriter()
+    for move, jump, restart in inputs:
+        writer.write(replay.pack(move, jump, restart), 4)
+    header = INPUT_HEADER.pack(ack, first, len(inputs))
+    return bytes([INPUT]) + header + writer.to_bytes()
+
+
+def decode_inputs(data):
+    """Unpack an input packet, returning (ack, first, inputs)"""
+    ack, first, count = INPUT_HEADER.unpack_from(data, 1)
+    reader = BitReader(data[1 + INPUT_HEADER.size :])
+    inputs = [Inputs(*replay.unpack(reader.read(4))) for _ in range(count)]
+    return ack, first, inputs
+
+
+class Session:
+    """One client's game on the server"""
+
+    def __init__(self, address, seed, now):
+        """Initialize session"""
+        self.address = address
+        self.simulation = Simulation(seed, prefetch=False)
+        self.last_heard = now
+
+        # Inputs received but not yet applied, by sequence number
+        self.pending = {}
+        # Sequence number of the last input applied
+        self.ack = 0
+        # Snapshot tick -> state sent then, for delta compression
+        self.sent = collections.OrderedDict()
+        # Last snapshot the client confirmed receiving
+        self.baseline_tick = 0
+
+    def receive_inputs(self, ack, first, inputs):
+        """Queue inputs from a packet
+
+        Inputs already applied are ignored, and so are ones too far ahead,
+        which the client sends again until they are applied.
+        """
+        for seq, tick_inputs in enumerate(inputs, first):
+            if self.ack < seq <= self.ack + MAX_INPUTS:
+                self.pending[seq] = tick_inputs
+        if ack in self.sent:
+            self.baseline_tick = max(self.baseline_tick, ack)
+
+    def advance(self):
+        """Apply the next inputs in order, up to MAX_CATCHUP of them"""
+        for _ in range(MAX_CATCHUP):
+            inputs = self.pending.pop(self.ack + 1, None)
+            if inputs is None:
+                break
+            self.simulation.step(inputs)
+            self.ack += 1
+
+    def snapshot(self, tick):
+        """Packet with the current state, as a delta when possible"""
+        state = game_state(self.simulation)
+        baseline = self.sent.get(self.baseline_tick)
+        if baseline is None:
+            packet = encode_snapshot(tick, self.ack, state)
+        else:
+            packet = encode_snapshot(
+                tick, self.ack, state, self.baseline_tick, baseline
+            )
+
+        self.sent[tick] = state
+        while len(self.sent) > HISTORY:
+            self.sent.popitem(last=False)
+        return packet
+
+
+class Server:
+    """Authoritative server running a game for every client"""
+
+    def __init__(
+        self, host="127.0.0.1", port=DEFAULT_PORT, seed=None, max_sessions=MAX_SESSIONS
+    ):
+        """Bind the server socket
+
+        With a seed, every session plays the same levels; otherwise each
+        session gets its own random seed. At most max_sessions clients
+        play at once.
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+        self.seed = seed
+        self.max_sessions = max_sessions
+
+        self.sessions = {}
+        self.tick = 0
+        self.bytes_sent = 0
+
+    def receive(self, now):
+        """Handle every packet waiting on the socket"""
+        while True:
+            try:
+                data, address = self.socket.recvfrom(MAX_PACKET)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            if not data:
+                continue
+
+            session = self.sessions.get(address)
+            if data[0] == HELLO:
+                if session is None:
+                    if len(self.sessions) >= self.max_sessions:
+                        self.send(bytes([FULL]), address)
+                        continue
+                    session = Session(address, self.seed, now)
+                    self.sessions[address] = session
+                seed = session.simulation.seed
+                self.send(bytes([WELCOME]) + WELCOME_HEADER.pack(seed), address)
+            elif session is None:
+                continue
+            elif data[0] == INPUT:
+                try:
+                    session.receive_inputs(*decode_inputs(data))
+                except (ValueError, struct.error):
+                    continue
+            elif data[0] == BYE:
+                del self.sessions[address]
+                continue
+            session.last_heard = now
+
+    def send(self, packet, address):
+        """Send a packet, dropping it if the socket is full"""
+        try:
+            self.socket.sendto(packet, address)
+        except (BlockingIOError, ConnectionResetError):
+            return
+        self.bytes_sent += len(packet)
+
+    def update(self, now):
+        """Run one server tick"""
+        self.receive(now)
+        self.tick += 1
+
+        for address, session in list(self.sessions.items()):
+            if now - session.last_heard > TIMEOUT:
+                del self.sessions[address]
+                continue
+            session.advance()
+            if self.tick % SNAPSHOT_INTERVAL == 0:
+                self.send(session.snapshot(self.tick), address)
+
+    def serve_forever(self):
+        """Run server ticks at the simulation rate until interrupted"""
+        next_tick = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now < next_tick:
+                select.select([self.socket], [], [], next_tick - now)
+                continue
+            self.update(now)
+            next_tick += TIMESTEP
+            # Skip ticks rather than running a burst after a stall
+            next_tick = max(next_tick, now - TIMESTEP)
+
+    def close(self):
+        """Close the server socket"""
+        self.socket.close()
+
+
+class Client:
+    """Plays a game hosted by a Server, predicting it locally"""
+
+    def __init__(self, address, timeout=5.0):
+        """Connect to a server, waiting up to timeout seconds for it"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.connect(address)
+        self.socket.settimeout(0.25)
+
+        seed = None
+        deadline = time.perf_counter() + timeout
+        while seed is None:
+            if time.perf_counter() > deadline:
+                self.socket.close()
+                raise ConnectionError(f"No answer from server at {address}")
+            self.socket.send(bytes([HELLO]))
+            try:
+                data = self.socket.recv(MAX_PACKET)
+            except (socket.timeout, ConnectionRefusedError):
+                continue
+            if data and data[0] == FULL:
+                self.socket.close()
+                raise ConnectionError(f"Server at {address} is full")
+            if data and data[0] == WELCOME:
+                (seed,) = WELCOME_HEADER.unpack_from(data, 1)
+        self.socket.setblocking(False)
+
+        self.simulation = Simulation(seed)
+
+        # Sequence number of the last input simulated
+        self.seq = 0
+        # Inputs the server has not confirmed yet, by sequence number
+        self.unacked = collections.OrderedDict()
+        # Predicted state after each unconfirmed input
+        self.predicted = {0: game_state(self.simulation)}
+        # Received snapshot tick -> state, for decoding deltas
+        self.snapshots = collections.OrderedDict()
+        self.last_snapshot = 0
+
+        # Times the prediction had to be corrected
+        self.corrections = 0
+        # When the server was last heard from
+        self.last_heard = time.perf_counter()
+
+    def step(self, inputs):
+        """Simulate one tick locally and send the input to the server
+
+        Raises ConnectionError once the server has not confirmed an input
+        for longer than one packet can hold; by then it has dropped the
+        session.
+        """
+        if len(self.unacked) >= MAX_INPUTS:
+            raise ConnectionError("Server stopped confirming inputs")
+        self.seq += 1
+        self.simulation.step(inputs)
+        self.unacked[self.seq] = inputs
+        self.predicted[self.seq] = game_state(self.simulation)
+
+        # Resend every unconfirmed input along with this one, so the server
+        # gets the ones it is waiting for however many packets were lost
+        first = next(iter(self.unacked))
+        inputs = list(self.unacked.values())
+        packet = encode_inputs(self.last_snapshot, first, inputs)
+        try:
+            self.socket.send(packet)
+        except (BlockingIOError, ConnectionRefusedError):
+            pass
+
+    def receive(self):
+        """Handle snapshots that have arrived and reconcile with them
+
+        Raises ConnectionError once no snapshot has arrived for TIMEOUT
+        seconds, as the server has dropped the session by then.
+        """
+        latest = None
+        while True:
+            try:
+                data = self.socket.recv(MAX_PACKET)
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+            if not data or data[0] != SNAPSHOT:
+                continue
+            self.last_heard = time.perf_counter()
+            try:
+                tick, ack, state = decode_snapshot(data, self.snapshots)
+            except (KeyError, ValueError, struct.error):
+                continue
+            if tick <= self.last_snapshot:
+                continue
+
+            self.snapshots[tick] = state
+            while len(self.snapshots) > HISTORY:
+                self.snapshots.popitem(last=False)
+            self.last_snapshot = tick
+            latest = (ack, state)
+
+        if latest is not None:
+            self.reconcile(*latest)
+        elif time.perf_counter() - self.last_heard > TIMEOUT:
+            raise ConnectionError("Server stopped sending snapshots")
+
+    def reconcile(self, ack, state):
+        """Correct the prediction with the server's state after input ack"""
+        predicted = self.predicted.get(ack)
+        for seq in [seq for seq in self.unacked if seq <= ack]:
+            del self.unacked[seq]
+        # Keep the prediction for ack itself, later snapshots may repeat it
+        for seq in [seq for seq in self.predicted if seq < ack]:
+            del self.predicted[seq]
+
+        if predicted == state:
+            return
+
+        # Rewind to the server's state and replay what it has not seen
+        self.corrections += 1
+        apply_state(self.simulation, state)
+        for seq, inputs in self.unacked.items():
+            self.simulation.step(inputs)
+            self.predicted[seq] = game_state(self.simulation)
+
+    def close(self):
+        """Tell the server the session is over and close the socket"""
+        try:
+            self.socket.send(bytes([BYE]))
+        except OSError:
+            pass
+        self.socket.close()
+
+
+def run_server(argv=None):
+    """Run a server from the command line"""
+    parser = argparse.ArgumentParser(description="Platformer game server")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--seed", type=int, help="same levels for every session")
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=MAX_SESSIONS,
+        help="clients that can play at once",
+    )
+    args = parser.parse_args(argv)
+
+    server = Server(args.host, args.port, args.seed, args.max_sessions)
+    print(f"Serving on {server.address[0]}:{server.address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    run_server()
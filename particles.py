@@ -0,0 +1,221 @@
+"""Particle bursts for coins and hurts, kept in preallocated NumPy arrays
+
+A ParticleSystem holds a fixed pool of particles as one array per field
+(position, velocity, age, lifetime, color). Bursts are written into the
+pool as a ring: a burst takes the slots after the last one, overwriting
+the oldest particles when the pool is full. Every tick moves all the
+particles with a few in-place array operations, and drawing blends them
+straight into the screen's packed 32-bit pixels with integer arithmetic
+on whole arrays, so a burst of thousands of particles creates no Python
+objects at all. Screens of other depths are blended through a 32-bit
+copy of the area the particles cover.
+
+Particles are only for show. They use their own random numbers and are
+not part of the simulation, snapshots or replays.
+"""
+
+import collections
+
+import numpy as np
+import pygame
+
+# Particles alive at once; beyond that, new bursts replace the oldest
+CAPACITY = 16384
+
+# Pixels per tick squared, and velocity kept per tick
+GRAVITY = 0.25
+DRAG = 0.98
+
+# Width and height of a particle in pixels
+SIZE = 3
+
+Burst = collections.namedtuple("Burst", ["count", "speed", "lift", "ticks", "colors"])
+Burst.__doc__ = """How a player event looks
+
+count particles fly out at up to speed pixels per tick, pushed up by
+lift, and live between ticks[0] and ticks[1] ticks.
+"""
+
+# Player event -> Burst (events are named in main.py)
+BURSTS = {
+    "coin": Burst(150, 3.0, 2.0, (20, 40), [(255, 215, 0), (255, 255, 160)]),
+    "lava": Burst(
+        1500, 5.0, 4.0, (30, 70), [(255, 69, 0), (255, 140, 0), (255, 220, 80)]
+    ),
+    "spike": Burst(600, 4.0, 2.0, (20, 45), [(192, 192, 192), (220, 20, 60)]),
+    "enemy": Burst(600, 4.0, 2.0, (20, 45), [(139, 0, 0), (128, 0, 128)]),
+}
+
+# Even and odd bytes of a 32-bit pixel. Blending every other byte at once
+# leaves each byte 16 bits of room for its product with alpha
+_EVEN_BYTES = np.uint32(0x00FF00FF)
+_ODD_BYTES = np.uint32(0xFF00FF00)
+
+
+class ParticleSystem:
+    """Pool of particles fed by the player's events
+
+    Call update() after each simulation tick and project() then draw()
+    each frame.
+    """
+
+    def __init__(self, capacity=CAPACITY, seed=None):
+        """Initialize an empty pool"""
+        self.capacity = capacity
+        self.x = np.zeros(capacity, dtype=np.float32)
+        self.y = np.zeros(capacity, dtype=np.float32)
+        self.change_x = np.zeros(capacity, dtype=np.float32)
+        self.change_y = np.zeros(capacity, dtype=np.float32)
+        # A particle is alive while its age is below its lifetime
+        self.age = np.zeros(capacity, dtype=np.float32)
+        self.lifetime = np.zeros(capacity, dtype=np.float32)
+        self.color = np.zeros((capacity, 3), dtype=np.uint32)
+
+        # Slot the next burst starts at, and ticks until every particle
+        # is dead, so an idle pool costs nothing
+        self.head = 0
+        self.remaining = 0
+        self.rng = np.random.default_rng(seed)
+
+        # Level the particles belong to, and the player's center on the
+        # tick before, where hurts happened before dropping it back in
+        self.level = None
+        self.last_center = None
+
+        # Screen pixels and blending of the live particles, and the area
+        # they cover, from project()
+        self.projected = None
+        self.area = None
+
+    def __len__(self):
+        """Number of live particles"""
+        if not self.remaining:
+            return 0
+        return int(np.count_nonzero(self.age < self.lifetime))
+
+    def clear(self):
+        """Kill every particle"""
+        self.lifetime[:] = 0
+        self.age[:] = 0
+        self.remaining = 0
+        self.projected = None
+
+    def emit(self, x, y, burst):
+        """Spray a burst of particles out from a world position"""
+        count = min(burst.count, self.capacity)
+        slots = (self.head + np.arange(count)) % self.capacity
+        self.head = (self.head + count) % self.capacity
+
+        rng = self.rng
+        angle = rng.uniform(0, 2 * np.pi, count)
+        speed = burst.speed * np.sqrt(rng.uniform(0, 1, count))
+        self.x[slots] = x
+        self.y[slots] = y
+        self.change_x[slots] = np.cos(angle) * speed
+        self.change_y[slots] = np.sin(angle) * speed - burst.lift
+        self.age[slots] = 0
+        self.lifetime[slots] = rng.integers(*burst.ticks, count, endpoint=True)
+        colors = np.array(burst.colors, dtype=np.uint32)
+        self.color[slots] = colors[rng.integers(0, len(colors), count)]
+        self.remaining = max(self.remaining, burst.ticks[1])
+
+    def step(self):
+        """Move every particle on by one tick"""
+        if not self.remaining:
+            return
+        self.remaining -= 1
+        self.x += self.change_x
+        self.y += self.change_y
+        self.change_x *= DRAG
+        self.change_y *= DRAG
+        self.change_y += GRAVITY
+        self.age += 1
+
+    def update(self, simulation):
+        """Advance a tick and burst out for the player's events of it"""
+        player = simulation.player
+        if simulation.current_level is not self.level:
+            # Particles stay behind in the level they were made in
+            self.clear()
+            self.level = simulation.current_level
+            self.last_center = None
+
+        self.step()
+        center = self.last_center or player.rect.center
+        for event in player.events:
+            burst = BURSTS.get(event)
+            if burst is not None:
+                self.emit(*center, burst)
+        self.last_center = player.rect.center
+
+    def project(self, camera_x, size):
+        """Place the live particles on a screen of size scrolled by camera_x
+
+        Returns the screen area they cover, or None if none are visible.
+        """
+        self.projected = None
+        if not self.remaining:
+            return None
+
+        alive = np.flatnonzero(self.age < self.lifetime)
+        x = (self.x[alive] - camera_x).astype(np.intp)
+        y = self.y[alive].astype(np.intp)
+        width, height = size
+        shown = (x >= 0) & (x <= width - SIZE) & (y >= 0) & (y <= height - SIZE)
+        if not shown.any():
+            return None
+        alive = alive[shown]
+        x = x[shown]
+        y = y[shown]
+
+        # Fade out over the particle's life, in 256ths
+        alpha = (256 * (1 - self.age[alive] / self.lifetime[alive])).astype(np.uint32)
+        self.projected = (x, y, self.color[alive], alpha)
+        left = int(x.min())
+        top = int(y.min())
+        self.area = pygame.Rect(
+            left, top, int(x.max()) - left + SIZE, int(y.max()) - top + SIZE
+        )
+        return self.area
+
+    def draw(self, surface):
+        """Blend the particles placed by project() into a surface"""
+        if self.projected is None:
+            return
+        x, y, color, alpha = self.projected
+        if surface.get_bytesize() == 4:
+            blend(surface, x, y, color, alpha)
+            return
+
+        # Other depths go through a 32-bit copy of the area covered
+        area = self.area
+        layer = pygame.Surface(area.size, 0, 32)
+        layer.blit(surface, (0, 0), area)
+        blend(layer, x - area.x, y - area.y, color, alpha)
+        surface.blit(layer, area)
+
+
+def blend(surface, x, y, color, alpha):
+    """Blend SIZE-pixel squares with top left x, y into a 32-bit surface"""
+    pitch = surface.get_pitch() // 4
+    count = SIZE * SIZE
+
+    # Every pixel of every particle, as indexes into the flat pixels
+    square = (np.arange(SIZE)[:, np.newaxis] * pitch + np.arange(SIZE)).ravel()
+    index = ((y * pitch + x)[:, np.newaxis] + square).ravel()
+
+    red, green, blue = surface.get_shifts()[:3]
+    packed = (color[:, 0] << red) | (color[:, 1] << green) | (color[:, 2] << blue)
+    packed = np.repeat(packed, count)
+    alpha = np.repeat(alpha, count)
+    keep = 256 - alpha
+    channels = np.uint32(sum(surface.get_masks()[:3]))
+
+    pixels = np.frombuffer(surface.get_buffer(), dtype=np.uint32)
+    under = pixels[index]
+    even = ((under & _EVEN_BYTES) * keep + (packed & _EVEN_BYTES) * alpha) >> 8
+    odd = (under >> 8 & _EVEN_BYTES) * keep + (packed >> 8 & _EVEN_BYTES) * alpha
+    blended = (even & _EVEN_BYTES) | (odd & _ODD_BYTES)
+    pixels[index] = (blended & channels) | (under & ~channels)
+    # Unlock the surface
+    del pixels
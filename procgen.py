@@ -0,0 +1,149 @@
+"""Procedural generation of an endless level in fixed-width chunks
+
+Each chunk is a row of platforms generated only from the session seed and
+the chunk's index, so any chunk can be dropped and rebuilt identically
+later. The first platform of every chunk sits at an "anchor" height that
+also depends only on the seed and index; each chunk's platforms are chosen
+so that every jump, including the one onto the next chunk's anchor, is
+within reach of the player's jump.
+"""
+
+import collections
+import random
+
+from enemies import KIND_NAMES
+from spatial import rect_round
+
+# Width of a chunk in world pixels, one screen
+CHUNK_WIDTH = 800
+
+# Platforms per chunk, each in its own equal-width slot
+SLOTS = 4
+SLOT_WIDTH = CHUNK_WIDTH // SLOTS
+
+PLATFORM_HEIGHT = 30
+PLATFORM_WIDTHS = (120, 170)
+
+# Range of platform tops; lower on screen is a bigger y
+MIN_Y = 200
+MAX_Y = 520
+
+# Largest step up and down between neighbouring platforms
+MAX_RISE = 90
+MAX_DROP = 200
+
+# Chance of a coin, spike or enemy on a platform
+COIN_CHANCE = 0.3
+SPIKE_CHANCE = 0.25
+ENEMY_CHANCE = 0.25
+
+# Width of the player, the margin allowed for jumping early
+PLAYER_WIDTH = 40
+
+Chunk = collections.namedtuple(
+    "Chunk", ["index", "platforms", "coins", "spikes", "enemies"]
+)
+Chunk.__doc__ = """Contents of one chunk in world coordinates
+
+platforms are [width, height, x, y] lists like in level files, coins and
+spikes (x, y) positions. Coins are numbered by their position in the list.
+enemies are (platform number, kind) pairs.
+"""
+
+
+def jump_arc(jump_speed, gravity, run_speed):
+    """(distance, height) of the player's feet each tick of a running jump
+
+    Follows Player.calc_grav() and the vertical move in Player.update()
+    until the player is back down at the height it jumped from.
+    """
+    change_y = jump_speed
+    distance = height = 0
+    while True:
+        change_y += gravity
+        # The player's new y is rounded, not the move on its own; take off
+        # from the lowest platform to round the same way as on screen
+        y = MAX_Y - height
+        height -= rect_round(y + change_y) - y
+        distance += run_speed
+        if height <= 0 and change_y > 0:
+            return
+        yield distance, height
+
+
+def can_reach(gap, rise, jump_speed, gravity, run_speed):
+    """Whether a running jump clears a gap onto a platform rise pixels up
+
+    gap is measured from where the player's front edge leaves the ground to
+    the near edge of the landing platform.
+    """
+    for distance, height in jump_arc(jump_speed, gravity, run_speed):
+        if distance > gap and height > rise:
+            return True
+    return False
+
+
+class ChunkGenerator:
+    """Builds reachable chunks of platforms, coins and spikes"""
+
+    def __init__(self, seed, jump_speed, gravity, run_speed):
+        """Initialize generator with the player's movement model"""
+        self.seed = seed
+        self.physics = (jump_speed, gravity, run_speed)
+
+    def anchor(self, index):
+        """Height of the first platform of a chunk"""
+        if index == 0:
+            # Start low, under a player arriving from the previous level
+            return MAX_Y
+        return random.Random(f"{self.seed}:anchor:{index}").randint(MIN_Y, MAX_Y)
+
+    def chunk(self, index):
+        """Generate one chunk"""
+        rng = random.Random(f"{self.seed}:chunk:{index}")
+        next_anchor = self.anchor(index + 1)
+
+        platforms = []
+        y = self.anchor(index)
+        for slot in range(SLOTS):
+            if slot > 0:
+                # Stay within a jump of the last platform and leave enough
+                # slots to climb to the next chunk's anchor
+                steps_left = SLOTS - slot
+                low = max(MIN_Y, y - MAX_RISE)
+                high = min(MAX_Y, y + MAX_DROP, next_anchor + MAX_RISE * steps_left)
+                y = rng.randint(low, high)
+
+            x = index * CHUNK_WIDTH + slot * SLOT_WIDTH
+            width = rng.randint(*PLATFORM_WIDTHS)
+            if index == 0 and slot == 0:
+                # Wide enough to catch a player placed at the level start
+                width = PLATFORM_WIDTHS[1]
+            platforms.append([width, PLATFORM_HEIGHT, x, y])
+
+        # Check every jump, including onto the next chunk, allowing for a
+        # take-off up to a player width before the edge
+        for (width, _, x, y), (_, _, next_x, next_y) in zip(
+            platforms, platforms[1:] + [[0, 0, (index + 1) * CHUNK_WIDTH, next_anchor]]
+        ):
+            gap = next_x - (x + width) + PLAYER_WIDTH
+            if not can_reach(gap, y - next_y, *self.physics):
+                raise ValueError(f"Chunk {index} has a jump the player cannot make")
+
+        coins = []
+        spikes = []
+        for slot, (width, _, x, y) in enumerate(platforms):
+            if rng.random() < COIN_CHANCE:
+                coins.append((x + rng.randint(0, width - 20), y - 40))
+            # Keep the anchor platform safe to land on
+            if slot > 0 and rng.random() < SPIKE_CHANCE:
+                spikes.append((x + rng.randint(0, width - 20), y - 20))
+
+        # Drawn from their own stream so they never change the layout
+        enemy_rng = random.Random(f"{self.seed}:enemies:{index}")
+        enemies = []
+        for slot in range(1, SLOTS):
+            if enemy_rng.random() < ENEMY_CHANCE:
+                enemies.append((slot, enemy_rng.choice(KIND_NAMES)))
+
+        return Chunk(index, platforms, coins, spikes, enemies)
@@ -0,0 +1,216 @@
+"""Frame time profiling with per-phase timing
+
+Wrap each part of a frame in profiler.phase(name) and call start_frame()
+and end_frame() around the whole frame. The profiler keeps the timings of
+the most recent frames for rolling percentiles, can draw them as an
+overlay and export them as CSV or JSON.
+"""
+
+import collections
+import contextlib
+import csv
+import json
+import time
+
+import pygame
+
+# Phases that are spent waiting rather than working, left out of frame time
+IDLE_PHASES = {"wait"}
+
+# Seconds between updates of the overlay's numbers
+OVERLAY_REFRESH = 0.25
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """Nearest-rank percentiles of some values, keyed by percentile
+
+    All zero when there are no values.
+    """
+    values = sorted(values)
+    if not values:
+        return {point: 0.0 for point in points}
+    result = {}
+    for point in points:
+        rank = max(1, -(-point * len(values) // 100))
+        result[point] = values[rank - 1]
+    return result
+
+
+class _Phase:
+    """Context manager adding its duration to one phase of the frame"""
+
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+
+
+class NullProfiler:
+    """Profiler that records nothing, for when profiling is off"""
+
+    _phase = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def start_frame(self):
+        pass
+
+    def end_frame(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class FrameProfiler:
+    """Collects per-phase timings over a rolling window of frames"""
+
+    def __init__(self, window=600, keep_history=False):
+        """Initialize profiler
+
+        Only the last window frames are kept unless keep_history is set,
+        which is needed for export() to include the whole session.
+        """
+        # Timings of recent frames: phase name -> seconds, plus "frame"
+        self.frames = collections.deque(maxlen=window)
+        # Every frame since the start, for export
+        self.keep_history = keep_history
+        self.history = []
+        self.timings = {}
+        self.frame_start = None
+        self.frame_no = 0
+
+        # Whether the overlay is shown, and its last rendering with the
+        # font and time it was made with
+        self.visible = False
+        self.overlay = None
+        self.overlay_font = None
+        self.overlay_time = 0.0
+
+    def phase(self, name):
+        """Time the enclosed block as part of the named phase"""
+        return _Phase(self.timings, name)
+
+    def start_frame(self):
+        """Mark the start of a frame"""
+        self.timings = {}
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Mark the end of a frame and record its timings"""
+        if self.frame_start is None:
+            return
+        elapsed = time.perf_counter() - self.frame_start
+        idle = sum(self.timings.get(name, 0.0) for name in IDLE_PHASES)
+        self.timings["frame"] = elapsed - idle
+
+        self.frame_no += 1
+        self.frames.append(self.timings)
+        if self.keep_history:
+            self.history.append((self.frame_no, self.timings))
+        self.frame_start = None
+
+    def percentiles(self, name="frame", points=(50, 95, 99)):
+        """Rolling percentiles of a phase in seconds, keyed by percentile"""
+        return percentiles((frame.get(name, 0.0) for frame in self.frames), points)
+
+    def phase_names(self):
+        """Names of all phases seen in the window, frame last"""
+        names = {}
+        for frame in self.frames:
+            names.update(dict.fromkeys(frame))
+        names.pop("frame", None)
+        return list(names) + ["frame"]
+
+    def summary(self):
+        """Mean and percentiles of every phase in milliseconds"""
+        summary = {}
+        count = len(self.frames) or 1
+        for name in self.phase_names():
+            total = sum(frame.get(name, 0.0) for frame in self.frames)
+            stats = {"mean": total / count * 1000}
+            for point, value in self.percentiles(name).items():
+                stats[f"p{point}"] = value * 1000
+            summary[name] = stats
+        return summary
+
+    def draw(self, screen, font):
+        """Draw the overlay in the top right corner, returning its rect
+
+        The overlay is only worked out and rendered again every
+        OVERLAY_REFRESH seconds; other frames blit the last rendering.
+        """
+        now = time.perf_counter()
+        if (
+            self.overlay is None
+            or self.overlay_font is not font
+            or now - self.overlay_time >= OVERLAY_REFRESH
+        ):
+            self.overlay = self.render_overlay(font)
+            self.overlay_font = font
+            self.overlay_time = now
+
+        rect = self.overlay.get_rect(topright=(screen.get_width(), 0))
+        screen.blit(self.overlay, rect)
+        return rect
+
+    def render_overlay(self, font):
+        """Image of the rolling percentiles of every phase"""
+        lines = ["   phase    p50    p95    p99"]
+        for name, stats in self.summary().items():
+            lines.append(
+                f"{name:>8} {stats['p50']:6.2f} {stats['p95']:6.2f} "
+                f"{stats['p99']:6.2f} ms"
+            )
+        images = [font.render(line, True, (255, 255, 255)) for line in lines]
+        width = max((image.get_width() for image in images), default=0) + 10
+        height = sum(image.get_height() for image in images) + 10
+
+        overlay = pygame.Surface((width, height))
+        y = 5
+        for image in images:
+            overlay.blit(image, (5, y))
+            y += image.get_height()
+        return overlay
+
+    def export(self, path):
+        """Write every recorded frame to a .csv file, or JSON otherwise"""
+        history = self.history
+        if not self.keep_history:
+            first = self.frame_no - len(self.frames) + 1
+            history = list(enumerate(self.frames, first))
+
+        names = []
+        for _, timings in history:
+            for name in timings:
+                if name not in names:
+                    names.append(name)
+
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["frame_no"] + [f"{name}_ms" for name in names])
+                for frame_no, timings in history:
+                    writer.writerow(
+                        [frame_no]
+                        + [f"{timings.get(name, 0.0) * 1000:.4f}" for name in names]
+                    )
+        else:
+            data = {
+                "summary_ms": self.summary(),
+                "frames_ms": [
+                    {name: timings.get(name, 0.0) * 1000 for name in names}
+                    for _, timings in history
+                ],
+            }
+            with open(path, "w") as f:
+                json.dump(data, f, indent=2)
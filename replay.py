@@ -0,0 +1,78 @@
+"""Recording and loading of per-tick inputs
+
+A replay file holds the seed the levels were generated from followed by
+the input of every simulation tick, run-length encoded: each run is one
+byte of packed input and one byte counting how many ticks it lasted.
+Together with the seed that is enough to re-simulate a session exactly,
+as long as the game rules have not changed since; files recorded before a
+change are rejected rather than played back differently.
+"""
+
+import struct
+
+# Magic and session seed
+HEADER = struct.Struct("<4sq")
+# Bump the number whenever a change to the game would make old recordings
+# play out differently (RPL2: jump buffering and coyote time, swept
+# collisions and enemies)
+MAGIC = b"RPL2"
+
+# Longest run a single count byte can hold
+MAX_RUN = 255
+
+
+def pack(move, jump, restart):
+    """Pack one tick of input into a byte"""
+    return (move + 1) | (jump << 2) | (restart << 3)
+
+
+def unpack(code):
+    """Inverse of pack(), as a (move, jump, restart) tuple"""
+    return (code & 3) - 1, bool(code & 4), bool(code & 8)
+
+
+class Recorder:
+    """Collects the input of every tick of a session"""
+
+    def __init__(self, seed):
+        """Initialize recorder"""
+        self.seed = seed
+        # Runs of [packed input, tick count]
+        self.runs = []
+
+    def record(self, inputs):
+        """Add the input used for one tick"""
+        code = pack(inputs.move, inputs.jump, inputs.restart)
+        if self.runs and self.runs[-1][0] == code and self.runs[-1][1] < MAX_RUN:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([code, 1])
+
+    def save(self, path):
+        """Write the recording to a file"""
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.seed))
+            f.write(bytes(value for run in self.runs for value in run))
+
+
+def load(path):
+    """Read a replay file, returning the seed and a list of per-tick inputs"""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not a replay file")
+    magic, seed = HEADER.unpack_from(data)
+    if magic[:3] == MAGIC[:3] and magic != MAGIC:
+        raise ValueError(f"{path} was recorded by an incompatible version")
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a replay file")
+
+    runs = data[HEADER.size :]
+    if len(runs) % 2:
+        raise ValueError(f"{path} is truncated")
+
+    inputs = []
+    for i in range(0, len(runs), 2):
+        inputs.extend([unpack(runs[i])] * runs[i + 1])
+    return seed, inputs
@@ -0,0 +1,360 @@
+"""Snapshots of a whole game that can be restored or saved as bytes
+
+capture() records the player, the progress through the levels and the
+state of every level built so far. Level contents are shared with earlier
+snapshots while they are unchanged (see EntityGroup.state()), so taking a
+snapshot every tick mostly copies the player, the scroll positions and
+the enemies. restore() puts a Simulation back to a snapshot, only
+touching what changed since; levels built after the snapshot are dropped
+and will be built fresh when reached.
+
+Snapshots convert to a compact binary blob with to_bytes() and back with
+from_bytes(), for checkpoints on disk or sending over the network. A blob
+can be restored into any Simulation with the same seed.
+"""
+
+import collections
+import struct
+
+import enemies
+from spatial import GroupState
+
+PlayerState = collections.namedtuple(
+    "PlayerState",
+    [
+        "x",
+        "y",
+        "change_x",
+        "change_y",
+        "score",
+        "life",
+        "jump_buffer",
+        "air_ticks",
+    ],
+)
+
+LevelState = collections.namedtuple(
+    "LevelState",
+    [
+        "camera_x",
+        "tick",
+        "platforms",
+        "coins",
+        "spikes",
+        "enemies",
+        "chunks",
+        "collected",
+    ],
+)
+LevelState.__doc__ = """Saved state of one level
+
+enemies is a tuple of EnemyState in the order the enemies were added.
+chunks and collected are None except for streamed levels (InfiniteLevel).
+chunks then holds (chunk index, ((group number, slot, serial), ...),
+((coin number, slot, serial), ...)) per loaded chunk, group number 0 for
+platforms and 1 for spikes.
+"""
+
+Snapshot = collections.namedtuple(
+    "Snapshot",
+    ["seed", "tick", "level_no", "game_over", "game_won", "player", "levels"],
+)
+Snapshot.__doc__ = """Saved state of a Simulation
+
+levels is a tuple of (level number, LevelState) for every level built.
+"""
+
+MAGIC = b"SNP2"
+HEADER = struct.Struct("<4sqQiBBI")
+PLAYER = struct.Struct("<iiidiiiq")
+LEVEL = struct.Struct("<iqqB")
+GROUP = struct.Struct("<qII")
+CHUNK = struct.Struct("<qII")
+CHUNK_SPRITE = struct.Struct("<BIq")
+CHUNK_COIN = struct.Struct("<IIq")
+COLLECTED = struct.Struct("<qI")
+COUNT = struct.Struct("<I")
+# Kind, whether it has a chunk, chunk, left, top, right, offset, phase, tick
+ENEMY = struct.Struct("<BBqiiiiiq")
+
+
+def _level_state(level):
+    """Save one level"""
+    chunks = collected = None
+    if getattr(level, "chunks", None) is not None:
+        chunks = tuple(
+            (
+                index,
+                tuple(
+                    (int(sprite.group is level.spike_list), sprite.index, sprite.serial)
+                    for sprite in sprites
+                ),
+                tuple(
+                    (number, coin.index, coin.serial) for number, coin in coins.items()
+                ),
+            )
+            for index, (sprites, coins) in level.chunks.items()
+        )
+        collected = frozenset(level.collected)
+
+    return LevelState(
+        level.camera.x,
+        level.tick,
+        level.platform_list.state(),
+        level.coin_list.state(),
+        level.spike_list.state(),
+        tuple(enemy.state() for enemy in level.enemy_list),
+        chunks,
+        collected,
+    )
+
+
+def capture(simulation):
+    """Take a snapshot of a simulation"""
+    levels = []
+    for level_no, future in sorted(simulation.level_list.levels.items()):
+        # Levels still being built in the background have not been played
+        if future.done() and future.exception() is None:
+            levels.append((level_no, _level_state(future.result())))
+
+    player = simulation.player
+    return Snapshot(
+        simulation.seed,
+        simulation.tick,
+        simulation.current_level_no,
+        simulation.game_over,
+        simulation.game_won,
+        PlayerState(
+            player.rect.x,
+            player.rect.y,
+            player.change_x,
+            player.change_y,
+            player.score,
+            player.life,
+            player.jump_buffer,
+            player.air_ticks,
+        ),
+        tuple(levels),
+    )
+
+
+def _restore_level(level, state):
+    """Put one level back to a saved state"""
+    level.camera.x = state.camera_x
+    level.tick = state.tick
+    level.platform_list.restore(state.platforms)
+    level.coin_list.restore(state.coins)
+    level.spike_list.restore(state.spikes)
+
+    # Enemies move every tick, so they are always rebuilt
+    restored = [enemies.from_state(enemy) for enemy in state.enemies]
+    level.enemy_list = enemies.EnemyGroup(*restored)
+
+    if state.chunks is not None:
+        groups = (level.platform_list, level.spike_list)
+        level.chunks = {
+            index: (
+                [
+                    groups[group].entity_class(groups[group], slot, serial)
+                    for group, slot, serial in sprites
+                ],
+                {
+                    number: level.coin_list.entity_class(level.coin_list, slot, serial)
+                    for number, slot, serial in coins
+                },
+            )
+            for index, sprites, coins in state.chunks
+        }
+        level.collected = set(state.collected)
+        level.chunk_enemies = {index: [] for index in level.chunks}
+        for enemy in restored:
+            level.chunk_enemies[enemy.chunk].append(enemy)
+
+
+def restore(simulation, snapshot):
+    """Put a simulation back to a snapshot"""
+    if snapshot.seed != simulation.seed:
+        raise ValueError("Snapshot is from a game with a different seed")
+
+    loader = simulation.level_list
+    saved = dict(snapshot.levels)
+    for level_no in list(loader.levels):
+        if level_no not in saved:
+            del loader.levels[level_no]
+    for level_no, state in saved.items():
+        _restore_level(loader[level_no], state)
+
+    simulation.tick = snapshot.tick
+    simulation.current_level_no = snapshot.level_no
+    simulation.current_level = loader[snapshot.level_no]
+    simulation.game_over = snapshot.game_over
+    simulation.game_won = snapshot.game_won
+    loader.prefetch(snapshot.level_no + 1)
+
+    player = simulation.player
+    state = snapshot.player
+    player.rect.x = state.x
+    player.rect.y = state.y
+    player.change_x = state.change_x
+    player.change_y = state.change_y
+    player.score = state.score
+    player.life = state.life
+    player.jump_buffer = state.jump_buffer
+    player.air_ticks = state.air_ticks
+    player.level = simulation.current_level
+
+
+def _pack_group(state):
+    """Bytes of a GroupState"""
+    slots = len(state.serials) // 8
+    free = struct.pack(f"<{len(state.free)}I", *state.free)
+    return b"".join(
+        [
+            GROUP.pack(state.counter, slots, len(state.free)),
+            state.left,
+            state.top,
+            state.width,
+            state.height,
+            state.serials,
+            free,
+        ]
+    )
+
+
+def _unpack_group(data, offset):
+    """Read a GroupState written by _pack_group(), returning it and the end"""
+    counter, slots, free_count = GROUP.unpack_from(data, offset)
+    offset += GROUP.size
+    arrays = []
+    for size in (4, 4, 4, 4, 8):
+        arrays.append(bytes(data[offset : offset + slots * size]))
+        offset += slots * size
+    free = struct.unpack_from(f"<{free_count}I", data, offset)
+    offset += free_count * 4
+    return GroupState(None, counter, *arrays, free, None), offset
+
+
+def to_bytes(snapshot):
+    """Serialize a snapshot"""
+    parts = [
+        HEADER.pack(
+            MAGIC,
+            snapshot.seed,
+            snapshot.tick,
+            snapshot.level_no,
+            snapshot.game_over,
+            snapshot.game_won,
+            len(snapshot.levels),
+        ),
+        PLAYER.pack(*snapshot.player),
+    ]
+    for level_no, state in snapshot.levels:
+        streamed = state.chunks is not None
+        parts.append(LEVEL.pack(level_no, state.camera_x, state.tick, streamed))
+        for group in (state.platforms, state.coins, state.spikes):
+            parts.append(_pack_group(group))
+        parts.append(COUNT.pack(len(state.enemies)))
+        for enemy in state.enemies:
+            parts.append(
+                ENEMY.pack(
+                    enemies.KIND_NAMES.index(enemy.kind),
+                    enemy.chunk is not None,
+                    enemy.chunk or 0,
+                    *enemy[2:],
+                )
+            )
+        if not streamed:
+            continue
+
+        parts.append(COUNT.pack(len(state.chunks)))
+        for index, sprites, coins in state.chunks:
+            parts.append(CHUNK.pack(index, len(sprites), len(coins)))
+            parts.extend(CHUNK_SPRITE.pack(*sprite) for sprite in sprites)
+            parts.extend(CHUNK_COIN.pack(*coin) for coin in coins)
+        parts.append(COUNT.pack(len(state.collected)))
+        parts.extend(COLLECTED.pack(*key) for key in sorted(state.collected))
+    return b"".join(parts)
+
+
+def from_bytes(data):
+    """Read a snapshot written by to_bytes()"""
+    data = memoryview(data)
+    try:
+        magic, seed, tick, level_no, game_over, game_won, count = HEADER.unpack_from(
+            data
+        )
+        if magic != MAGIC:
+            raise ValueError("Not a snapshot")
+        offset = HEADER.size
+        player = PlayerState(*PLAYER.unpack_from(data, offset))
+        offset += PLAYER.size
+
+        levels = []
+        for _ in range(count):
+            number, camera_x, level_tick, streamed = LEVEL.unpack_from(data, offset)
+            offset += LEVEL.size
+            groups = []
+            for _ in range(3):
+                group, offset = _unpack_group(data, offset)
+                groups.append(group)
+
+            (enemy_count,) = COUNT.unpack_from(data, offset)
+            offset += COUNT.size
+            level_enemies = []
+            for _ in range(enemy_count):
+                kind, has_chunk, chunk, *rest = ENEMY.unpack_from(data, offset)
+                offset += ENEMY.size
+                level_enemies.append(
+                    enemies.EnemyState(
+                        enemies.KIND_NAMES[kind], chunk if has_chunk else None, *rest
+                    )
+                )
+
+            chunks = collected = None
+            if streamed:
+                chunks = []
+                (chunk_count,) = COUNT.unpack_from(data, offset)
+                offset += COUNT.size
+                for _ in range(chunk_count):
+                    index, sprite_count, coin_count = CHUNK.unpack_from(data, offset)
+                    offset += CHUNK.size
+                    sprites = tuple(
+                        CHUNK_SPRITE.unpack_from(data, offset + i * CHUNK_SPRITE.size)
+                        for i in range(sprite_count)
+                    )
+                    offset += sprite_count * CHUNK_SPRITE.size
+                    coins = tuple(
+                        CHUNK_COIN.unpack_from(data, offset + i * CHUNK_COIN.size)
+                        for i in range(coin_count)
+                    )
+                    offset += coin_count * CHUNK_COIN.size
+                    chunks.append((index, sprites, coins))
+                chunks = tuple(chunks)
+
+                (collected_count,) = COUNT.unpack_from(data, offset)
+                offset += COUNT.size
+                collected = frozenset(
+                    COLLECTED.unpack_from(data, offset + i * COLLECTED.size)
+                    for i in range(collected_count)
+                )
+                offset += collected_count * COLLECTED.size
+
+            levels.append(
+                (
+                    number,
+                    LevelState(
+                        camera_x,
+                        level_tick,
+                        *groups,
+                        tuple(level_enemies),
+                        chunks,
+                        collected,
+                    ),
+                )
+            )
+    except (struct.error, IndexError) as error:
+        raise ValueError(f"Snapshot is truncated: {error}") from None
+
+    return Snapshot(
+        seed, tick, level_no, bool(game_over), bool(game_won), player, tuple(levels)
+    )
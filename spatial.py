@@ -0,0 +1,440 @@
+"""Grid-indexed groups for fast collision queries in world coordinates
+
+SpatialGroup indexes ordinary pygame sprites. EntityGroup stores many
+small static entities (platforms, coins, spikes) as parallel arrays
+instead of one sprite object each, and hands out Entity views on demand.
+"""
+
+import array
+import collections
+import itertools
+
+import pygame
+
+# Size of one grid cell in pixels, roughly one platform wide
+CELL_SIZE = 128
+
+
+# Version numbers for EntityGroup contents, unique across all groups and
+# over the whole run, so equal versions always mean equal contents
+_versions = itertools.count(1)
+
+GroupState = collections.namedtuple(
+    "GroupState",
+    [
+        "version",
+        "counter",
+        "left",
+        "top",
+        "width",
+        "height",
+        "serials",
+        "free",
+        "images",
+    ],
+)
+GroupState.__doc__ = """Saved contents of an EntityGroup (see EntityGroup.state())
+
+The arrays are stored as bytes. version and images are None when the
+state was read back from a file; restore() then redraws the images.
+"""
+
+
+def rect_round(value):
+    """Round a coordinate like pygame.Rect does with floats: halves away from 0"""
+    return int(value + 0.5) if value >= 0 else -int(-value + 0.5)
+
+
+def cells_for(left, top, right, bottom, size=CELL_SIZE):
+    """Grid cells covered by a box"""
+    x0 = left // size
+    x1 = (right - 1) // size
+    y0 = top // size
+    y1 = (bottom - 1) // size
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+class SpatialGroup(pygame.sprite.Group):
+    """Sprite group with a uniform grid index for collision queries
+
+    Sprites are bucketed by the grid cells their rect covers in world
+    coordinates when they are added, so a query only looks at the few
+    sprites sharing cells with the query rect instead of the whole group.
+    Members are assumed not to move; call reindex() if one does.
+    """
+
+    def __init__(self, *sprites, cell_size=CELL_SIZE):
+        """Initialize group"""
+        self.cell_size = cell_size
+        # Grid cell -> {sprite: insertion order}
+        self.cells = {}
+        # Sprite -> (insertion order, covered cells)
+        self.entries = {}
+        self.counter = 0
+        super().__init__(*sprites)
+
+    def cells_for(self, rect):
+        """Grid cells covered by a rect"""
+        return cells_for(rect.left, rect.top, rect.right, rect.bottom, self.cell_size)
+
+    def bounds(self, sprite):
+        """Area a sprite is indexed and queried by; its rect unless overridden"""
+        return sprite.rect
+
+    def add_internal(self, sprite, layer=None):
+        """Add a sprite and index its bounds"""
+        super().add_internal(sprite, layer)
+        self.counter += 1
+        cells = self.cells_for(self.bounds(sprite))
+        self.entries[sprite] = (self.counter, cells)
+        for cell in cells:
+            self.cells.setdefault(cell, {})[sprite] = self.counter
+
+    def remove_internal(self, sprite):
+        """Remove a sprite and drop it from the index"""
+        super().remove_internal(sprite)
+        entry = self.entries.pop(sprite, None)
+        if entry is None:
+            return
+        for cell in entry[1]:
+            bucket = self.cells[cell]
+            del bucket[sprite]
+            if not bucket:
+                del self.cells[cell]
+
+    def reindex(self, sprite):
+        """Update the index after a member sprite moved"""
+        self.remove_internal(sprite)
+        self.add_internal(sprite)
+
+    def query(self, rect):
+        """Sprites whose bounds collide with rect, in the order they were added"""
+        found = {}
+        for cell in self.cells_for(rect):
+            bucket = self.cells.get(cell)
+            if bucket:
+                found.update(bucket)
+        bounds = self.bounds
+        hits = [sprite for sprite in found if rect.colliderect(bounds(sprite))]
+        if len(hits) > 1:
+            hits.sort(key=found.__getitem__)
+        return hits
+
+    def spritecollide(self, sprite, dokill=False):
+        """Same as pygame.sprite.spritecollide against this group"""
+        hits = self.query(sprite.rect)
+        if dokill:
+            for hit in hits:
+                hit.kill()
+        return hits
+
+
+class Entity:
+    """View of one entity stored in an EntityGroup
+
+    Holds only its group, slot and serial number; the position and image
+    live in the group's arrays. A view of a removed entity stays valid but
+    is no longer alive(), even if its slot has been reused. Subclasses must
+    set surface and may set a default size.
+    """
+
+    __slots__ = ("group", "index", "serial")
+
+    # Size used when none is given to EntityGroup.add()
+    size = None
+
+    # Function of (width, height) returning the image for an entity of
+    # that size, usually a staticmethod; required
+    surface = None
+
+    def __init__(self, group, index, serial):
+        """Initialize view"""
+        self.group = group
+        self.index = index
+        self.serial = serial
+
+    @property
+    def rect(self):
+        """Copy of the entity's rect in world coordinates"""
+        group = self.group
+        i = self.index
+        return pygame.Rect(group.left[i], group.top[i], group.width[i], group.height[i])
+
+    @property
+    def image(self):
+        """The entity's shared image"""
+        return self.group.images[self.index]
+
+    def alive(self):
+        """Whether the entity is still in its group"""
+        return self.group.serials[self.index] == self.serial
+
+    def kill(self):
+        """Remove the entity from its group"""
+        if self.alive():
+            self.group.remove(self)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Entity)
+            and self.serial == other.serial
+            and self.group is other.group
+        )
+
+    def __hash__(self):
+        return hash((id(self.group), self.serial))
+
+
+class EntityGroup:
+    """Static entities of one type stored as parallel arrays
+
+    Each entity takes one slot in the left, top, width, height and serial
+    arrays plus a reference to its (shared) image, rather than a sprite
+    with its own dict and Rect. Slots of removed entities are reused.
+    Serial numbers grow with every add(), so sorting by serial gives the
+    order entities were added in; a free slot has serial 0.
+
+    Entities are indexed on a uniform grid like SpatialGroup and are
+    assumed not to move.
+    """
+
+    def __init__(self, entity_class, cell_size=CELL_SIZE):
+        """Initialize group of entity_class, an Entity subclass with a surface"""
+        if entity_class.surface is None:
+            raise TypeError(f"{entity_class.__name__} does not set surface")
+        self.entity_class = entity_class
+        self.cell_size = cell_size
+
+        self.left = array.array("i")
+        self.top = array.array("i")
+        self.width = array.array("i")
+        self.height = array.array("i")
+        self.serials = array.array("q")
+        self.images = []
+
+        # Free slots, and the number of entities in use
+        self.free = []
+        self.count = 0
+        self.counter = 0
+        # Changes on every add and remove, to spot changes cheaply
+        self.version = next(_versions)
+        # Last state() taken, shared until the group changes
+        self.saved_state = None
+
+        # Grid cell key (see _keys()) -> list of slots
+        self.cells = {}
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """Live entities in the order they were added"""
+        return iter(self.entities(self.live_slots()))
+
+    def live_slots(self):
+        """Slots in use, in the order their entities were added"""
+        serials = self.serials
+        slots = [i for i in range(len(serials)) if serials[i]]
+        slots.sort(key=serials.__getitem__)
+        return slots
+
+    def entities(self, slots):
+        """Views of the entities in slots"""
+        entity_class = self.entity_class
+        serials = self.serials
+        return [entity_class(self, i, serials[i]) for i in slots]
+
+    def add(self, x, y, width=None, height=None):
+        """Add an entity at (x, y) and return its view"""
+        if width is None:
+            width, height = self.entity_class.size
+        self.counter += 1
+        image = self.entity_class.surface(width, height)
+
+        if self.free:
+            i = self.free.pop()
+            self.left[i] = x
+            self.top[i] = y
+            self.width[i] = width
+            self.height[i] = height
+            self.serials[i] = self.counter
+            self.images[i] = image
+        else:
+            i = len(self.serials)
+            self.left.append(x)
+            self.top.append(y)
+            self.width.append(width)
+            self.height.append(height)
+            self.serials.append(self.counter)
+            self.images.append(image)
+        self.count += 1
+        self.version = next(_versions)
+
+        for key in self._keys(i):
+            self.cells.setdefault(key, []).append(i)
+        return self.entity_class(self, i, self.counter)
+
+    def remove(self, entity):
+        """Remove an entity, freeing its slot"""
+        i = entity.index
+        if self.serials[i] != entity.serial:
+            return
+        for key in self._keys(i):
+            bucket = self.cells[key]
+            bucket.remove(i)
+            if not bucket:
+                del self.cells[key]
+        self.serials[i] = 0
+        self.images[i] = None
+        self.free.append(i)
+        self.count -= 1
+        self.version = next(_versions)
+
+    def state(self):
+        """Immutable copy of the group's contents
+
+        Copies are only made when the group changed since the last call;
+        otherwise the same GroupState is returned, so saving a group that
+        has not changed is free.
+        """
+        saved = self.saved_state
+        if saved is None or saved.version != self.version:
+            saved = GroupState(
+                self.version,
+                self.counter,
+                self.left.tobytes(),
+                self.top.tobytes(),
+                self.width.tobytes(),
+                self.height.tobytes(),
+                self.serials.tobytes(),
+                tuple(self.free),
+                tuple(self.images),
+            )
+            self.saved_state = saved
+        return saved
+
+    def restore(self, state):
+        """Put the group back to a state() taken earlier
+
+        Does nothing if the group has not changed since.
+        """
+        if state.version is not None and state.version == self.version:
+            return
+
+        for name, typecode in (
+            ("left", "i"),
+            ("top", "i"),
+            ("width", "i"),
+            ("height", "i"),
+            ("serials", "q"),
+        ):
+            values = array.array(typecode)
+            values.frombytes(getattr(state, name))
+            setattr(self, name, values)
+
+        serials = self.serials
+        if state.images is None:
+            surface = self.entity_class.surface
+            self.images = [
+                surface(self.width[i], self.height[i]) if serials[i] else None
+                for i in range(len(serials))
+            ]
+        else:
+            self.images = list(state.images)
+
+        self.free = list(state.free)
+        self.count = len(serials) - len(self.free)
+        self.counter = state.counter
+        if state.version is None:
+            self.version = next(_versions)
+            self.saved_state = None
+        else:
+            self.version = state.version
+            self.saved_state = state
+
+        self.cells = {}
+        for i in range(len(serials)):
+            if serials[i]:
+                for key in self._keys(i):
+                    self.cells.setdefault(key, []).append(i)
+
+    def _keys(self, i):
+        """Grid cell keys covered by the entity in slot i"""
+        left = self.left[i]
+        top = self.top[i]
+        return self.cell_keys(left, top, left + self.width[i], top + self.height[i])
+
+    def cell_keys(self, left, top, right, bottom):
+        """Grid cells covered by a box, packed into ints
+
+        Cell (x, y) becomes x * 2**20 + y, which is smaller to keep as a
+        dict key than a tuple and unique for any y within a million cells.
+        """
+        size = self.cell_size
+        y0 = top // size
+        y1 = (bottom - 1) // size + 1
+        return [
+            (x << 20) + y
+            for x in range(left // size, (right - 1) // size + 1)
+            for y in range(y0, y1)
+        ]
+
+    def collide_slots(self, rect):
+        """Slots of entities colliding with rect, in the order they were added"""
+        left = rect.left
+        top = rect.top
+        right = rect.right
+        bottom = rect.bottom
+        if right <= left or bottom <= top:
+            return []
+
+        cells = self.cells
+        keys = self.cell_keys(left, top, right, bottom)
+        if len(keys) == 1:
+            found = cells.get(keys[0], ())
+        else:
+            # Entities spanning several cells are listed in each of them
+            found = set()
+            for key in keys:
+                bucket = cells.get(key)
+                if bucket:
+                    found.update(bucket)
+
+        lefts = self.left
+        tops = self.top
+        widths = self.width
+        heights = self.height
+        hits = [
+            i
+            for i in found
+            if lefts[i] < right
+            and lefts[i] + widths[i] > left
+            and tops[i] < bottom
+            and tops[i] + heights[i] > top
+        ]
+        if len(hits) > 1:
+            hits.sort(key=self.serials.__getitem__)
+        return hits
+
+    def boxes(self, rect):
+        """(left, top, right, bottom) of entities colliding with rect, in order"""
+        lefts = self.left
+        tops = self.top
+        widths = self.width
+        heights = self.height
+        return [
+            (lefts[i], tops[i], lefts[i] + widths[i], tops[i] + heights[i])
+            for i in self.collide_slots(rect)
+        ]
+
+    def query(self, rect):
+        """Entities colliding with rect, in the order they were added"""
+        return self.entities(self.collide_slots(rect))
+
+    def spritecollide(self, sprite, dokill=False):
+        """Same as pygame.sprite.spritecollide against this group"""
+        hits = self.query(sprite.rect)
+        if dokill:
+            for hit in hits:
+                self.remove(hit)
+        return hits
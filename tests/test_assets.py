@@ -0,0 +1,63 @@
+"""The shared asset cache: loading, references, eviction and forking"""
+
+import gc
+import multiprocessing
+import os
+
+import pytest
+
+from assets import ASSET_DIR, ASSETS, AssetManager
+
+
+def _load_in_child(name):
+    """Bytes of an asset loaded through ASSETS, in a worker process"""
+    return len(ASSETS.acquire(name, "music"))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_child_can_load():
+    # The loading thread has started in the parent
+    ASSETS.load("preview.png", "music").result()
+
+    context = multiprocessing.get_context("fork")
+    with context.Pool(1) as pool:
+        # Never loaded in the parent, so the child has to load it itself
+        size = pool.apply_async(_load_in_child, ("blob.png",)).get(timeout=30)
+    assert size == os.path.getsize(os.path.join(ASSET_DIR, "blob.png"))
+
+
+def test_released_assets_are_evicted_least_recently_used_first():
+    manager = AssetManager(capacity=1)
+    first = manager.acquire("blob.png", "music")
+    assert first == manager.acquire("blob.png", "music")
+    assert manager.references[("music", "blob.png")] == 2
+
+    # Held assets are never evicted
+    manager.load("preview.png", "music").result()
+    manager.load("green_forest.png", "music").result()
+    assert ("music", "blob.png") in manager.futures
+    assert ("music", "preview.png") not in manager.futures
+
+    manager.release("blob.png", "music")
+    manager.release("blob.png", "music")
+    assert ("music", "blob.png") not in manager.references
+    # Now unused and just used, so the other unused asset makes way
+    assert ("music", "blob.png") in manager.futures
+    assert ("music", "green_forest.png") not in manager.futures
+
+    # Used again, it is loaded again
+    assert manager.acquire("green_forest.png", "music")
+    assert ("music", "blob.png") not in manager.futures
+
+
+def test_levels_release_their_background():
+    import main
+
+    key = ("image", main.BACKGROUND)
+    before = ASSETS.references[key]
+    levels = [main.Level(None) for _ in range(3)]
+    assert ASSETS.references[key] == before + 3
+
+    del levels
+    gc.collect()
+    assert ASSETS.references[key] == before
@@ -0,0 +1,46 @@
+"""Sound effects and music, under SDL's dummy audio driver"""
+
+import pygame
+import pytest
+
+import audio
+
+
+@pytest.fixture
+def engine():
+    pygame.mixer.init()
+    yield audio.AudioEngine()
+    pygame.mixer.quit()
+
+
+def sounds(engine):
+    """Name of the effect last played on each channel"""
+    names = {sound: name for name, sound in engine.sounds.items()}
+    return [names.get(channel.get_sound()) for channel in engine.channels]
+
+
+def test_builds_every_effect(engine):
+    assert sorted(engine.sounds) == sorted(audio.EFFECTS)
+    assert len(engine.channels) == audio.CHANNELS
+    assert not any(channel.get_busy() for channel in engine.channels)
+
+
+def test_steals_oldest_sound_of_same_or_lower_priority(engine):
+    for _ in range(audio.CHANNELS):
+        assert engine.play("coin")
+    assert all(channel.get_busy() for channel in engine.channels)
+
+    # Equal priority takes the oldest channel, higher the next oldest
+    assert engine.play("coin")
+    assert engine.play("spike")
+    assert sounds(engine) == ["coin", "spike"] + ["coin"] * (audio.CHANNELS - 2)
+    assert engine.started[:3] == [audio.CHANNELS + 1, audio.CHANNELS + 2, 3]
+
+
+def test_never_cuts_off_more_important_sound(engine):
+    for _ in range(audio.CHANNELS):
+        assert engine.play("lava")
+
+    assert not engine.play("jump")
+    assert not engine.play("coin")
+    assert sounds(engine) == ["lava"] * audio.CHANNELS
@@ -0,0 +1,62 @@
+"""Batch physics keeps to the rules of the Player it stands in for"""
+
+import random
+
+import pytest
+
+from main import LEVEL_FILES, SCREEN_HEIGHT, Level, Player
+
+np = pytest.importorskip("numpy")
+batch_physics = pytest.importorskip("batch_physics")
+
+# Bodies run side by side with Players in each test
+BODIES = 10
+
+
+def players(path, seed):
+    """Players at the spawn point, each in its own copy of a level"""
+    result = []
+    for _ in range(BODIES):
+        player = Player()
+        player.level = Level.from_file(path, player, random.Random(seed))
+        player.rect.x = 240
+        player.rect.y = SCREEN_HEIGHT - player.rect.height
+        result.append(player)
+    return result
+
+
+# The level files without enemies, which bodies leave out
+@pytest.mark.parametrize("level_no", [0, 1, 3])
+@pytest.mark.parametrize("seed", range(2))
+def test_bodies_move_like_players(level_no, seed):
+    group = players(LEVEL_FILES[level_no], seed)
+    assert not len(group[0].level.enemy_list)
+    batch = batch_physics.BodyBatch(group[0].level, BODIES)
+    rng = np.random.default_rng(seed)
+
+    for tick in range(1200):
+        move = rng.choice([-1, 0, 1, 1], BODIES)
+        jump = rng.random(BODIES) < 0.08
+        batch.step(move, jump)
+
+        for body, player in enumerate(group):
+            # Players that have lost or won stop, like done bodies
+            if player.life <= 0 or player.score >= 6:
+                continue
+            if move[body] < 0:
+                player.go_left()
+            elif move[body] > 0:
+                player.go_right()
+            else:
+                player.stop()
+            if jump[body]:
+                player.jump()
+            player.update()
+            player.level.update()
+
+        expected = [
+            (player.rect.x, player.rect.y, player.change_y, player.life, player.score)
+            for player in group
+        ]
+        bodies = zip(batch.x, batch.y, batch.change_y, batch.life, batch.score)
+        assert [tuple(body) for body in bodies] == expected, f"tick {tick}"
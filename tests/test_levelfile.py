@@ -0,0 +1,28 @@
+"""Level files and their compiled caches"""
+
+import concurrent.futures
+import os
+
+import levelfile
+from main import LEVEL_FILES
+
+
+def test_concurrent_compiles_publish_whole_caches(tmp_path):
+    path = LEVEL_FILES[2]
+    level = levelfile.parse(path)
+    stat = os.stat(path)
+    cache = str(tmp_path / "level.bin")
+
+    def compile_and_read(_):
+        levelfile.compile_level(level, stat, cache)
+        return levelfile.read_cache(cache, stat)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(compile_and_read, range(64)))
+
+    for cached in results:
+        assert cached is not None
+        assert list(cached.platforms) == list(level.platforms)
+        assert list(cached.enemies) == list(level.enemies)
+    # No temporary files left behind
+    assert os.listdir(tmp_path) == ["level.bin"]
@@ -0,0 +1,160 @@
+"""Network play over a real loopback socket, with packets dropped on purpose"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import net
+import replay
+from main import Inputs
+
+
+def connect(seed):
+    """Server and a client connected to it"""
+    server = net.Server(port=0, seed=seed)
+    return server, join(server)
+
+
+def join(server):
+    """Client connected to a server"""
+    connected = threading.Event()
+
+    def answer():
+        # Answer the client's hello while it waits for the welcome
+        while not connected.is_set():
+            server.receive(time.perf_counter())
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=answer)
+    thread.start()
+    try:
+        return net.Client(server.address)
+    finally:
+        connected.set()
+        thread.join()
+
+
+def drop_packets(server):
+    """Throw away every packet waiting for the server, as if lost"""
+    while True:
+        try:
+            server.socket.recvfrom(net.MAX_PACKET)
+        except BlockingIOError:
+            return
+
+
+def play(server, client, ticks, lose=False):
+    """Run client and server side by side for some ticks"""
+    for tick in range(ticks):
+        client.step(Inputs(1 if tick % 50 < 40 else 0, tick % 30 == 0, True))
+        if lose:
+            drop_packets(server)
+        server.update(time.perf_counter())
+        client.receive()
+
+
+def test_catches_up_after_long_loss_burst():
+    server, client = connect(seed=7)
+    try:
+        play(server, client, 300)
+        (session,) = server.sessions.values()
+        assert session.ack == 300
+
+        # Far more lost packets than the old resend window of 16
+        play(server, client, 30, lose=True)
+        assert session.ack == 300
+        play(server, client, 200)
+
+        assert session.ack == client.seq == 530
+        assert not session.pending
+        # Only inputs sent since the last snapshot are left unconfirmed
+        assert len(client.unacked) < net.SNAPSHOT_INTERVAL * 2
+        assert net.game_state(client.simulation) == net.game_state(session.simulation)
+    finally:
+        client.close()
+        server.close()
+
+
+def test_inputs_far_ahead_are_not_queued():
+    server, client = connect(seed=1)
+    try:
+        (session,) = server.sessions.values()
+        inputs = [Inputs(0, False, False)] * 3
+        session.receive_inputs(0, net.MAX_INPUTS, inputs)
+        assert sorted(session.pending) == [net.MAX_INPUTS]
+    finally:
+        client.close()
+        server.close()
+
+
+def test_hellos_beyond_max_sessions_are_refused():
+    server = net.Server(port=0, max_sessions=1)
+    client = join(server)
+    try:
+        with pytest.raises(ConnectionError, match="full"):
+            join(server)
+        assert list(server.sessions) == [client.socket.getsockname()]
+    finally:
+        client.close()
+        server.close()
+
+
+def test_negative_seed():
+    server, client = connect(seed=-7)
+    try:
+        assert client.simulation.seed == -7
+    finally:
+        client.close()
+        server.close()
+
+
+def test_client_gives_up_on_a_silent_server():
+    server, client = connect(seed=3)
+    try:
+        play(server, client, 10)
+        client.last_heard -= net.TIMEOUT
+        # Nothing from the server since
+        client.step(Inputs(0, False, False))
+        with pytest.raises(ConnectionError):
+            client.receive()
+    finally:
+        client.close()
+        server.close()
+
+
+# Plays on a server that goes away after a second, recording the session
+LOSE_SERVER = """
+import sys
+
+import main
+import net
+
+net.TIMEOUT = 0.5
+main.main(["--connect", sys.argv[1], "--record", sys.argv[2]])
+"""
+
+
+def test_game_shuts_down_when_the_server_goes_away(tmp_path):
+    server = net.Server(port=0, seed=5)
+    try:
+        root = os.path.dirname(os.path.abspath(net.__file__))
+        path = str(tmp_path / "session.rpl")
+        address = "%s:%d" % server.address
+        game = subprocess.Popen(
+            [sys.executable, "-c", LOSE_SERVER, address, path], cwd=root
+        )
+        deadline = time.perf_counter() + 1
+        while time.perf_counter() < deadline:
+            server.update(time.perf_counter())
+            time.sleep(net.TIMESTEP)
+    finally:
+        server.close()
+    assert game.wait(timeout=30) == 0
+
+    seed, inputs = replay.load(path)
+    assert seed == 5
+    assert inputs
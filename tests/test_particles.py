@@ -0,0 +1,58 @@
+"""Particle effects, which are only for show and need NumPy"""
+
+import os
+import subprocess
+import sys
+
+import pygame
+import pytest
+
+import main
+
+# Hides NumPy, then draws some frames of a game with effects
+WITHOUT_NUMPY = """
+import sys
+sys.modules["numpy"] = None
+
+import pygame
+import main
+
+pygame.init()
+screen = pygame.display.set_mode((main.SCREEN_WIDTH, main.SCREEN_HEIGHT))
+renderer = main.Renderer(screen, pygame.font.Font(None, 36), dirty_rects=True)
+assert renderer.particles is None
+simulation = main.Simulation(1)
+for tick in range(200):
+    simulation.step(main.Inputs(1, tick % 20 == 0, False))
+    renderer.draw(simulation)
+"""
+
+
+def test_game_runs_without_numpy():
+    # A fresh interpreter, as NumPy is already loaded in this one
+    root = os.path.dirname(os.path.abspath(main.__file__))
+    subprocess.run([sys.executable, "-c", WITHOUT_NUMPY], cwd=root, check=True)
+
+
+def burst_frame(depth):
+    """Screen-sized surface of some depth with a lava burst drawn on it"""
+    from particles import BURSTS, ParticleSystem
+
+    surface = pygame.Surface((main.SCREEN_WIDTH, main.SCREEN_HEIGHT), 0, depth)
+    surface.fill((0, 0, 64))
+    particles = ParticleSystem(seed=4)
+    particles.emit(400, 300, BURSTS["lava"])
+    for _ in range(10):
+        particles.step()
+    particles.project(0, surface.get_size())
+    particles.draw(surface)
+    return surface
+
+
+@pytest.mark.parametrize("depth", [16, 24])
+def test_draws_on_other_depths_like_on_32_bits(depth):
+    pytest.importorskip("numpy")
+    expected = pygame.Surface((main.SCREEN_WIDTH, main.SCREEN_HEIGHT), 0, depth)
+    expected.blit(burst_frame(32), (0, 0))
+    surface = burst_frame(depth)
+    assert pygame.image.tobytes(surface, "RGB") == pygame.image.tobytes(expected, "RGB")
@@ -0,0 +1,102 @@
+"""Player movement and collisions with platforms"""
+
+import random
+
+import pygame
+import pytest
+
+from procgen import PLATFORM_HEIGHT
+from main import LEVEL_FILES, SCREEN_HEIGHT, Inputs, Level, Player, Simulation
+
+
+def player_in_level(*platforms):
+    """Player in an empty level with platforms (x, y, width, height)"""
+    player = Player()
+    level = Level(player)
+    for x, y, width, height in platforms:
+        level.platform_list.add(x, y, width, height)
+    player.level = level
+    return player
+
+
+def test_fast_fall_lands_on_thin_platform():
+    player = player_in_level((100, 300, 200, 30))
+    player.rect.midbottom = (200, 250)
+    # Would pass the whole platform in one tick without sweeping
+    player.change_y = 120
+
+    player.update()
+    assert player.rect.bottom == 300
+    assert player.change_y == 0
+    assert player.air_ticks == 0
+
+
+def test_fast_jump_stops_under_thin_platform():
+    player = player_in_level((100, 300, 200, 30))
+    player.rect.midtop = (200, 380)
+    player.change_y = -120
+
+    player.update()
+    assert player.rect.top == 330
+    assert player.change_y == 0
+
+
+@pytest.mark.parametrize("change_x", [120, -120])
+def test_fast_run_stops_at_thin_wall(change_x):
+    wall = pygame.Rect(300, SCREEN_HEIGHT - 200, 30, 200)
+    player = player_in_level(wall)
+    player.rect.bottom = SCREEN_HEIGHT
+    player.rect.right = wall.left - 20
+    if change_x < 0:
+        player.rect.left = wall.right + 20
+    player.change_x = change_x
+
+    player.update()
+    if change_x > 0:
+        assert player.rect.right == wall.left
+    else:
+        assert player.rect.left == wall.right
+
+
+def trace(seed, ticks, sweep):
+    """Player states over a random run, with or without sweeping"""
+    rng = random.Random(seed)
+    simulation = Simulation(seed, prefetch=False)
+    # A different level for each seed, with lives to play it for long
+    simulation.current_level_no = seed % len(LEVEL_FILES)
+    simulation.current_level = simulation.level_list[simulation.current_level_no]
+    simulation.player.level = simulation.current_level
+    simulation.player.life = 1000
+    if not sweep:
+        # Move the whole way and only push out afterwards, as before
+        simulation.player.sweep_x = simulation.player.sweep_y = lambda d: d
+    states = []
+    for _ in range(ticks):
+        # Falls into the lava again and again build up speeds that do skip
+        # over platforms without sweeping
+        player = simulation.player
+        if abs(player.change_y) >= PLATFORM_HEIGHT + player.rect.height:
+            break
+        move = rng.choice([-1, 0, 1, 1, 1])
+        simulation.step(Inputs(move, rng.random() < 0.1, False))
+        states.append(
+            (
+                simulation.current_level_no,
+                tuple(player.rect),
+                player.change_x,
+                player.change_y,
+                player.life,
+                player.score,
+            )
+        )
+    return states
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_sweeping_changes_nothing_at_game_speeds(seed):
+    # A player moving less than its height plus a platform's thickness per
+    # tick can never get past a platform, so sweeping must give the same
+    # game as resolving overlaps after moving
+    states = trace(seed, 3000, sweep=True)
+    assert len(states) > 500
+    assert states == trace(seed, 3000, sweep=False)
@@ -0,0 +1,41 @@
+"""The endless level's chunks stay within the player's jump"""
+
+import pytest
+
+import procgen
+from main import GRAVITY, JUMP_SPEED, PLAYER_SPEED, Level, Player
+
+PHYSICS = (JUMP_SPEED, GRAVITY, PLAYER_SPEED)
+
+# Top of the platform the player jumps from
+GROUND = procgen.MAX_Y
+
+
+@pytest.mark.parametrize("seed", [0, 1, -1, 12345, 2**40, -(2**40)])
+def test_every_chunk_is_reachable(seed):
+    generator = procgen.ChunkGenerator(seed, *PHYSICS)
+    # chunk() raises ValueError on a jump the player cannot make
+    for index in range(-100, 400):
+        chunk = generator.chunk(index)
+        assert chunk.platforms[0][3] == generator.anchor(index)
+        for width, height, x, y in chunk.platforms:
+            assert procgen.MIN_Y <= y <= procgen.MAX_Y
+            assert procgen.PLATFORM_WIDTHS[0] <= width <= procgen.PLATFORM_WIDTHS[1]
+
+
+def test_jump_arc_follows_the_player():
+    # The reachability check is only as good as its model of a jump
+    player = Player()
+    player.level = Level(player)
+    player.level.platform_list.add(0, GROUND, 2000, procgen.PLATFORM_HEIGHT)
+    player.rect.bottom = GROUND
+    start = player.rect.x
+    player.go_right()
+    player.jump()
+
+    arc = []
+    for _ in procgen.jump_arc(*PHYSICS):
+        player.update()
+        arc.append((player.rect.x - start, GROUND - player.rect.bottom))
+    assert arc == list(procgen.jump_arc(*PHYSICS))
+    assert len(arc) > 10
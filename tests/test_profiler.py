@@ -0,0 +1,45 @@
+"""Frame profiling and its overlay"""
+
+import pygame
+
+import profiler
+
+
+def profiled_frames(frames, phases=10):
+    """Profiler that has timed some frames of several phases"""
+    frame_profiler = profiler.FrameProfiler()
+    for _ in range(frames):
+        frame_profiler.start_frame()
+        for phase in range(phases):
+            with frame_profiler.phase(f"phase{phase}"):
+                pass
+        frame_profiler.end_frame()
+    return frame_profiler
+
+
+def test_percentiles_are_nearest_rank():
+    frame_profiler = profiler.FrameProfiler()
+    for value in range(1, 101):
+        frame_profiler.frames.append({"frame": value / 1000})
+    assert frame_profiler.percentiles() == {50: 0.05, 95: 0.095, 99: 0.099}
+    assert profiler.percentiles([3, 1, 2], (1, 50, 100)) == {1: 1, 50: 2, 100: 3}
+    assert profiler.percentiles([]) == {50: 0.0, 95: 0.0, 99: 0.0}
+
+
+def test_overlay_is_only_rendered_a_few_times_a_second():
+    screen = pygame.Surface((800, 600))
+    pygame.font.init()
+    font = pygame.font.Font(None, 20)
+    frame_profiler = profiled_frames(600)
+
+    rect = frame_profiler.draw(screen, font)
+    assert rect.topright == (800, 0)
+    overlay = frame_profiler.overlay
+    # The next frame comes too soon for new numbers
+    assert frame_profiler.draw(screen, font) == rect
+    assert frame_profiler.overlay is overlay
+
+    # Later, they are worked out again
+    frame_profiler.overlay_time -= profiler.OVERLAY_REFRESH
+    frame_profiler.draw(screen, font)
+    assert frame_profiler.overlay is not overlay
@@ -0,0 +1,48 @@
+"""Restoring snapshots puts a game back exactly"""
+
+import random
+
+import snapshot
+from main import LEVEL_FILES, Inputs, Simulation
+
+
+def endless(seed):
+    """Simulation dropped straight into the endless level"""
+    simulation = Simulation(seed, prefetch=False)
+    simulation.current_level_no = len(LEVEL_FILES)
+    simulation.current_level = simulation.level_list[simulation.current_level_no]
+    simulation.player.level = simulation.current_level
+    # Enough lives to keep going through the whole run
+    simulation.player.life = 1000
+    return simulation
+
+
+def play(simulation, inputs):
+    """Enemy states after each tick of inputs"""
+    states = []
+    for tick_inputs in inputs:
+        simulation.step(tick_inputs)
+        level = simulation.current_level
+        states.append(sorted(enemy.state() for enemy in level.enemy_list))
+    return states
+
+
+def test_restore_is_exact_with_enemies():
+    rng = random.Random(3)
+    inputs = [
+        Inputs(rng.choice([-1, 0, 1, 1, 1]), rng.random() < 0.1, False)
+        for _ in range(2500)
+    ]
+    simulation = endless(5)
+    # Far enough that chunks, and their enemies, have been dropped
+    play(simulation, inputs[:2000])
+    saved = snapshot.capture(simulation)
+    expected = play(simulation, inputs[2000:])
+    assert any(expected)
+
+    snapshot.restore(simulation, saved)
+    assert play(simulation, inputs[2000:]) == expected
+
+    # Through bytes too
+    snapshot.restore(simulation, snapshot.from_bytes(snapshot.to_bytes(saved)))
+    assert play(simulation, inputs[2000:]) == expected